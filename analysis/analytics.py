@@ -0,0 +1,190 @@
+"""
+================================================================================
+Description: This script contains the vectorized analytics of the hamsterwheel
+             data used by hamsterwheel_analysis.ipynb and scheduled jobs. All
+             functions work on NumPy arrays of int64 timestamps in nanoseconds
+             and uint8 pin states (0 if the reed sensor is closed).
+================================================================================
+"""
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+SECOND_NS = 1_000_000_000
+MINUTE_NS = 60 * SECOND_NS
+HOUR_NS = 60 * MINUTE_NS
+DAY_NS = 24 * HOUR_NS
+
+
+def convert_timestamps(timestamps: Iterable[str]) -> np.ndarray:
+    """Function to convert 'YYYY-MM-DD HH:MM:SS[.ffffff]' strings to nanoseconds.
+
+    Replaces `pd.to_datetime(..., infer_datetime_format=True)` with one
+    vectorized conversion of a fixed format.
+
+    Args:
+        timestamps: Timestamp strings.
+
+    Returns:
+        Timestamps in nanoseconds since the epoch (int64).
+    """
+    return np.asarray(timestamps, dtype='U32').astype('datetime64[ns]').astype(np.int64)
+
+
+def sort_by_time(timestamps_ns: np.ndarray, states: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to sort readings by time.
+
+    Args:
+        timestamps_ns: Timestamps in nanoseconds.
+        states: Pin states.
+
+    Returns:
+        Tuple of the sorted timestamps and pin states.
+    """
+    order = np.argsort(timestamps_ns, kind='stable')
+    return timestamps_ns[order], states[order]
+
+
+def detect_edges(states: np.ndarray) -> np.ndarray:
+    """Function to find the readings at which the pin state changes.
+
+    Args:
+        states: Pin states sorted by time.
+
+    Returns:
+        Indices of the readings with a state different from the previous reading.
+    """
+    return np.flatnonzero(np.diff(states.astype(np.int8))) + 1
+
+
+def closures(timestamps_ns: np.ndarray, states: np.ndarray) -> np.ndarray:
+    """Function to find the closures of the reed sensor, one per rotation.
+
+    Args:
+        timestamps_ns: Timestamps in nanoseconds sorted by time.
+        states: Pin states sorted by time.
+
+    Returns:
+        Timestamps in nanoseconds of the readings where the state changes from 1 to 0.
+    """
+    falling = np.flatnonzero(np.diff(states.astype(np.int8)) < 0) + 1
+    return timestamps_ns[falling]
+
+
+def count_rotations(states: np.ndarray) -> int:
+    """Function to count the rotations.
+
+    Args:
+        states: Pin states sorted by time.
+
+    Returns:
+        Number of changes of the pin state from 1 to 0.
+    """
+    return int(np.count_nonzero(np.diff(states.astype(np.int8)) < 0))
+
+
+def rpm(closure_ns: np.ndarray) -> np.ndarray:
+    """Function to compute the RPM from the time between consecutive closures.
+
+    Args:
+        closure_ns: Timestamps of the closures in nanoseconds, see `closures`.
+
+    Returns:
+        RPM at every closure after the first one (float64).
+    """
+    intervals = np.diff(closure_ns)
+    return 60 * SECOND_NS / np.maximum(intervals, 1)
+
+
+def resample(
+    timestamps_ns: np.ndarray,
+    states: np.ndarray,
+    bin_ns: int,
+    start_ns: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Function to aggregate readings into bins of equal length.
+
+    Args:
+        timestamps_ns: Timestamps in nanoseconds sorted by time.
+        states: Pin states sorted by time.
+        bin_ns: Length of a bin in nanoseconds, e.g. `MINUTE_NS`.
+        start_ns: Start of the first bin. Defaults to the first timestamp
+            rounded down to a multiple of `bin_ns`.
+
+    Returns:
+        Tuple of the bin starts in nanoseconds, the rotations per bin and the
+        fraction of readings per bin with the reed sensor closed (NaN for bins
+        without readings).
+    """
+    if len(timestamps_ns) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    if start_ns is None:
+        start_ns = int(timestamps_ns[0]) - int(timestamps_ns[0]) % bin_ns
+    bins = (timestamps_ns - start_ns) // bin_ns
+    n_bins = int(bins[-1]) + 1
+    readings = np.bincount(bins, minlength=n_bins)
+    closed = np.bincount(bins, weights=(states == 0), minlength=n_bins)
+    rotations = np.bincount((closures(timestamps_ns, states) - start_ns) // bin_ns, minlength=n_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        closed_fraction = closed / readings
+    starts = start_ns + np.arange(n_bins, dtype=np.int64) * bin_ns
+    return starts, rotations.astype(np.int64), closed_fraction
+
+
+def activity_sessions(
+    closure_ns: np.ndarray,
+    idle_timeout_ns: int = 30 * SECOND_NS,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Function to split the closures into run sessions.
+
+    A session ends once there is no closure for `idle_timeout_ns`.
+
+    Args:
+        closure_ns: Timestamps of the closures in nanoseconds, see `closures`.
+        idle_timeout_ns: Time without closure which ends a session.
+
+    Returns:
+        Tuple of the session starts and ends in nanoseconds and the rotations
+        per session.
+    """
+    if len(closure_ns) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(closure_ns) > idle_timeout_ns) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks - 1, [len(closure_ns) - 1]))
+    return closure_ns[first], closure_ns[last], (last - first + 1).astype(np.int64)
+
+
+def nightly_totals(
+    closure_ns: np.ndarray,
+    night_start_hour: int = 18,
+    idle_timeout_ns: int = 30 * SECOND_NS,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Function to compute the totals per night.
+
+    A night runs from `night_start_hour` to the same hour on the next day and
+    is labelled with the date it starts on.
+
+    Args:
+        closure_ns: Timestamps of the closures in nanoseconds, see `closures`.
+        night_start_hour: Hour of the day at which a night starts.
+        idle_timeout_ns: Time without closure which ends a session, used for
+            the active time.
+
+    Returns:
+        Tuple of the nights (datetime64[D]), the rotations per night and the
+        active time per night in seconds.
+    """
+    if len(closure_ns) == 0:
+        return np.empty(0, dtype='datetime64[D]'), np.empty(0, dtype=np.int64), np.empty(0)
+    nights = (closure_ns - night_start_hour * HOUR_NS) // DAY_NS
+    first_night = int(nights[0])
+    index = nights - first_night
+    rotations = np.bincount(index)
+
+    starts, ends, _ = activity_sessions(closure_ns=closure_ns, idle_timeout_ns=idle_timeout_ns)
+    session_nights = (starts - night_start_hour * HOUR_NS) // DAY_NS - first_night
+    active = np.bincount(session_nights, weights=(ends - starts) / SECOND_NS, minlength=len(rotations))
+
+    labels = (first_night + np.arange(len(rotations))).astype('datetime64[D]')
+    return labels, rotations.astype(np.int64), active
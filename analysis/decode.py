@@ -0,0 +1,234 @@
+"""
+================================================================================
+Description: This script contains the decoders of the MQTT payloads published
+             by the readout daemon, see src/python/payload.py for the schema.
+             Version 2 batches are decoded into arrays without parsing the
+             fields of single readings.
+
+             Version 1 timestamps were written with a 12-hour clock without
+             AM/PM ('%I'), so afternoon readings decode 12 hours early. See
+             `repair_12_hour_clock`.
+================================================================================
+"""
+import json
+import re
+import struct
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from analytics import DAY_NS, HOUR_NS, convert_timestamps
+
+SCHEMA_VERSION = 2
+# Layout of the binary encoding, must match src/python/payload.py
+BINARY_HEADER = struct.Struct('<BBHIIq')
+FLAG_WHEEL = 0x1
+FLAG_DURATIONS = 0x2
+STATE_PIN = 0x1
+STATE_KEEPALIVE = 0x2
+STATE_EDGE = 0x4
+DURATION_UNKNOWN = 0xFFFFFFFF
+
+# Largest step back in time of version 1 readings which is not taken for noon
+_CLOCK_TOLERANCE_NS = HOUR_NS
+# Fields of a version 1 message
+_TIMESTAMP = re.compile(rb'"Timestamp"\s*:\s*"([^"]+)"')
+_MESSAGE = re.compile(rb'"Message"\s*:\s*"([01])"')
+_WHEEL_ID = re.compile(rb'"WheelId"\s*:\s*"([^"]*)"')
+
+
+class Batch(NamedTuple):
+    """Decoded readings of a version 2 payload.
+
+    Attributes:
+        device_id: ID of the device.
+        wheel_id: ID of the wheel, None if the payload has none.
+        boot_id: ID of the start of the daemon which sent the batch.
+        seq: Sequence number of the batch. Restarts at 0 with every `boot_id`.
+        timestamps_ns: Epoch timestamps in nanoseconds (int64).
+        states: Pin states (uint8).
+        keepalive: True for keep-alive readings (bool).
+        edge: True for readings at which the state changed (bool).
+        durations: Durations in seconds of the previous state (float64), NaN if
+            unknown.
+    """
+    device_id: str
+    wheel_id: Optional[str]
+    boot_id: int
+    seq: int
+    timestamps_ns: np.ndarray
+    states: np.ndarray
+    keepalive: np.ndarray
+    edge: np.ndarray
+    durations: np.ndarray
+
+
+def decode_json(payload: bytes) -> Batch:
+    """Function to decode a version 2 JSON payload.
+
+    Args:
+        payload: JSON payload.
+
+    Returns:
+        Decoded batch.
+    """
+    batch = json.loads(payload)
+    offsets_ms = np.asarray(batch['dt'], dtype=np.int64)
+    keepalive = np.zeros(len(offsets_ms), dtype=bool)
+    keepalive[batch.get('k', [])] = True
+    edge = np.zeros(len(offsets_ms), dtype=bool)
+    edge[batch.get('e', [])] = True
+    durations = np.full(len(offsets_ms), np.nan)
+    if 'd' in batch:
+        durations = np.array([np.nan if d is None else d / 1000 for d in batch['d']], dtype=np.float64)
+    return Batch(
+        device_id=batch['dev'],
+        wheel_id=batch.get('wheel'),
+        boot_id=batch.get('boot', 0),
+        seq=batch['seq'],
+        timestamps_ns=(batch['t0'] + offsets_ms) * 1_000_000,
+        states=np.asarray(batch['s'], dtype=np.uint8),
+        keepalive=keepalive,
+        edge=edge,
+        durations=durations,
+    )
+
+
+def decode_binary(payload: bytes) -> Batch:
+    """Function to decode a version 2 binary payload.
+
+    Args:
+        payload: Binary payload.
+
+    Returns:
+        Decoded batch.
+
+    Raises:
+        ValueError if the payload is not a version 2 binary payload.
+    """
+    version, flags, count, boot_id, seq, t0 = BINARY_HEADER.unpack_from(payload)
+    if version != SCHEMA_VERSION:
+        raise ValueError(f'Binary payload version {version} is not supported.')
+    offset = BINARY_HEADER.size
+    strings: List[Optional[str]] = []
+    for _ in range(2 if flags & FLAG_WHEEL else 1):
+        length = payload[offset]
+        strings.append(payload[offset + 1:offset + 1 + length].decode())
+        offset += 1 + length
+    offsets_ms = np.frombuffer(payload, dtype='<i4', count=count, offset=offset).astype(np.int64)
+    offset += 4 * count
+    flags_states = np.frombuffer(payload, dtype=np.uint8, count=count, offset=offset)
+    offset += count
+    durations = np.full(count, np.nan)
+    if flags & FLAG_DURATIONS:
+        durations_ms = np.frombuffer(payload, dtype='<u4', count=count, offset=offset)
+        durations = np.where(durations_ms == DURATION_UNKNOWN, np.nan, durations_ms / 1000)
+    return Batch(
+        device_id=strings[0],
+        wheel_id=strings[1] if len(strings) > 1 else None,
+        boot_id=boot_id,
+        seq=seq,
+        timestamps_ns=(t0 + offsets_ms) * 1_000_000,
+        states=flags_states & STATE_PIN,
+        keepalive=(flags_states & STATE_KEEPALIVE) > 0,
+        edge=(flags_states & STATE_EDGE) > 0,
+        durations=durations,
+    )
+
+
+def repair_12_hour_clock(timestamps_ns: np.ndarray) -> np.ndarray:
+    """Function to restore the afternoon of version 1 timestamps.
+
+    Version 1 timestamps have hours 1 to 12 without AM/PM, so the readings
+    from 12:00 until midnight decode 12 hours early, and those from midnight
+    until 1:00 12 hours late. Taken in the order the messages were sent, the
+    afternoon of a day starts where the time steps back by more than an hour
+    within the day. The readings from there until the end of the day are
+    moved by 12 hours. A day with only afternoon readings cannot be told
+    apart and stays 12 hours early. Days with hours of 0 or 13 to 23 were
+    written with a 24-hour clock and are kept.
+
+    Args:
+        timestamps_ns: Version 1 timestamps in nanoseconds in the order the
+            messages were sent.
+
+    Returns:
+        Repaired timestamps in nanoseconds.
+    """
+    if len(timestamps_ns) == 0:
+        return timestamps_ns
+    hours = timestamps_ns // HOUR_NS % 24
+    days = timestamps_ns // DAY_NS
+    # Hour 12 is the first hour of the morning or of the afternoon
+    morning_ns = np.where(hours == 12, timestamps_ns - 12 * HOUR_NS, timestamps_ns)
+    new_day = np.ones(len(days), dtype=bool)
+    new_day[1:] = days[1:] != days[:-1]
+    step_back = np.zeros(len(days), dtype=bool)
+    step_back[1:] = (np.diff(morning_ns) < -_CLOCK_TOLERANCE_NS) & ~new_day[1:]
+    steps = np.cumsum(step_back)
+    afternoon = steps > steps[np.flatnonzero(new_day)][np.cumsum(new_day) - 1]
+    clock_24 = np.isin(days, days[(hours == 0) | (hours > 12)])
+    repaired_ns = np.where(afternoon, morning_ns + 12 * HOUR_NS, morning_ns)
+    return np.where(clock_24, timestamps_ns, repaired_ns)
+
+
+def decode_payloads(
+    payloads: Iterable[bytes],
+    wheel_id: Optional[str] = None,
+    repair_12_hour: bool = False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to decode payloads of all schema versions into typed arrays.
+
+    Version 1 timestamps are the wall-clock time of the device, taken as if
+    they were UTC; version 2 timestamps are UTC. All version 1 timestamps are
+    converted in one vectorized call. They have a 12-hour clock without AM/PM,
+    so afternoon readings are 12 hours early unless `repair_12_hour` is set.
+    Payloads which are not pin state messages are skipped.
+
+    Args:
+        payloads: Payloads, e.g. the contents of the downloaded message files.
+        wheel_id: If set, only the readings of this wheel are kept, of version 1
+            messages by their "WheelId". Version 1 messages without a
+            "WheelId" are dropped then. Defaults to None, which keeps the
+            readings of all wheels; pass it for multi-wheel data.
+        repair_12_hour: If True, the version 1 timestamps are repaired with
+            `repair_12_hour_clock`. Requires the payloads of whole days in the
+            order they were sent. Defaults to False.
+
+    Returns:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8),
+        the version 1 messages first. They are not sorted by time.
+    """
+    timestamps: List[bytes] = []
+    states: List[bytes] = []
+    batches: List[Batch] = []
+    for payload in payloads:
+        if not payload:
+            continue
+        if payload[0] == SCHEMA_VERSION:
+            batches.append(decode_binary(payload=payload))
+            continue
+        if b'"v":2' in payload[:8]:
+            # Other version 2 messages, e.g. of publish_ip.py, have no readings
+            if b'"dt":' in payload:
+                batches.append(decode_json(payload=payload))
+            continue
+        timestamp = _TIMESTAMP.search(payload)
+        message = _MESSAGE.search(payload)
+        if timestamp is None or message is None:
+            continue
+        if wheel_id is not None:
+            wheel = _WHEEL_ID.search(payload)
+            if wheel is None or wheel.group(1).decode() != wheel_id:
+                continue
+        timestamps.append(timestamp.group(1))
+        states.append(message.group(1))
+
+    if wheel_id is not None:
+        batches = [batch for batch in batches if batch.wheel_id == wheel_id]
+    v1_timestamps_ns = convert_timestamps(timestamps=timestamps)
+    if repair_12_hour:
+        v1_timestamps_ns = repair_12_hour_clock(timestamps_ns=v1_timestamps_ns)
+    timestamps_ns = [v1_timestamps_ns] + [batch.timestamps_ns for batch in batches]
+    pin_states = [np.frombuffer(b''.join(states), dtype=np.uint8) - ord('0')] + [batch.states for batch in batches]
+    return np.concatenate(timestamps_ns).astype(np.int64), np.concatenate(pin_states).astype(np.uint8)
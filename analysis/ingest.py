@@ -0,0 +1,285 @@
+"""
+================================================================================
+Description: This script contains the ingestion of the downloaded MQTT message
+             files and of local text logs into a columnar cache used by
+             hamsterwheel_analysis.ipynb
+================================================================================
+"""
+import json
+import mmap
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from decode import decode_payloads
+from text_log import iter_rotated_since, iter_text_log, last_timestamp
+
+
+def parse_message_files(paths: Iterable[str], wheel_id: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to parse message files into typed arrays.
+
+    The files may hold payloads of all schema versions, see `decode.py`.
+    Files which are not pin state messages are skipped.
+
+    Args:
+        paths: Full paths to the message files.
+        wheel_id: If set, only the readings of this wheel are kept. Defaults
+            to None, which keeps all readings.
+
+    Returns:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8).
+    """
+    payloads: List[bytes] = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            payloads.append(file.read())
+    return decode_payloads(payloads=payloads, wheel_id=wheel_id)
+
+
+def iter_message_files(message_dir: str, skip: Optional[Set[str]] = None) -> Iterator[str]:
+    """Function to list the message files in a directory and its subdirectories.
+
+    Args:
+        message_dir: Directory with the downloaded message files.
+        skip: Paths relative to `message_dir` to leave out. Defaults to None.
+
+    Returns:
+        Iterator over the paths relative to `message_dir`, sorted per directory.
+    """
+    for root, dirs, files in os.walk(message_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.relpath(os.path.join(root, name), message_dir)
+            if skip is None or path not in skip:
+                yield path
+
+
+class ColumnarCache():
+    """Class to keep the downloaded message files in a compact columnar cache.
+
+    Every call of `update` parses only the files which were not ingested
+    before, in chunks of `chunk_files` files. Every chunk is appended as a new
+    partition, a pair of `.npy` files with the int64 timestamps in nanoseconds
+    and the uint8 pin states, and its files are appended to the manifest, a
+    text file with one path per line. `load` memory-maps all partitions and
+    returns the data sorted by time.
+
+    `backfill` adds the readings of local text logs, e.g. months of
+    hamsterwheel.log from 'local' mode, the same way.
+
+    Attributes:
+        cache_dir: Directory of the cache. Created if it does not exist.
+        chunk_files: Maximum number of message files read into memory at once.
+            Defaults to 10000.
+    """
+    manifest_name = 'ingested.txt'
+    # Manifest of earlier versions, migrated on first use
+    legacy_manifest_name = 'ingested.json'
+    backfill_name = 'backfilled.json'
+
+    def __init__(self, cache_dir: str, chunk_files: int = 10000) -> None:
+        self.cache_dir = cache_dir
+        self.chunk_files = chunk_files
+        os.makedirs(cache_dir, exist_ok=True)
+        self._manifest_path = os.path.join(cache_dir, ColumnarCache.manifest_name)
+        self._ingested: Set[str] = set()
+        legacy_manifest_path = os.path.join(cache_dir, ColumnarCache.legacy_manifest_name)
+        if os.path.exists(legacy_manifest_path):
+            with open(legacy_manifest_path, 'r') as file:
+                self._append_manifest(paths=[path for path in json.load(file) if path not in self._read_manifest()])
+            os.remove(legacy_manifest_path)
+        self._ingested = self._read_manifest()
+        self._backfill_path = os.path.join(cache_dir, ColumnarCache.backfill_name)
+        self._backfilled: Dict[str, Union[int, dict]] = {}
+        if os.path.exists(self._backfill_path):
+            with open(self._backfill_path, 'r') as file:
+                self._backfilled = json.load(file)
+
+    def _partitions(self) -> List[str]:
+        """Method to list the partitions in the cache, oldest first.
+
+        Returns:
+            List of partition names.
+        """
+        names = [f[:-len('.timestamps.npy')] for f in os.listdir(self.cache_dir) if f.endswith('.timestamps.npy')]
+        return sorted(names)
+
+    def _write_partition(self, name: str, timestamps_ns: np.ndarray, states: np.ndarray) -> None:
+        """Method to write a partition.
+
+        Args:
+            name: Partition name.
+            timestamps_ns: Timestamps in nanoseconds.
+            states: Pin states.
+        """
+        np.save(os.path.join(self.cache_dir, f'{name}.timestamps.npy'), timestamps_ns.astype(np.int64))
+        np.save(os.path.join(self.cache_dir, f'{name}.states.npy'), states.astype(np.uint8))
+
+    def _read_manifest(self) -> Set[str]:
+        """Method to read the paths of the ingested files.
+
+        Returns:
+            Set of paths relative to the message directory.
+        """
+        if not os.path.exists(self._manifest_path):
+            return set()
+        with open(self._manifest_path, 'r') as file:
+            # A line cut off by a crash has no newline and was not ingested
+            return {line[:-1] for line in file if line.endswith('\n')}
+
+    def _append_manifest(self, paths: List[str]) -> None:
+        """Method to append the paths of ingested files to the manifest.
+
+        Args:
+            paths: Paths relative to the message directory.
+        """
+        with open(self._manifest_path, 'a') as file:
+            file.write(''.join(f'{path}\n' for path in paths))
+            file.flush()
+            os.fsync(file.fileno())
+        self._ingested.update(paths)
+
+    def append(self, timestamps_ns: np.ndarray, states: np.ndarray) -> None:
+        """Method to append arrays as a new partition.
+
+        Args:
+            timestamps_ns: Timestamps in nanoseconds.
+            states: Pin states.
+        """
+        if len(timestamps_ns) == 0:
+            return
+        partitions = self._partitions()
+        index = int(partitions[-1].split('-')[1]) + 1 if partitions else 0
+        self._write_partition(name=f'part-{index:06d}', timestamps_ns=timestamps_ns, states=states)
+
+    def update(self, message_dir: str) -> int:
+        """Method to ingest the message files below `message_dir` which are not in the cache yet.
+
+        Subdirectories are included, the files are kept by their path relative
+        to `message_dir`. At most `chunk_files` files are in memory at once.
+
+        Args:
+            message_dir: Directory with the downloaded message files.
+
+        Returns:
+            Number of ingested files.
+        """
+        ingested = 0
+        chunk: List[str] = []
+        for path in iter_message_files(message_dir=message_dir, skip=self._ingested):
+            chunk.append(path)
+            if len(chunk) == self.chunk_files:
+                ingested += self._ingest_chunk(message_dir=message_dir, paths=chunk)
+                chunk = []
+        if chunk:
+            ingested += self._ingest_chunk(message_dir=message_dir, paths=chunk)
+        return ingested
+
+    def _ingest_chunk(self, message_dir: str, paths: List[str]) -> int:
+        """Method to append a chunk of message files as a partition and record it in the manifest.
+
+        Args:
+            message_dir: Directory with the downloaded message files.
+            paths: Paths relative to `message_dir`.
+
+        Returns:
+            Number of ingested files.
+        """
+        timestamps_ns, states = parse_message_files(paths=[os.path.join(message_dir, path) for path in paths])
+        self.append(timestamps_ns=timestamps_ns, states=states)
+        self._append_manifest(paths=paths)
+        return len(paths)
+
+    def backfill(self, log_path: str, wheel_id: Optional[str] = None, live: bool = False) -> int:
+        """Method to ingest the readings of a local text log, see `text_log.py`.
+
+        Only the part of the log after the previous backfill is parsed, so a
+        growing log can be backfilled repeatedly. The offset, the inode and the
+        timestamp of the last line read are kept in `backfill_name`. A log with
+        another inode, shorter than the offset or without the last line read
+        at the offset was rotated: the segment it became is parsed from the
+        offset, newer segments and the new log from the start, see
+        `text_log.iter_rotated_since`. Every chunk of the log becomes a
+        partition.
+
+        Args:
+            log_path: Full path to the log file.
+            wheel_id: If set, only the readings of this wheel are kept. Defaults
+                to None, which keeps all readings.
+            live: If True, the last line is left for the next backfill, as it may
+                still be written. Defaults to False.
+
+        Returns:
+            Number of ingested readings.
+        """
+        key = os.path.abspath(log_path) if wheel_id is None else f'{os.path.abspath(log_path)}:{wheel_id}'
+        state = self._backfilled.get(key, {})
+        if isinstance(state, int):
+            # Earlier versions kept only the offset
+            state = {'offset': state}
+        stat = os.stat(log_path)
+        start = state.get('offset', 0)
+        last = state.get('last')
+
+        rotated = start > stat.st_size or state.get('inode', stat.st_ino) != stat.st_ino
+        if not rotated and start > 0 and last is not None:
+            # Inodes of deleted segments are reused, the last line read must still be there
+            with open(log_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                rotated = last_timestamp(data=data, start=0, end=start) != last
+
+        readings = 0
+        if rotated:
+            for timestamps_ns, states in iter_rotated_since(log_path=log_path, last=last, offset=start, wheel_id=wheel_id):
+                self.append(timestamps_ns=timestamps_ns, states=states)
+                readings += len(timestamps_ns)
+            start = 0
+        end = stat.st_size
+        if end > start:
+            with open(log_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if live:
+                    # Lines are preceded by a newline, the last one starts the last line
+                    end = max(start, data.rfind(b'\n', start, end))
+                last = last_timestamp(data=data, start=start, end=end) or last
+
+        for timestamps_ns, states in iter_text_log(path=log_path, start=start, end=end, wheel_id=wheel_id):
+            self.append(timestamps_ns=timestamps_ns, states=states)
+            readings += len(timestamps_ns)
+        self._backfilled[key] = {'offset': end, 'inode': stat.st_ino, 'last': last}
+        tmp_path = f'{self._backfill_path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self._backfilled, file)
+        os.replace(tmp_path, self._backfill_path)
+        return readings
+
+    def load(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Method to load the cached data.
+
+        Returns:
+            Tuple of the timestamps in nanoseconds (int64) and the pin states
+            (uint8), sorted by time.
+        """
+        partitions = self._partitions()
+        if not partitions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        timestamps_ns = np.concatenate([
+            np.load(os.path.join(self.cache_dir, f'{name}.timestamps.npy'), mmap_mode='r') for name in partitions
+        ])
+        states = np.concatenate([
+            np.load(os.path.join(self.cache_dir, f'{name}.states.npy'), mmap_mode='r') for name in partitions
+        ])
+        order = np.argsort(timestamps_ns, kind='stable')
+        return timestamps_ns[order], states[order]
+
+    def compact(self) -> None:
+        """Method to merge all partitions into one partition sorted by time.
+        """
+        partitions = self._partitions()
+        if len(partitions) < 2:
+            return
+        timestamps_ns, states = self.load()
+        name = f'part-{int(partitions[-1].split("-")[1]) + 1:06d}'
+        self._write_partition(name=name, timestamps_ns=timestamps_ns, states=states)
+        for old in partitions:
+            os.remove(os.path.join(self.cache_dir, f'{old}.timestamps.npy'))
+            os.remove(os.path.join(self.cache_dir, f'{old}.states.npy'))
@@ -0,0 +1,329 @@
+"""
+================================================================================
+Description: This script contains the rollup store which keeps pre-aggregated
+             rotation counts, active time and maximum RPM of the hamsterwheel
+             at minute, hour and day resolution
+================================================================================
+"""
+import sqlite3
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from analytics import DAY_NS, HOUR_NS, MINUTE_NS, SECOND_NS
+
+Totals = Dict[str, Union[int, float]]
+
+
+class RollupStore():
+    """Class to keep rollups of the readings of the reed sensor in an SQLite database.
+
+    Every closure of the reed sensor counts as one rotation. The time between
+    two closures which are at most `idle_timeout` apart counts as active time
+    and gives the RPM; both are attributed to the bucket of the later closure.
+
+    `update` is passed the same growing arrays (e.g. `ColumnarCache.load`)
+    repeatedly. Readings newer than the last reading of the previous update
+    are added to the rollups. Late readings, e.g. backfilled messages which
+    are older than that, are detected by the number of readings per day, and
+    the rollups from the day of the earliest late reading on are recomputed
+    from the arrays.
+
+    `query` answers a range with at most five indexed lookups, whole days from
+    the day rollup and only the edges of the range from the hour and minute
+    rollups.
+
+    Attributes:
+        path: Full path to the SQLite database file.
+        idle_timeout: Time in seconds without rotation which ends a session.
+            Defaults to 30 seconds.
+        dropped: Number of late readings which could not be aggregated, because
+            the arrays passed to `update` did not hold the earlier readings.
+    """
+    levels = {'day': DAY_NS, 'hour': HOUR_NS, 'minute': MINUTE_NS}
+
+    def __init__(self, path: str, idle_timeout: float = 30.0) -> None:
+        self.path = path
+        self._idle_timeout_ns = int(RollupStore._validate_idle_timeout(idle_timeout=idle_timeout) * 1e9)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS rollup (level TEXT NOT NULL, start INTEGER NOT NULL, '
+            'rotations INTEGER NOT NULL, active REAL NOT NULL, max_rpm REAL NOT NULL, PRIMARY KEY (level, start))'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS cursor (id INTEGER PRIMARY KEY CHECK (id = 0), '
+            'last_ns INTEGER, last_state INTEGER, last_closure INTEGER)'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS readings (day INTEGER PRIMARY KEY, count INTEGER NOT NULL)'
+        )
+        self._connection.commit()
+        row = self._connection.execute('SELECT last_ns, last_state, last_closure FROM cursor').fetchone()
+        self._last_ns: Optional[int] = row[0] if row else None
+        self._last_state: Optional[int] = row[1] if row else None
+        self._last_closure: Optional[int] = row[2] if row else None
+        # Number of aggregated readings per day, to detect late readings
+        self._counts: Dict[int, int] = dict(self._connection.execute('SELECT day, count FROM readings').fetchall())
+        self.dropped = 0
+
+    @classmethod
+    def _validate_idle_timeout(cls, idle_timeout: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            idle_timeout: Idle timeout input argument.
+
+        Returns:
+            idle_timeout if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(idle_timeout, float)
+            assert idle_timeout > 0.0
+
+        except AssertionError:
+            errmsg = f'Idle timeout {idle_timeout} is not supported. Must be float and larger than 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return idle_timeout
+
+    @classmethod
+    def _validate_level(cls, level: str) -> str:
+        """Class method to validate user input.
+
+        Args:
+            level: Rollup level input argument.
+
+        Returns:
+            level if it is a part of the supported levels.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert level in RollupStore.levels
+
+        except AssertionError:
+            errmsg = f'Level {level} is not among the supported levels {list(RollupStore.levels)}.'
+            raise ValueError(errmsg) from AssertionError
+
+        return level
+
+    def update(self, timestamps_ns: np.ndarray, states: np.ndarray) -> int:
+        """Method to aggregate new readings into the rollups.
+
+        The arrays must hold every reading passed before. Late readings in
+        arrays which do not, e.g. only the newest readings, cannot be
+        recomputed and are counted in `dropped`.
+
+        Args:
+            timestamps_ns: Timestamps in nanoseconds sorted by time.
+            states: Pin states sorted by time.
+
+        Returns:
+            Number of new rotations.
+        """
+        start, rewind_ns = 0, None
+        if self._last_ns is not None:
+            start = int(np.searchsorted(timestamps_ns, self._last_ns, side='right'))
+            aggregated = sum(self._counts.values())
+            if start < aggregated:
+                self.dropped += start
+            elif start > aggregated:
+                start, rewind_ns = self._rewind(timestamps_ns=timestamps_ns[:start], states=states[:start])
+        timestamps_ns, states = timestamps_ns[start:], states[start:]
+        if len(timestamps_ns) == 0:
+            return 0
+
+        # A closure is a reading of 0 after a reading of 1, also across updates
+        previous = np.empty(len(states), dtype=np.uint8)
+        previous[0] = 0 if self._last_state is None else self._last_state
+        previous[1:] = states[:-1]
+        closure_ns = timestamps_ns[(states == 0) & (previous != 0)]
+
+        if len(closure_ns):
+            if self._last_closure is None:
+                intervals = np.diff(closure_ns, prepend=closure_ns[0] - self._idle_timeout_ns - 1)
+            else:
+                intervals = np.diff(closure_ns, prepend=self._last_closure)
+            in_session = intervals <= self._idle_timeout_ns
+            active = np.where(in_session, intervals, 0) / SECOND_NS
+            rpm = np.where(in_session, 60 * SECOND_NS / np.maximum(intervals, 1), 0.0)
+            rows = self._aggregate(closure_ns=closure_ns, active=active, rpm=rpm)
+        else:
+            rows = []
+
+        self._last_ns = int(timestamps_ns[-1])
+        self._last_state = int(states[-1])
+        if len(closure_ns):
+            self._last_closure = int(closure_ns[-1])
+        days, counts = np.unique(timestamps_ns // DAY_NS * DAY_NS, return_counts=True)
+        for day, count in zip(days.tolist(), counts.tolist()):
+            self._counts[day] = self._counts.get(day, 0) + count
+
+        removed = 0
+        with self._connection:
+            if rewind_ns is not None:
+                removed = self._connection.execute(
+                    "SELECT COALESCE(SUM(rotations), 0) FROM rollup WHERE level = 'day' AND start >= ?", (rewind_ns,)
+                ).fetchone()[0]
+                self._connection.execute('DELETE FROM rollup WHERE start >= ?', (rewind_ns,))
+                self._connection.execute('DELETE FROM readings WHERE day >= ?', (rewind_ns,))
+            self._connection.executemany(
+                'INSERT INTO rollup (level, start, rotations, active, max_rpm) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (level, start) DO UPDATE SET rotations = rotations + excluded.rotations, '
+                'active = active + excluded.active, max_rpm = MAX(max_rpm, excluded.max_rpm)',
+                rows,
+            )
+            self._connection.executemany(
+                'INSERT INTO readings (day, count) VALUES (?, ?) '
+                'ON CONFLICT (day) DO UPDATE SET count = count + excluded.count',
+                zip(days.tolist(), counts.tolist()),
+            )
+            self._connection.execute(
+                'INSERT OR REPLACE INTO cursor (id, last_ns, last_state, last_closure) VALUES (0, ?, ?, ?)',
+                (self._last_ns, self._last_state, self._last_closure),
+            )
+        return len(closure_ns) - removed
+
+    def _rewind(self, timestamps_ns: np.ndarray, states: np.ndarray) -> Tuple[int, int]:
+        """Method to rewind the cursor to the first day with late readings.
+
+        Args:
+            timestamps_ns: Timestamps in nanoseconds up to the last aggregated reading.
+            states: Pin states up to the last aggregated reading.
+
+        Returns:
+            Tuple of the index of the first reading to aggregate again and the
+            start of its day in nanoseconds.
+        """
+        days, counts = np.unique(timestamps_ns // DAY_NS * DAY_NS, return_counts=True)
+        counts = dict(zip(days.tolist(), counts.tolist()))
+        rewind_ns = min(day for day in set(counts) | set(self._counts) if counts.get(day) != self._counts.get(day))
+        start = int(np.searchsorted(timestamps_ns, rewind_ns, side='left'))
+
+        # Restore the cursor from the readings before that day
+        before = states[:start]
+        closures = np.flatnonzero((before[1:] == 0) & (before[:-1] != 0))
+        self._last_state = int(before[-1]) if start else None
+        self._last_closure = int(timestamps_ns[closures[-1] + 1]) if len(closures) else None
+        self._counts = {day: count for day, count in self._counts.items() if day < rewind_ns}
+        return start, rewind_ns
+
+    @staticmethod
+    def _aggregate(
+        closure_ns: np.ndarray,
+        active: np.ndarray,
+        rpm: np.ndarray,
+    ) -> List[Tuple[str, int, int, float, float]]:
+        """Method to aggregate closures into the rows of all levels.
+
+        Args:
+            closure_ns: Timestamps of the closures in nanoseconds.
+            active: Active time in seconds attributed to every closure.
+            rpm: RPM at every closure, 0 at the start of a session.
+
+        Returns:
+            List of (level, start, rotations, active, max_rpm) rows.
+        """
+        rows = []
+        for level, level_ns in RollupStore.levels.items():
+            buckets, index = np.unique(closure_ns // level_ns, return_inverse=True)
+            rotations = np.bincount(index)
+            bucket_active = np.bincount(index, weights=active)
+            max_rpm = np.zeros(len(buckets))
+            np.maximum.at(max_rpm, index, rpm)
+            rows.extend(zip(
+                [level] * len(buckets),
+                (buckets * level_ns).tolist(),
+                rotations.tolist(),
+                bucket_active.tolist(),
+                max_rpm.tolist(),
+            ))
+        return rows
+
+    def _cover(self, start_ns: int, end_ns: int, depth: int = 0) -> List[Tuple[str, int, int]]:
+        """Method to split a range into the fewest buckets of the coarsest levels.
+
+        Args:
+            start_ns: Start of the range, a multiple of a minute.
+            end_ns: End of the range (exclusive), a multiple of a minute.
+            depth: Index of the coarsest level to use.
+
+        Returns:
+            List of (level, start, end) ranges of whole buckets.
+        """
+        if start_ns >= end_ns:
+            return []
+        level, level_ns = list(RollupStore.levels.items())[depth]
+        if level == 'minute':
+            return [(level, start_ns, end_ns)]
+        inner_start = -(-start_ns // level_ns) * level_ns
+        inner_end = end_ns // level_ns * level_ns
+        if inner_start >= inner_end:
+            return self._cover(start_ns=start_ns, end_ns=end_ns, depth=depth + 1)
+        return (
+            self._cover(start_ns=start_ns, end_ns=inner_start, depth=depth + 1)
+            + [(level, inner_start, inner_end)]
+            + self._cover(start_ns=inner_end, end_ns=end_ns, depth=depth + 1)
+        )
+
+    def query(self, start_ns: int, end_ns: int) -> Totals:
+        """Method to get the totals of a time range.
+
+        The range is rounded down to whole minutes.
+
+        Args:
+            start_ns: Start of the range in nanoseconds.
+            end_ns: End of the range (exclusive) in nanoseconds.
+
+        Returns:
+            Dictionary with the rotations, the active time in seconds and the
+            maximum RPM in the range.
+        """
+        start_ns = start_ns // MINUTE_NS * MINUTE_NS
+        end_ns = end_ns // MINUTE_NS * MINUTE_NS
+        rotations, active, max_rpm = 0, 0.0, 0.0
+        for level, level_start, level_end in self._cover(start_ns=start_ns, end_ns=end_ns):
+            row = self._connection.execute(
+                'SELECT COALESCE(SUM(rotations), 0), COALESCE(SUM(active), 0.0), COALESCE(MAX(max_rpm), 0.0) '
+                'FROM rollup WHERE level = ? AND start >= ? AND start < ?',
+                (level, level_start, level_end),
+            ).fetchone()
+            rotations += row[0]
+            active += row[1]
+            max_rpm = max(max_rpm, row[2])
+        return {'Rotations': rotations, 'ActiveTime': round(active, 3), 'MaxRpm': round(max_rpm, 1)}
+
+    def series(self, level: str, start_ns: int, end_ns: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Method to get the rollups of one level in a time range, e.g. for plotting.
+
+        Buckets without rotations are not stored and therefore not returned.
+
+        Args:
+            level: One of 'minute', 'hour' or 'day'.
+            start_ns: Start of the range in nanoseconds.
+            end_ns: End of the range (exclusive) in nanoseconds.
+
+        Returns:
+            Tuple of the bucket starts in nanoseconds, the rotations, the active
+            time in seconds and the maximum RPM per bucket.
+        """
+        level = RollupStore._validate_level(level=level)
+        rows = self._connection.execute(
+            'SELECT start, rotations, active, max_rpm FROM rollup WHERE level = ? AND start >= ? AND start < ? '
+            'ORDER BY start',
+            (level, start_ns, end_ns),
+        ).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        starts, rotations, active, max_rpm = zip(*rows)
+        return np.array(starts, dtype=np.int64), np.array(rotations, dtype=np.int64), np.array(active), np.array(max_rpm)
+
+    def close(self) -> None:
+        """Method to close the database connection.
+        """
+        self._connection.close()
@@ -0,0 +1,410 @@
+"""
+================================================================================
+Description: This script contains the streaming parser of the local text logs
+             written by utils.log in 'local' mode, e.g. hamsterwheel.log:
+
+                 2021-03-01 06:00:00.123456 - pin_state = 0
+                 2021-03-01 06:00:01 - wheel_id = cage1, pin_state = 1, state_duration = 0.877
+                 2021-03-01 06:00:02.000001 - Running...
+
+             Lines are preceded by a newline and start with the fixed-width
+             timestamp of `str(datetime)`, which leaves out the microseconds if
+             they are 0. The file is memory-mapped and parsed in chunks with
+             NumPy: every field is read at a fixed offset from the line start
+             for all lines of a chunk at once, so no line is handled in Python.
+             Lines other than pin states are skipped.
+
+             Logs rotated by src/python/log_rotation.py are read with
+             `parse_rotated_log`, which opens only the segments overlapping
+             the requested time window.
+================================================================================
+"""
+from datetime import datetime
+import gzip
+import json
+import mmap
+import os
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from analytics import DAY_NS, SECOND_NS
+
+# Bytes of a file parsed at once, must exceed the longest line
+CHUNK_SIZE = 16 * 1024 * 1024
+# Zero bytes after a chunk, so fixed offsets past its end read no data
+_PADDING = 64
+# Offsets of the fields in a line, relative to its start
+_DATE_SEPARATORS = ((4, b'-'), (7, b'-'), (10, b' '), (13, b':'), (16, b':'))
+_FRACTION = 19
+_SEPARATOR = b' - '
+_WHEEL_ID = b'wheel_id = '
+_PIN_STATE = b'pin_state = '
+
+
+def _matches(buffer: np.ndarray, positions: np.ndarray, pattern: bytes) -> np.ndarray:
+    """Function to check for a pattern at many positions of a buffer.
+
+    Args:
+        buffer: Bytes as uint8 array.
+        positions: Positions in `buffer`.
+        pattern: Bytes expected at every position.
+
+    Returns:
+        Boolean array, True where `pattern` starts at the position.
+    """
+    matches = np.ones(len(positions), dtype=bool)
+    for offset, value in enumerate(pattern):
+        matches &= buffer[positions + offset] == value
+    return matches
+
+
+def _digits(buffer: np.ndarray, positions: np.ndarray, count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to read decimal numbers of fixed width at many positions of a buffer.
+
+    Args:
+        buffer: Bytes as uint8 array.
+        positions: Positions in `buffer` of the first digit.
+        count: Number of digits.
+
+    Returns:
+        Tuple of the numbers (int64) and a boolean array, True where all
+        bytes are digits.
+    """
+    values = np.zeros(len(positions), dtype=np.int64)
+    valid = np.ones(len(positions), dtype=bool)
+    for offset in range(count):
+        digit = buffer[positions + offset].astype(np.int64) - ord('0')
+        valid &= (digit >= 0) & (digit <= 9)
+        values = values * 10 + digit
+    return values, valid
+
+
+def parse_lines(data: bytes, wheel_id: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to parse the pin states of complete lines of a text log.
+
+    The timestamps are the wall-clock time of the device, stored as int64
+    nanoseconds since the epoch as if they were UTC, as in `decode.py`.
+
+    Args:
+        data: Lines of the log. Must start at the start of a line and end at
+            the end of a line.
+        wheel_id: If set, only the readings of this wheel are kept; lines
+            without wheel ID are dropped. Defaults to None, which keeps all
+            readings.
+
+    Returns:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8),
+        in the order of the lines.
+    """
+    length = len(data)
+    buffer = np.zeros(length + _PADDING, dtype=np.uint8)
+    buffer[:length] = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(buffer[:length] == ord('\n'))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [length]))
+
+    # Date and time up to the seconds, at the same offsets in every line
+    valid = np.ones(len(starts), dtype=bool)
+    for offset, separator in _DATE_SEPARATORS:
+        valid &= buffer[starts + offset] == separator[0]
+    starts, ends = starts[valid], ends[valid]
+    fields = []
+    valid = np.ones(len(starts), dtype=bool)
+    for offset, count in ((0, 4), (5, 2), (8, 2), (11, 2), (14, 2), (17, 2)):
+        values, digits = _digits(buffer=buffer, positions=starts + offset, count=count)
+        fields.append(values)
+        valid &= digits
+    year, month, day, hour, minute, second = fields
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (hour < 24) & (minute < 60) & (second < 60)
+
+    # Microseconds, left out by `str(datetime)` if they are 0
+    has_fraction = buffer[starts + _FRACTION] == ord('.')
+    micros, digits = _digits(buffer=buffer, positions=starts + _FRACTION + 1, count=6)
+    valid &= digits | ~has_fraction
+    micros[~has_fraction] = 0
+    messages = starts + np.where(has_fraction, _FRACTION + 7, _FRACTION) + len(_SEPARATOR)
+    valid &= _matches(buffer=buffer, positions=messages - len(_SEPARATOR), pattern=_SEPARATOR)
+
+    # Optional wheel ID, ended by the first comma of the line
+    has_wheel = _matches(buffer=buffer, positions=messages, pattern=_WHEEL_ID)
+    pin_states = messages.copy()
+    wheel_lengths = np.full(len(messages), -1, dtype=np.int64)
+    if has_wheel.any():
+        commas = np.append(np.flatnonzero(buffer[:length] == ord(',')), length + _PADDING - 2)
+        wheel_starts = messages[has_wheel] + len(_WHEEL_ID)
+        wheel_ends = commas[np.searchsorted(commas, wheel_starts)]
+        wheel_ends = np.minimum(wheel_ends, length)
+        valid[has_wheel] &= (wheel_ends < ends[has_wheel]) & (buffer[wheel_ends + 1] == ord(' '))
+        wheel_lengths[has_wheel] = wheel_ends - wheel_starts
+        pin_states[has_wheel] = wheel_ends + 2
+    if wheel_id is not None:
+        wheel = wheel_id.encode()
+        valid &= wheel_lengths == len(wheel)
+        valid[valid] &= _matches(buffer=buffer, positions=messages[valid] + len(_WHEEL_ID), pattern=wheel)
+
+    # Pin state, followed by the end of the line or more fields
+    valid &= pin_states + len(_PIN_STATE) < ends
+    valid &= _matches(buffer=buffer, positions=pin_states, pattern=_PIN_STATE)
+    states = buffer[pin_states + len(_PIN_STATE)].astype(np.int64) - ord('0')
+    after = pin_states + len(_PIN_STATE) + 1
+    valid &= (states >= 0) & (states <= 1)
+    valid &= (after == ends) | (buffer[after] == ord(','))
+
+    year, month, day, hour, minute, second = (field[valid] for field in fields)
+    # Days since the epoch via the month, without parsing strings
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]').astype(np.int64) + day - 1
+    seconds = (hour * 60 + minute) * 60 + second
+    timestamps_ns = days * DAY_NS + seconds * SECOND_NS + micros[valid] * 1000
+    return timestamps_ns.astype(np.int64), states[valid].astype(np.uint8)
+
+
+def _iter_chunks(
+    data: Union[bytes, mmap.mmap],
+    start: int,
+    end: int,
+    wheel_id: Optional[str],
+    chunk_size: int,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Function to parse lines of a text log in memory chunk by chunk.
+
+    Args:
+        data: Contents of the log.
+        start: Byte offset of the first line.
+        end: Byte offset after the last line.
+        wheel_id: See `parse_lines`.
+        chunk_size: Bytes parsed at once.
+
+    Yields:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8)
+        of a chunk.
+    """
+    position = start
+    while position < end:
+        stop = min(position + chunk_size, end)
+        if stop < end:
+            # End the chunk after its last complete line
+            newline = data.rfind(b'\n', position, stop)
+            if newline <= position:
+                newline = data.find(b'\n', stop, end)
+            stop = end if newline < 0 else newline
+        yield parse_lines(data=data[position:stop], wheel_id=wheel_id)
+        position = stop + 1 if stop < end else end
+
+
+def iter_text_log(
+    path: str,
+    start: int = 0,
+    end: Optional[int] = None,
+    wheel_id: Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Function to parse a text log chunk by chunk.
+
+    Args:
+        path: Full path to the log file.
+        start: Byte offset of the first line. Defaults to 0.
+        end: Byte offset after the last line. Defaults to None, which parses up
+            to the end of the file.
+        wheel_id: See `parse_lines`. Defaults to None.
+        chunk_size: Bytes parsed at once. Defaults to `CHUNK_SIZE`.
+
+    Yields:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8)
+        of a chunk.
+    """
+    size = os.path.getsize(path)
+    end = size if end is None else min(end, size)
+    if end <= start:
+        return
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield from _iter_chunks(data=data, start=start, end=end, wheel_id=wheel_id, chunk_size=chunk_size)
+
+
+def parse_text_log(path: str, wheel_id: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to parse a whole text log into typed arrays.
+
+    Args:
+        path: Full path to the log file.
+        wheel_id: See `parse_lines`. Defaults to None.
+
+    Returns:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8),
+        in the order of the lines.
+    """
+    return _concatenate(chunks=list(iter_text_log(path=path, wheel_id=wheel_id)))
+
+
+def _concatenate(chunks: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to concatenate parsed chunks.
+
+    Args:
+        chunks: Tuples of timestamps and pin states.
+
+    Returns:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8).
+    """
+    if not chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+    return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+
+
+def _read_segment(path: str) -> bytes:
+    """Function to read a compressed segment of a rotated log.
+
+    zstandard is only imported for '.zst' segments.
+
+    Args:
+        path: Full path to the segment, ending in '.gz' or '.zst'.
+
+    Returns:
+        Uncompressed contents.
+    """
+    with open(path, 'rb') as file:
+        if path.endswith('.zst'):
+            import zstandard
+            return zstandard.ZstdDecompressor().stream_reader(file).read()
+        return gzip.decompress(file.read())
+
+
+def last_timestamp(data: Union[bytes, mmap.mmap], start: int, end: int) -> Optional[str]:
+    """Function to get the timestamp of the last line of a part of a text log.
+
+    Args:
+        data: Contents of the log.
+        start: Byte offset of the first line.
+        end: Byte offset after the last line.
+
+    Returns:
+        Timestamp as in the line, e.g. '2021-03-01 06:00:00.123456', or None if
+        the last line has none.
+    """
+    line_start = max(start, data.rfind(b'\n', start, end) + 1)
+    timestamp = data[line_start:end].split(_SEPARATOR, 1)[0].decode(errors='replace')
+    try:
+        datetime.fromisoformat(timestamp)
+    except ValueError:
+        return None
+    return timestamp
+
+
+def read_index(log_path: str) -> List[Dict[str, Union[str, int]]]:
+    """Function to read the segments of a rotated log, oldest first.
+
+    Args:
+        log_path: Full path to the log file.
+
+    Returns:
+        Entries of '<log_path>.index.json' with the full path of the segment in
+        'path', or an empty list if the log was not rotated.
+    """
+    index_path = f'{log_path}.index.json'
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, 'r') as file:
+        segments = json.load(file)
+    directory = os.path.dirname(os.path.abspath(log_path))
+    return [{**segment, 'path': os.path.join(directory, segment['file'])} for segment in segments]
+
+
+def iter_segment(path: str, start: int = 0, wheel_id: Optional[str] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Function to parse a segment of a rotated log chunk by chunk.
+
+    Compressed segments are decompressed in memory.
+
+    Args:
+        path: Full path to the segment.
+        start: Byte offset of the first line in the uncompressed segment. Defaults to 0.
+        wheel_id: See `parse_lines`. Defaults to None.
+
+    Yields:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8)
+        of a chunk.
+    """
+    if path.endswith(('.gz', '.zst')):
+        data = _read_segment(path=path)
+        yield from _iter_chunks(data=data, start=start, end=len(data), wheel_id=wheel_id, chunk_size=CHUNK_SIZE)
+    else:
+        yield from iter_text_log(path=path, start=start, wheel_id=wheel_id)
+
+
+def iter_rotated_since(
+    log_path: str,
+    last: Optional[str],
+    offset: int,
+    wheel_id: Optional[str] = None,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Function to parse the segments of a rotated log written after a position in the log.
+
+    The segment holding the line `last` at `offset` was the log when it was
+    read up to there, so it is parsed from `offset`; the newer segments are
+    parsed from the start. Without `last` only the newest segment is parsed,
+    from `offset`. The log itself is not parsed.
+
+    Args:
+        log_path: Full path to the log file.
+        last: Timestamp of the last line read, as in the line. None if unknown.
+        offset: Byte offset after the last line read.
+        wheel_id: See `parse_lines`. Defaults to None.
+
+    Yields:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8)
+        of a chunk.
+    """
+    segments = read_index(log_path=log_path)
+    if last is None:
+        segments, starts = segments[-1:], [offset]
+    else:
+        last_time = datetime.fromisoformat(last)
+        segments = [segment for segment in segments if datetime.fromisoformat(str(segment['end'])) >= last_time]
+        # Expired segments are lost, the first kept one is then parsed from the start
+        first = offset if segments and datetime.fromisoformat(str(segments[0]['start'])) <= last_time else 0
+        starts = [first] + [0] * (len(segments) - 1)
+    for segment, start in zip(segments, starts):
+        yield from iter_segment(path=str(segment['path']), start=start, wheel_id=wheel_id)
+
+
+def parse_rotated_log(
+    log_path: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    wheel_id: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to parse the readings of a time window of a rotated log.
+
+    The segments closed by the rotation in src/python/log_rotation.py are
+    listed with their time range in '<log_path>.index.json'. Only the segments
+    overlapping the window and the log itself are read; compressed segments
+    are decompressed in memory.
+
+    Args:
+        log_path: Full path to the log file.
+        start: Start of the window as in the log lines, e.g. '2021-03-01 06:00:00'.
+            Defaults to None.
+        end: End of the window as in the log lines. Defaults to None.
+        wheel_id: See `parse_lines`. Defaults to None.
+
+    Returns:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8)
+        in the window, in the order of the lines.
+    """
+    start_ns = np.datetime64(start, 'ns').astype(np.int64) if start is not None else None
+    end_ns = np.datetime64(end, 'ns').astype(np.int64) if end is not None else None
+    chunks: List[Tuple[np.ndarray, np.ndarray]] = []
+    for segment in read_index(log_path=log_path):
+        if start_ns is not None and np.datetime64(segment['end'], 'ns').astype(np.int64) < start_ns:
+            continue
+        if end_ns is not None and np.datetime64(segment['start'], 'ns').astype(np.int64) > end_ns:
+            continue
+        chunks.extend(iter_segment(path=str(segment['path']), wheel_id=wheel_id))
+    if os.path.exists(log_path):
+        chunks.extend(iter_text_log(path=log_path, wheel_id=wheel_id))
+
+    timestamps_ns, states = _concatenate(chunks=chunks)
+    window = np.ones(len(timestamps_ns), dtype=bool)
+    if start_ns is not None:
+        window &= timestamps_ns >= start_ns
+    if end_ns is not None:
+        window &= timestamps_ns <= end_ns
+    return timestamps_ns[window], states[window]
@@ -0,0 +1,108 @@
+"""
+================================================================================
+Description: This script benchmarks the vectorized analytics in
+             analysis/analytics.py on synthetic readings of the reed sensor.
+
+             python benchmarks/bench_analytics.py --samples 10000000
+================================================================================
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+
+import analytics  # noqa: E402
+
+
+def synthetic_readings(samples: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to generate readings of a wheel with runs and idle periods.
+
+    Readings are taken every 10 ms on average. The wheel alternates between
+    runs at a constant speed of 30 to 120 RPM and idle periods, the reed
+    sensor is closed for 10% of a rotation.
+
+    Args:
+        samples: Number of readings.
+        seed: Seed of the random generator.
+
+    Returns:
+        Tuple of the timestamps in nanoseconds (int64) and the pin states (uint8).
+    """
+    rng = np.random.default_rng(seed)
+    start_ns = np.datetime64('2021-03-01T18:00:00', 'ns').astype(np.int64)
+    timestamps_ns = start_ns + np.cumsum(rng.integers(5_000_000, 15_000_000, size=samples, dtype=np.int64))
+
+    # One run of 1 to 10 minutes every 40 minutes
+    period_ns = analytics.MINUTE_NS * 40
+    phase = (timestamps_ns - start_ns) % period_ns
+    running = phase < rng.integers(1, 11) * analytics.MINUTE_NS
+    rotation_ns = int(60 * analytics.SECOND_NS / rng.uniform(30, 120))
+    closed = (timestamps_ns % rotation_ns) < rotation_ns // 10
+    states = np.where(running & closed, 0, 1).astype(np.uint8)
+    return timestamps_ns, states
+
+
+def timed(function: Callable[[], object], repeat: int) -> float:
+    """Function to measure the best wall time of `repeat` calls.
+
+    Args:
+        function: Function to call without arguments.
+        repeat: Number of calls.
+
+    Returns:
+        Best time in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(samples: int, repeat: int) -> Dict[str, float]:
+    """Function to benchmark the analytics.
+
+    Args:
+        samples: Number of readings.
+        repeat: Number of calls per function.
+
+    Returns:
+        Dictionary of function names and best times in seconds.
+    """
+    timestamps_ns, states = synthetic_readings(samples=samples)
+    closure_ns = analytics.closures(timestamps_ns=timestamps_ns, states=states)
+    shuffled = np.random.default_rng(1).permutation(samples)
+    shuffled_ns, shuffled_states = timestamps_ns[shuffled], states[shuffled]
+    strings = timestamps_ns[:1_000_000].astype('datetime64[us]').astype(str)
+
+    return {
+        'convert_timestamps (1e6)': timed(lambda: analytics.convert_timestamps(strings), repeat),
+        'sort_by_time': timed(lambda: analytics.sort_by_time(shuffled_ns, shuffled_states), repeat),
+        'detect_edges': timed(lambda: analytics.detect_edges(states=states), repeat),
+        'closures': timed(lambda: analytics.closures(timestamps_ns=timestamps_ns, states=states), repeat),
+        'count_rotations': timed(lambda: analytics.count_rotations(states=states), repeat),
+        'resample (1 min)': timed(
+            lambda: analytics.resample(timestamps_ns=timestamps_ns, states=states, bin_ns=analytics.MINUTE_NS),
+            repeat,
+        ),
+        'activity_sessions': timed(lambda: analytics.activity_sessions(closure_ns=closure_ns), repeat),
+        'nightly_totals': timed(lambda: analytics.nightly_totals(closure_ns=closure_ns), repeat),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=10_000_000, help='Number of readings.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of calls per function.')
+    args = parser.parse_args()
+
+    results = run(samples=args.samples, repeat=args.repeat)
+    print(f'{args.samples:,} samples, best of {args.repeat}')
+    for name, seconds in results.items():
+        print(f'{name:<26} {seconds * 1e3:10.1f} ms')
@@ -0,0 +1,232 @@
+"""
+================================================================================
+Description: This script benchmarks the readout daemon in src/python offline:
+             import time of the daemon, readout loop iterations with the
+             simulated GPIO backend, log throughput of utils.log, and
+             serialization and publish cost of the MQTT sink with a fake MQTT
+             client.
+
+             python benchmarks/bench_daemon.py --duration 2
+================================================================================
+"""
+import argparse
+from contextlib import contextmanager
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Iterator
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'python')
+sys.path.insert(0, SRC)
+
+from fakes import install_fake_mqtt  # noqa: E402
+
+install_fake_mqtt()
+
+import hamsterwheel  # noqa: E402
+from gpio_backend import SimulatedGpioBackend  # noqa: E402
+from sinks import Event, MqttSink  # noqa: E402
+import utils  # noqa: E402
+
+
+@contextmanager
+def quiet_logging() -> Iterator[None]:
+    """Context manager to drop the log messages printed out by the daemon.
+
+    The daemon prints every reading and publish with `utils.log(...,
+    printout=True)`; writing them to the terminal would be measured too.
+    Messages are still written to the log files.
+    """
+    level = utils.logger.level
+    utils.logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        utils.logger.setLevel(level)
+
+
+def bench_import(repeat: int = 5) -> Dict[str, float]:
+    """Function to measure the import time of the daemon in a fresh interpreter.
+
+    This is the time a restart by the supervisor spends before the readout
+    loop can start. The start of the interpreter itself is subtracted.
+
+    Args:
+        repeat: Number of interpreter starts per measurement.
+
+    Returns:
+        Dictionary with the best import time of hamsterwheel.py in seconds.
+
+    Raises:
+        RuntimeError if importing the daemon imports boto3.
+    """
+    def best(code: str) -> float:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', code], cwd=SRC, capture_output=True, text=True, check=True)
+            times.append(time.perf_counter() - start)
+        if 'boto3' in output.stdout.split():
+            raise RuntimeError('Importing hamsterwheel.py imports boto3.')
+        return min(times)
+
+    baseline = best('pass')
+    imported = best('import sys, hamsterwheel; print(*sys.modules)')
+    return {'import_hamsterwheel_s': max(0.0, imported - baseline)}
+
+
+@quiet_logging()
+def bench_readout(tmp_dir: str, duration: float) -> Dict[str, float]:
+    """Function to measure the readout loop with the simulated GPIO backend.
+
+    Args:
+        tmp_dir: Directory for the logs.
+        duration: Time in seconds the readout loop runs.
+
+    Returns:
+        Dictionary with the loop iterations per second in 'poll' readout mode
+        with the shortest dead time, and the time per recorded reading.
+    """
+    hamsterwheel.LOG_HAMSTERWHEEL = os.path.join(tmp_dir, 'hamsterwheel.log')
+    wheel = hamsterwheel.HamsterWheel(
+        mode=['local'],
+        wheelpin=18,
+        ledpin=26,
+        deadtime=1e-6,
+        local_log_path=os.path.join(tmp_dir, 'readout.log'),
+        gpio=SimulatedGpioBackend(rpm=120.0),
+    )
+    timer = threading.Timer(duration, wheel.stop)
+    timer.start()
+    start = time.perf_counter()
+    wheel.readout()
+    elapsed = time.perf_counter() - start
+    iterations = wheel._sinks[0].stats()['enqueued']
+
+    # Cost of handling a single reading, without the sleep of the loop
+    readings = 100_000
+    target = hamsterwheel._Wheel(
+        config=hamsterwheel.WheelConfig(wheel_id=None, wheelpin=18, ledpin=26),
+        session_timeout=30.0,
+        window=None,
+    )
+    wheel._sinks = []
+    now_ns = time.time_ns()
+    start = time.perf_counter()
+    for i in range(readings):
+        wheel._record_pin_state(wheel=target, pin_state=(i // 50) % 2, timestamp_ns=now_ns + i * 10_000_000)
+    record_s = (time.perf_counter() - start) / readings
+
+    return {
+        'readout_poll_iterations_per_s': iterations / elapsed,
+        'record_pin_state_s': record_s,
+    }
+
+
+def bench_log(tmp_dir: str, messages: int) -> Dict[str, float]:
+    """Function to measure the throughput of `utils.log`.
+
+    Args:
+        tmp_dir: Directory for the logs.
+        messages: Number of messages per measurement.
+
+    Returns:
+        Dictionary with the messages per second written directly and through
+        a `BufferedLogWriter`, including its final flush.
+    """
+    direct_path = os.path.join(tmp_dir, 'direct.log')
+    direct_messages = max(1, messages // 10)
+    start = time.perf_counter()
+    for i in range(direct_messages):
+        utils.log(log_path=direct_path, logmsg=f'pin_state = {i % 2}')
+    direct = direct_messages / (time.perf_counter() - start)
+
+    buffered_path = os.path.join(tmp_dir, 'buffered.log')
+    utils.open_log_writer(log_path=buffered_path)
+    start = time.perf_counter()
+    for i in range(messages):
+        utils.log(log_path=buffered_path, logmsg=f'pin_state = {i % 2}')
+    utils.close_log_writers()
+    buffered = messages / (time.perf_counter() - start)
+
+    return {
+        'log_direct_messages_per_s': direct,
+        'log_buffered_messages_per_s': buffered,
+    }
+
+
+@quiet_logging()
+def bench_publish(tmp_dir: str, messages: int) -> Dict[str, float]:
+    """Function to measure the serialization and publish cost of `MqttSink` with a fake client.
+
+    Args:
+        tmp_dir: Directory for the logs and the spool.
+        messages: Number of readings per measurement.
+
+    Returns:
+        Dictionary with the time per published reading without and with spool.
+    """
+    results = {}
+    log_path = os.path.join(tmp_dir, 'publish.log')
+    utils.open_log_writer(log_path=log_path)
+    now_ns = time.time_ns()
+    for name, spool_path, count in [
+        ('publish_reading_s', None, messages),
+        ('publish_reading_spooled_s', os.path.join(tmp_dir, 'spool.sqlite'), max(1, messages // 10)),
+    ]:
+        sink = MqttSink(
+            client_name='bench',
+            endpoint='localhost',
+            ca_file='',
+            key='',
+            cert='',
+            topic='topic/bench',
+            aggregate_topic='topic/bench_aggregate',
+            metrics_topic='topic/bench_metrics',
+            log_path=log_path,
+            spool_path=spool_path,
+        )
+        sink.open()
+        events = [
+            Event(kind='reading', timestamp_ns=now_ns + i * 1_000_000, pin_state=i % 2, edge=True, duration=0.1)
+            for i in range(count)
+        ]
+        start = time.perf_counter()
+        for event in events:
+            sink.handle(event)
+        results[name] = (time.perf_counter() - start) / count
+        sink.shutdown()
+    utils.close_log_writers()
+    return results
+
+
+def run(duration: float, messages: int) -> Dict[str, float]:
+    """Function to run all daemon benchmarks in a temporary directory.
+
+    Args:
+        duration: Time in seconds the readout loop runs.
+        messages: Number of messages for the log and publish benchmarks.
+
+    Returns:
+        Dictionary of metric names and values.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = bench_import()
+        results.update(bench_readout(tmp_dir=tmp_dir, duration=duration))
+        results.update(bench_log(tmp_dir=tmp_dir, messages=messages))
+        results.update(bench_publish(tmp_dir=tmp_dir, messages=messages))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=2.0, help='Time in seconds the readout loop runs.')
+    parser.add_argument('--messages', type=int, default=100_000, help='Number of log and publish messages.')
+    args = parser.parse_args()
+
+    for name, value in run(duration=args.duration, messages=args.messages).items():
+        print(f'{name:<36} {value:14.6g}')
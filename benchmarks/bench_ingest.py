@@ -0,0 +1,217 @@
+"""
+================================================================================
+Description: This script benchmarks getting the MQTT messages into the
+             notebook: download_s3_folder against a local S3 stand-in (moto),
+             the ingestion in analysis/ingest.py at 10^4 to 10^7 messages and
+             the backfill of a local text log.
+
+             python benchmarks/bench_ingest.py --sizes 10000,100000,1000000
+================================================================================
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'src', 'python'))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'analysis'))
+
+from bench_analytics import synthetic_readings  # noqa: E402
+from decode import decode_payloads  # noqa: E402
+from ingest import ColumnarCache  # noqa: E402
+
+BUCKET = 'hamsterwheel-bench'
+FOLDER = 'wilson'
+
+
+def messages(samples: int) -> List[bytes]:
+    """Function to generate MQTT messages as published by the readout daemon.
+
+    Args:
+        samples: Number of messages.
+
+    Returns:
+        List of JSON messages.
+    """
+    timestamps_ns, states = synthetic_readings(samples=samples)
+    timestamps = timestamps_ns.astype('datetime64[s]').astype(str)
+    return [
+        b'{"Timestamp" :"' + timestamp.replace('T', ' ').encode() + b'", "Message":"' + str(state).encode() + b'"}'
+        for timestamp, state in zip(timestamps, states)
+    ]
+
+
+def write_messages(message_dir: str, payloads: List[bytes]) -> None:
+    """Function to write one file per message, like `download_s3_folder`.
+
+    Args:
+        message_dir: Directory of the message files.
+        payloads: Messages to write.
+    """
+    os.makedirs(message_dir, exist_ok=True)
+    for i, payload in enumerate(payloads):
+        with open(os.path.join(message_dir, f'{i:08d}'), 'wb') as file:
+            file.write(payload)
+
+
+def bench_download(tmp_dir: str, objects: int) -> Dict[str, float]:
+    """Function to measure `download_s3_folder` against a local S3 bucket.
+
+    Skipped if moto is not installed.
+
+    Args:
+        tmp_dir: Directory for the downloads.
+        objects: Number of message objects in the bucket.
+
+    Returns:
+        Dictionary with the downloaded objects per second of a full and the
+        time of an incremental download without new objects.
+    """
+    try:
+        from fakes import local_s3
+    except ImportError:
+        print('moto is not installed, skipping download_s3_folder')
+        return {}
+    from s3_utils import download_s3_folder
+
+    with local_s3(bucket_name=BUCKET) as s3_resource:
+        client = s3_resource.meta.client
+        for i, payload in enumerate(messages(samples=objects)):
+            client.put_object(Bucket=BUCKET, Key=f'{FOLDER}/{i:08d}', Body=payload)
+
+        kwargs = dict(
+            bucket_name=BUCKET,
+            s3_folder=FOLDER,
+            local_dir=os.path.join(tmp_dir, 's3'),
+            manifest_path=os.path.join(tmp_dir, 's3_manifest.json'),
+            progress_every=objects + 1,
+            s3_resource=s3_resource,
+        )
+        start = time.perf_counter()
+        download_s3_folder(**kwargs)
+        full = objects / (time.perf_counter() - start)
+        start = time.perf_counter()
+        download_s3_folder(**kwargs)
+        incremental = time.perf_counter() - start
+
+    return {
+        'download_s3_objects_per_s': full,
+        'download_s3_incremental_s': incremental,
+    }
+
+
+def write_text_log(log_path: str, samples: int) -> None:
+    """Function to write a text log as written by `utils.log` in 'local' mode.
+
+    Every 50th line is a 'Running...' message between the readings.
+
+    Args:
+        log_path: Full path to the log file.
+        samples: Number of readings.
+    """
+    timestamps_ns, states = synthetic_readings(samples=samples)
+    # `str(datetime)` leaves out the microseconds if they are 0
+    timestamps = np.char.replace(timestamps_ns.astype('datetime64[ns]').astype('datetime64[us]').astype(str), 'T', ' ')
+    timestamps = np.char.replace(timestamps, '.000000', '')
+    lines = []
+    for i, (timestamp, state) in enumerate(zip(timestamps.tolist(), states.tolist())):
+        if i % 50 == 0:
+            lines.append(f'\n{timestamp} - Running...')
+        lines.append(f'\n{timestamp} - pin_state = {state}')
+    with open(log_path, 'w') as file:
+        file.write(''.join(lines))
+
+
+def bench_backfill(tmp_dir: str, samples: int) -> Dict[str, float]:
+    """Function to measure `ColumnarCache.backfill` of a local text log.
+
+    Args:
+        tmp_dir: Directory for the log and the cache.
+        samples: Number of readings in the log.
+
+    Returns:
+        Dictionary with the backfilled megabytes of log per second.
+    """
+    log_path = os.path.join(tmp_dir, 'hamsterwheel.log')
+    write_text_log(log_path=log_path, samples=samples)
+    cache = ColumnarCache(cache_dir=os.path.join(tmp_dir, 'cache_backfill'))
+    start = time.perf_counter()
+    readings = cache.backfill(log_path=log_path)
+    seconds = time.perf_counter() - start
+    assert readings == samples
+    return {'backfill_text_log_mb_per_s': os.path.getsize(log_path) / 1e6 / seconds}
+
+
+def bench_ingest(tmp_dir: str, sizes: List[int], max_files: int) -> Dict[str, float]:
+    """Function to measure the ingestion of messages into the columnar cache.
+
+    Up to `max_files` messages are written as files and ingested with
+    `ColumnarCache.update`, as in the notebook. Larger sizes parse the
+    messages from memory, which leaves out only the file reads.
+
+    Args:
+        tmp_dir: Directory for the message files and the caches.
+        sizes: Numbers of messages.
+        max_files: Largest number of messages written as files.
+
+    Returns:
+        Dictionary with the ingested messages per second and the time to
+        load the cache per size.
+    """
+    results = {}
+    for size in sizes:
+        payloads = messages(samples=size)
+        cache_dir = os.path.join(tmp_dir, f'cache_{size}')
+        cache = ColumnarCache(cache_dir=cache_dir)
+        if size <= max_files:
+            message_dir = os.path.join(tmp_dir, f'messages_{size}')
+            write_messages(message_dir=message_dir, payloads=payloads)
+            start = time.perf_counter()
+            cache.update(message_dir=message_dir)
+        else:
+            start = time.perf_counter()
+            timestamps_ns, states = decode_payloads(payloads=payloads)
+            cache.append(timestamps_ns=timestamps_ns, states=states)
+        results[f'ingest_{size}_messages_per_s'] = size / (time.perf_counter() - start)
+        del payloads
+
+        start = time.perf_counter()
+        timestamps_ns, states = ColumnarCache(cache_dir=cache_dir).load()
+        results[f'load_{size}_s'] = time.perf_counter() - start
+        assert len(timestamps_ns) == size
+    return results
+
+
+def run(sizes: List[int], max_files: int, objects: int) -> Dict[str, float]:
+    """Function to run all ingestion benchmarks in a temporary directory.
+
+    Args:
+        sizes: Numbers of messages for the ingestion.
+        max_files: Largest number of messages written as files.
+        objects: Number of objects in the local S3 bucket.
+
+    Returns:
+        Dictionary of metric names and values.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = bench_download(tmp_dir=tmp_dir, objects=objects)
+        results.update(bench_ingest(tmp_dir=tmp_dir, sizes=sizes, max_files=max_files))
+        results.update(bench_backfill(tmp_dir=tmp_dir, samples=max(sizes)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='Comma separated numbers of messages.')
+    parser.add_argument('--max-files', type=int, default=10_000, help='Largest number of messages written as files.')
+    parser.add_argument('--objects', type=int, default=1000, help='Number of objects in the local S3 bucket.')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    for name, value in run(sizes=sizes, max_files=args.max_files, objects=args.objects).items():
+        print(f'{name:<36} {value:14.6g}')
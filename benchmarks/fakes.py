@@ -0,0 +1,78 @@
+"""
+================================================================================
+Description: This script contains the stand-ins used by the benchmarks to run
+             offline: a fake AWSIoTPythonSDK MQTT client and a local S3
+             bucket served by moto.
+================================================================================
+"""
+from contextlib import contextmanager
+import sys
+import time
+import types
+from typing import Iterator, List, Tuple
+
+
+class FakeMqttClient():
+    """MQTT client with the interface of `AWSIoTMQTTClient` which keeps the messages in memory.
+
+    Attributes:
+        client_name: Name of the client.
+        publish_latency: Time in seconds every publish blocks, to model the
+            network round trip. Defaults to 0.
+    """
+    publish_latency = 0.0
+
+    def __init__(self, client_name: str) -> None:
+        self.client_name = client_name
+        self.published: List[Tuple[str, str]] = []
+
+    def configureEndpoint(self, endpoint: str, port: int) -> None:
+        pass
+
+    def configureCredentials(self, CAFilePath: str, KeyPath: str, CertificatePath: str) -> None:
+        pass
+
+    def configureOfflinePublishQueueing(self, queue_size: int) -> None:
+        pass
+
+    def connect(self) -> bool:
+        return True
+
+    def disconnect(self) -> bool:
+        return True
+
+    def publish(self, topic: str, payload: str, qos: int) -> bool:
+        if self.publish_latency:
+            time.sleep(self.publish_latency)
+        self.published.append((topic, payload))
+        return True
+
+
+def install_fake_mqtt() -> None:
+    """Function to make `from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient` return `FakeMqttClient`.
+    """
+    package = types.ModuleType('AWSIoTPythonSDK')
+    mqttlib = types.ModuleType('AWSIoTPythonSDK.MQTTLib')
+    mqttlib.AWSIoTMQTTClient = FakeMqttClient
+    package.MQTTLib = mqttlib
+    sys.modules['AWSIoTPythonSDK'] = package
+    sys.modules['AWSIoTPythonSDK.MQTTLib'] = mqttlib
+
+
+@contextmanager
+def local_s3(bucket_name: str) -> Iterator[object]:
+    """Context manager serving an empty S3 bucket from memory with moto.
+
+    Args:
+        bucket_name: Name of the bucket to create.
+
+    Yields:
+        boto3 S3 resource connected to the local stand-in.
+    """
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        s3_resource = boto3.resource('s3', region_name='us-east-1')
+        s3_resource.create_bucket(Bucket=bucket_name)
+        yield s3_resource
@@ -0,0 +1,133 @@
+"""
+================================================================================
+Description: This script runs all benchmarks in this folder, stores the results
+             as JSON and compares them with a baseline to catch regressions.
+
+             python benchmarks/run_benchmarks.py --output results.json
+             python benchmarks/run_benchmarks.py --baseline results.json
+
+             Metrics ending in '_per_s' are rates (higher is better), all other
+             metrics are times in seconds (lower is better).
+================================================================================
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from typing import Dict, List
+
+import bench_analytics
+import bench_daemon
+import bench_ingest
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+_NON_WORD = re.compile(r'\W+')
+
+
+def _git_commit() -> str:
+    """Function to get the current commit of the repository.
+
+    Returns:
+        Commit hash, or 'unknown' outside of a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args: argparse.Namespace) -> Dict[str, object]:
+    """Function to run all benchmarks.
+
+    Args:
+        args: Parsed command line arguments.
+
+    Returns:
+        Dictionary with the environment and the results per benchmark.
+    """
+    sizes = [int(size) for size in args.sizes.split(',')]
+    return {
+        'environment': {
+            'created': datetime.now().isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'arguments': vars(args),
+        },
+        'results': {
+            'daemon': bench_daemon.run(duration=args.duration, messages=args.messages),
+            'ingest': bench_ingest.run(sizes=sizes, max_files=args.max_files, objects=args.objects),
+            'analytics': {
+                _NON_WORD.sub('_', name).strip('_') + '_s': seconds
+                for name, seconds in bench_analytics.run(samples=args.samples, repeat=args.repeat).items()
+            },
+        },
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    """Function to compare results with a baseline.
+
+    Args:
+        results: Results per benchmark.
+        baseline: Baseline results per benchmark.
+        tolerance: Allowed relative slowdown, e.g. 0.2 for 20%.
+
+    Returns:
+        List of messages describing the regressions.
+    """
+    regressions = []
+    for benchmark, metrics in results.items():
+        for name, value in metrics.items():
+            reference = baseline.get(benchmark, {}).get(name)
+            if not reference or not value:
+                continue
+            # Relative slowdown, positive if the metric got worse
+            if name.endswith('_per_s'):
+                slowdown = reference / value - 1
+            else:
+                slowdown = value / reference - 1
+            if slowdown > tolerance:
+                regressions.append(f'{benchmark}.{name}: {value:.6g} vs. {reference:.6g} ({slowdown:+.0%})')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Path of the JSON file the results are written to.')
+    parser.add_argument('--baseline', help='Path of a JSON file with results to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown.')
+    parser.add_argument('--duration', type=float, default=2.0, help='Time in seconds the readout loop runs.')
+    parser.add_argument('--messages', type=int, default=100_000, help='Number of log and publish messages.')
+    parser.add_argument('--sizes', default='10000,100000,1000000,10000000', help='Comma separated numbers of messages to ingest.')
+    parser.add_argument('--max-files', type=int, default=10_000, help='Largest number of messages written as files.')
+    parser.add_argument('--objects', type=int, default=1000, help='Number of objects in the local S3 bucket.')
+    parser.add_argument('--samples', type=int, default=10_000_000, help='Number of readings for the analytics.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of calls per analytics function.')
+    args = parser.parse_args()
+
+    report = run(args=args)
+    for benchmark, metrics in report['results'].items():
+        print(f'[{benchmark}]')
+        for name, value in metrics.items():
+            print(f'  {name:<40} {value:14.6g}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Results written to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results=report['results'], baseline=baseline, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,3 @@
+#!/bin/bash
+sleep 2 &&
+/home/wilson/env/bin/python /home/wilson/repo/hamsterwheel/src/python/hamsterwheel_handler.py
@@ -0,0 +1,149 @@
+"""
+================================================================================
+Description: This script contains the window aggregation used by the
+             'aws_aggregate' mode in hamsterwheel.py
+================================================================================
+"""
+from typing import Dict, List, Optional, Union
+
+
+class WindowAggregator():
+    """Class to summarise readings of the reed sensor over fixed time windows.
+
+    Windows are aligned to multiples of `window` since the epoch. A rotation is
+    counted whenever the reed sensor closes (pin state changes to 0). The RPM
+    is derived from the time between two consecutive closures.
+
+    Attributes:
+        window: Length of a window in seconds.
+    """
+    max_gap_windows = 100
+
+    def __init__(self, window: float = 60.0) -> None:
+        self._window_ns = int(WindowAggregator._validate_window(window=window) * 1e9)
+        self._window_start: Optional[int] = None
+        self._last_timestamp: Optional[int] = None
+        self._last_state: Optional[int] = None
+        self._last_closure: Optional[int] = None
+        self._reset()
+
+    @classmethod
+    def _validate_window(cls, window: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            window: Window input argument.
+
+        Returns:
+            window if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(window, float)
+            assert window > 0.0
+
+        except AssertionError:
+            errmsg = f'Window {window} is not supported. Must be float and larger than 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return window
+
+    def _reset(self) -> None:
+        """Method to clear the accumulated values of the current window.
+        """
+        self._rotations = 0
+        self._closed_ns = 0
+        self._samples = 0
+        self._max_rpm = 0.0
+
+    def _accumulate_until(self, timestamp_ns: int) -> None:
+        """Method to add the time since the last reading to the closed time.
+
+        Args:
+            timestamp_ns: Epoch timestamp in nanoseconds.
+        """
+        if self._last_state == 0 and self._last_timestamp is not None:
+            self._closed_ns += max(0, timestamp_ns - self._last_timestamp)
+        self._last_timestamp = timestamp_ns
+
+    def _close_window(self) -> Dict[str, Union[int, float]]:
+        """Method to finish the current window and start the next one.
+
+        Returns:
+            Summary of the finished window.
+        """
+        window_end = self._window_start + self._window_ns
+        self._accumulate_until(timestamp_ns=window_end)
+        summary = {
+            'WindowStart': self._window_start // 1_000_000,
+            'Window': self._window_ns / 1e9,
+            'Rotations': self._rotations,
+            'ClosedTime': round(self._closed_ns / 1e9, 3),
+            'MaxRpm': round(self._max_rpm, 1),
+            'Samples': self._samples,
+        }
+        self._window_start = window_end
+        self._reset()
+        return summary
+
+    def window_end_ns(self) -> Optional[int]:
+        """Method to get the end of the current window.
+
+        Returns:
+            Epoch timestamp in nanoseconds, None before the first reading.
+        """
+        if self._window_start is None:
+            return None
+        return self._window_start + self._window_ns
+
+    def add(self, timestamp_ns: int, pin_state: int) -> List[Dict[str, Union[int, float]]]:
+        """Method to add a reading of the reed sensor.
+
+        Args:
+            timestamp_ns: Epoch timestamp of the reading in nanoseconds.
+            pin_state: State of the wheel pin, 0 if the loop is closed.
+
+        Returns:
+            Summaries of the windows which ended before the reading, oldest first.
+        """
+        summaries = self.flush(timestamp_ns=timestamp_ns)
+        if self._window_start is None:
+            self._window_start = timestamp_ns - timestamp_ns % self._window_ns
+
+        self._accumulate_until(timestamp_ns=timestamp_ns)
+        if pin_state == 0 and self._last_state != 0:
+            self._rotations += 1
+            if self._last_closure is not None and timestamp_ns > self._last_closure:
+                rpm = 60e9 / (timestamp_ns - self._last_closure)
+                self._max_rpm = max(self._max_rpm, rpm)
+            self._last_closure = timestamp_ns
+        self._last_state = pin_state
+        self._samples += 1
+        return summaries
+
+    def flush(self, timestamp_ns: int) -> List[Dict[str, Union[int, float]]]:
+        """Method to finish all windows which have ended by `timestamp_ns`.
+
+        Windows without readings are reported as well. After a gap of more than
+        `max_gap_windows` windows, e.g. when the system clock jumps, the
+        aggregation restarts at the window of `timestamp_ns` instead.
+
+        Args:
+            timestamp_ns: Current epoch timestamp in nanoseconds.
+
+        Returns:
+            Summaries of the finished windows, oldest first.
+        """
+        summaries: List[Dict[str, Union[int, float]]] = []
+        if self._window_start is None:
+            return summaries
+        if (timestamp_ns - self._window_start) // self._window_ns > self.max_gap_windows:
+            self._window_start = timestamp_ns - timestamp_ns % self._window_ns
+            self._last_timestamp = timestamp_ns
+            self._reset()
+            return summaries
+        while timestamp_ns >= self._window_start + self._window_ns:
+            summaries.append(self._close_window())
+        return summaries
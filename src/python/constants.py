@@ -14,15 +14,66 @@ LOGS = '/logs/'
 
 # Log file for the hamsterwheel readout code
 FILENAME_LOG_HAMSTERWHEEL = 'hamsterwheel.log'
+# Binary event log for the rotation data
+FILENAME_EVENT_LOG = 'hamsterwheel_events.bin'
+# Spool database for MQTT messages which are not yet published
+FILENAME_SPOOL = 'hamsterwheel_spool.sqlite'
 # Log file for the handler of the script
 FILENAME_LOG_PUBLISHIP = 'hamsterwheel_handler.log'
-# Filename for the script to retrieve ifconfig results
+# Log file of the supervisor of the readout script
+FILENAME_LOG_SUPERVISOR = 'hamsterwheel_supervisor.log'
+# Heartbeat of the readout loop and restart statistics of the supervisor
+FILENAME_HEARTBEAT = 'hamsterwheel.heartbeat'
+FILENAME_SUPERVISOR_STATS = 'hamsterwheel_supervisor.json'
+# Lock held by the running supervisor, so a second one exits
+FILENAME_SUPERVISOR_LOCK = 'hamsterwheel_supervisor.lock'
+# Unix domain socket of the query server of the recent history
+FILENAME_HISTORY_SOCKET = 'hamsterwheel_history.sock'
+# Filename for the script to retrieve ifconfig results, used by the deprecated
+# PublishIp.run_bash
 FILENAME_GET_WLAN = 'get_wlan.sh'
 # Path to the bash script to retrieve ifconfig results
 BASH_GET_WLAN = f'/{REPO}/src/bash/{FILENAME_GET_WLAN}'
+# Last IP address published by publish_ip.py
+FILENAME_PUBLISHIP_STATE = 'publish_ip.state'
 
 LOG_HAMSTERWHEEL = f'{HOME}{LOGS}{FILENAME_LOG_HAMSTERWHEEL}'
 LOG_PUBLISHIP = f'{HOME}{LOGS}{FILENAME_LOG_PUBLISHIP}'
+PUBLISHIP_STATE = f'{HOME}{LOGS}{FILENAME_PUBLISHIP_STATE}'
+EVENT_LOG = f'{HOME}{LOGS}{FILENAME_EVENT_LOG}'
+SPOOL = f'{HOME}{LOGS}{FILENAME_SPOOL}'
+LOG_SUPERVISOR = f'{HOME}{LOGS}{FILENAME_LOG_SUPERVISOR}'
+HEARTBEAT = f'{HOME}{LOGS}{FILENAME_HEARTBEAT}'
+HISTORY_SOCKET = f'{HOME}{LOGS}{FILENAME_HISTORY_SOCKET}'
+SUPERVISOR_STATS = f'{HOME}{LOGS}{FILENAME_SUPERVISOR_STATS}'
+SUPERVISOR_LOCK = f'{HOME}{LOGS}{FILENAME_SUPERVISOR_LOCK}'
+# Readout scripts started by the supervisor, see hamsterwheel_handler.py
+HAMSTERWHEEL_SCRIPT = f'{HOME}repo/{REPO}/src/python/hamsterwheel.py'
+HAMSTERWHEEL_AWS_SCRIPT = f'{HOME}repo/{REPO}/src/python/hamsterwheel_aws.py'
+
+# Buffered log writer: flush after this many messages or seconds, and sync to
+# the SD card at most once per LOG_FSYNC_INTERVAL seconds. Beyond LOG_MAX_QUEUE
+# queued messages new ones are dropped
+LOG_FLUSH_LINES = 256
+LOG_FLUSH_INTERVAL = 5.0
+LOG_FSYNC = 'periodic'
+LOG_FSYNC_INTERVAL = 60.0
+LOG_MAX_QUEUE = 100000
+# Log rotation: close the log as a segment at LOG_ROTATE_BYTES bytes or
+# LOG_ROTATE_AGE seconds, compress it and keep at most LOG_KEEP_BYTES of segments
+LOG_ROTATE_BYTES = 8 * 1024 * 1024
+LOG_ROTATE_AGE = 86400.0
+LOG_COMPRESSION = 'gzip'
+LOG_KEEP_BYTES = 256 * 1024 * 1024
+
+# Heartbeat: the readout loop beats at least every HEARTBEAT_INTERVAL seconds,
+# the supervisor restarts it if the last beat is older than HEARTBEAT_DEADLINE
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_DEADLINE = 5.0
+HEARTBEAT_STARTUP_TIMEOUT = 30.0
+# Supervisor: wait time before a restart, doubled after every failure
+RESTART_MIN_BACKOFF = 1.0
+RESTART_MAX_BACKOFF = 60.0
 
 # AWS
 AWS_CLIENT_NAME = "rpi_hamsterwheel_sensor"
@@ -31,3 +82,35 @@ AWS_CA_FILE = "/home/wilson/certificates/AmazonRootCA1.pem"
 AWS_KEY = "/home/wilson/certificates/private-key.pem.key"
 AWS_CERT = "/home/wilson/certificates/device-certificate.pem.crt"
 AWS_TOPIC = "topic/wilson"
+AWS_TOPIC_AGGREGATE = "topic/wilson_aggregate"
+AWS_TOPIC_METRICS = "topic/wilson_metrics"
+AWS_TOPIC_PUBLISH_IP = "topic/publish_ip"
+# Spool: maximum number of stored messages and seconds between publish retries
+SPOOL_MAX_MESSAGES = 500000
+SPOOL_RETRY_INTERVAL = 10.0
+# Publisher thread: seconds to wait for queued messages on shutdown and between stats logs
+PUBLISH_CLOSE_TIMEOUT = 10.0
+PUBLISH_STATS_INTERVAL = 300.0
+# Supervisor: time a stopped readout script gets before it is killed. It closes
+# at most one sink per mode and the history sink, each within
+# PUBLISH_CLOSE_TIMEOUT, then flushes its logs and waits for the log compression
+SUPERVISOR_STOP_TIMEOUT = 6 * PUBLISH_CLOSE_TIMEOUT + LOG_FLUSH_INTERVAL + 30.0
+# Supervisor: time a crashed or hung readout script gets before it is killed and
+# restarted
+SUPERVISOR_KILL_TIMEOUT = 1.0
+# Payload of the published readings, see payload.py: 'legacy', 'json' or 'binary'.
+# Batches hold at most PUBLISH_BATCH_SIZE readings and are published at the
+# latest PUBLISH_BATCH_INTERVAL seconds after their first reading
+PAYLOAD_FORMAT = 'json'
+PUBLISH_BATCH_SIZE = 50
+PUBLISH_BATCH_INTERVAL = 5.0
+# Instrumentation: local HTTP endpoint serving the metrics in the Prometheus text format
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9101
+# Recent history: number of events and per-minute summaries kept in memory
+HISTORY_EVENTS = 10000
+HISTORY_MINUTES = 1440
+# IP monitor: seconds between two checks without netlink notification, and
+# between two publishes of an unchanged address
+PUBLISHIP_INTERVAL = 60.0
+PUBLISHIP_REFRESH_INTERVAL = 86400.0
@@ -0,0 +1,233 @@
+"""
+================================================================================
+Description: This script contains the interrupt-driven edge capture used by the
+             'edge' readout mode in hamsterwheel.py
+================================================================================
+"""
+from array import array
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class EdgeRingBuffer():
+    """Bounded ring buffer holding timestamped edges of the reed sensors.
+
+    The buffer is filled from the GPIO callback thread and drained by the
+    readout loop. Every edge records the pin it was seen on, so the edges of
+    several wheels share one buffer. If the readout loop falls behind, the
+    oldest edges are overwritten and counted in `dropped`.
+
+    Attributes:
+        capacity: Maximum number of edges kept in the buffer.
+    """
+
+    def __init__(self, capacity: int = 4096) -> None:
+        self._capacity = EdgeRingBuffer._validate_capacity(capacity=capacity)
+        self._timestamps = array('q', bytes(8 * self._capacity))
+        self._states = bytearray(self._capacity)
+        self._pins = bytearray(self._capacity)
+        self._head = 0
+        self._size = 0
+        self._dropped = 0
+        self._not_empty = threading.Condition(threading.Lock())
+
+    @classmethod
+    def _validate_capacity(cls, capacity: int) -> int:
+        """Class method to validate user input.
+
+        Args:
+            capacity: Capacity input argument.
+
+        Returns:
+            Capacity if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(capacity, int)
+            assert capacity > 0
+
+        except AssertionError:
+            errmsg = f'Capacity {capacity} is not supported. Must be a positive integer.'
+            raise ValueError(errmsg) from AssertionError
+
+        return capacity
+
+    @property
+    def dropped(self) -> int:
+        """Number of edges overwritten before they were drained."""
+        return self._dropped
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, timestamp_ns: int, pin_state: int, pin: int = 0) -> None:
+        """Method to append an edge, overwriting the oldest one if the buffer is full.
+
+        Args:
+            timestamp_ns: Monotonic timestamp of the edge in nanoseconds.
+            pin_state: Pin state after the edge.
+            pin: GPIO pin of the edge. Defaults to 0.
+        """
+        with self._not_empty:
+            self._timestamps[self._head] = timestamp_ns
+            self._states[self._head] = pin_state
+            self._pins[self._head] = pin
+            self._head = (self._head + 1) % self._capacity
+            if self._size == self._capacity:
+                self._dropped += 1
+            else:
+                self._size += 1
+            self._not_empty.notify()
+
+    def drain(self) -> List[Tuple[int, int, int]]:
+        """Method to remove and return all buffered edges, oldest first.
+
+        Returns:
+            List of (timestamp_ns, pin, pin_state) tuples.
+        """
+        with self._not_empty:
+            start = (self._head - self._size) % self._capacity
+            edges = []
+            for i in range(self._size):
+                index = (start + i) % self._capacity
+                edges.append((self._timestamps[index], self._pins[index], self._states[index]))
+            self._size = 0
+        return edges
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Method to block until at least one edge is buffered.
+
+        Args:
+            timeout: Maximum time to wait in seconds. Waits forever if None.
+
+        Returns:
+            True if edges are available, False if the wait timed out.
+        """
+        with self._not_empty:
+            return self._not_empty.wait_for(lambda: self._size > 0, timeout=timeout)
+
+
+class EdgeCapture():
+    """Class to capture edges of the reed sensors with GPIO callbacks.
+
+    Every edge reported by the GPIO library is timestamped with the monotonic
+    clock. Bounces are filtered in software per pin: an edge is only accepted
+    if the pin state differs from the last accepted state of the pin and at
+    least `debouncetime` has passed since its last accepted edge. An edge
+    inside the window schedules a re-read of the pin once the window expired,
+    so a state which settles within the window is not missed. The edges of
+    all pins go into one ring buffer, so the readout loop wakes up once for
+    any number of wheels.
+
+    Attributes:
+        io: GPIO module, e.g. `RPi.GPIO`. The pins must already be set up as input.
+        pins: GPIO pins connected to the reed sensors.
+        debouncetime: Minimum time between two accepted edges of a pin in seconds.
+        buffer_size: Capacity of the edge ring buffer.
+    """
+
+    def __init__(self, io, pins: List[int], debouncetime: float = 0.005, buffer_size: int = 4096) -> None:
+        self._io = io
+        self._pins = pins
+        self._debounce_ns = int(debouncetime * 1e9)
+        self.buffer = EdgeRingBuffer(capacity=buffer_size)
+        self._last_state: Dict[int, int] = {}
+        self._last_edge_ns: Dict[int, int] = {}
+        # Timestamp of the last edge inside the debounce window and its re-read per pin
+        self._suppressed_ns: Dict[int, int] = {}
+        self._rereads: Dict[int, threading.Timer] = {}
+        self._lock = threading.Lock()
+        # Offset to convert monotonic timestamps into epoch timestamps
+        self._epoch_offset_ns = time.time_ns() - time.monotonic_ns()
+
+    def _callback(self, channel: int) -> None:
+        """Callback executed by the GPIO library on every edge of `channel`.
+
+        Args:
+            channel: GPIO pin which triggered the callback.
+        """
+        now = time.monotonic_ns()
+        with self._lock:
+            remaining_ns = self._last_edge_ns[channel] + self._debounce_ns - now
+            if remaining_ns > 0:
+                self._suppressed_ns[channel] = now
+                if channel not in self._rereads:
+                    timer = threading.Timer(remaining_ns / 1e9, self._reread, args=(channel,))
+                    timer.daemon = True
+                    self._rereads[channel] = timer
+                    timer.start()
+                return
+            self._accept(channel=channel, pin_state=self._io.input(channel), timestamp_ns=now)
+
+    def _reread(self, channel: int) -> None:
+        """Method to re-read a pin once the debounce window of its last edge expired.
+
+        The settled state is accepted as an edge at the time of the last
+        suppressed edge if it differs from the last accepted state.
+
+        Args:
+            channel: GPIO pin to re-read.
+        """
+        with self._lock:
+            if self._rereads.pop(channel, None) is None:
+                return
+            timestamp_ns = self._suppressed_ns.pop(channel, time.monotonic_ns())
+            self._accept(channel=channel, pin_state=self._io.input(channel), timestamp_ns=timestamp_ns)
+
+    def _accept(self, channel: int, pin_state: int, timestamp_ns: int) -> None:
+        """Method to push an edge if the pin state changed. Must be called with the lock held.
+
+        Args:
+            channel: GPIO pin of the edge.
+            pin_state: Pin state read after the edge.
+            timestamp_ns: Monotonic timestamp of the edge in nanoseconds.
+        """
+        if pin_state == self._last_state[channel]:
+            return
+        self._last_state[channel] = pin_state
+        self._last_edge_ns[channel] = timestamp_ns
+        self.buffer.push(timestamp_ns=timestamp_ns, pin_state=pin_state, pin=channel)
+
+    def start(self) -> None:
+        """Method to register the edge callbacks. Pushes the current pin states as first edges.
+        """
+        for pin in self._pins:
+            now = time.monotonic_ns()
+            self._last_state[pin] = self._io.input(pin)
+            self._last_edge_ns[pin] = now
+            self.buffer.push(timestamp_ns=now, pin_state=self._last_state[pin], pin=pin)
+            self._io.add_event_detect(pin, self._io.BOTH, callback=self._callback)
+
+    def stop(self) -> None:
+        """Method to unregister the edge callbacks and cancel the pending re-reads.
+        """
+        for pin in self._pins:
+            self._io.remove_event_detect(pin)
+        with self._lock:
+            for timer in self._rereads.values():
+                timer.cancel()
+            self._rereads.clear()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Method to block until edges are available. See `EdgeRingBuffer.wait`.
+        """
+        return self.buffer.wait(timeout=timeout)
+
+    def drain(self) -> List[Tuple[int, int, int]]:
+        """Method to return all captured edges. See `EdgeRingBuffer.drain`.
+        """
+        return self.buffer.drain()
+
+    def to_epoch_ns(self, timestamp_ns: int) -> int:
+        """Method to convert a monotonic edge timestamp into epoch nanoseconds.
+
+        Args:
+            timestamp_ns: Monotonic timestamp in nanoseconds.
+
+        Returns:
+            Timestamp in nanoseconds since the epoch.
+        """
+        return timestamp_ns + self._epoch_offset_ns
@@ -0,0 +1,152 @@
+"""
+================================================================================
+Description: This script contains the binary event log used by the 'binary'
+             mode in hamsterwheel.py. Every event is a fixed 9 byte record with
+             the epoch timestamp in nanoseconds and a state/edge byte, appended
+             through a memory-mapped file.
+================================================================================
+"""
+import mmap
+import os
+import struct
+from typing import Tuple
+
+# File header: magic, format version, record size, number of records
+HEADER = struct.Struct('<4sHHQ')
+HEADER_MAGIC = b'HWEV'
+HEADER_VERSION = 1
+# Record: epoch timestamp in nanoseconds, state byte
+RECORD = struct.Struct('<qB')
+# Bits of the state byte
+STATE_BIT = 0x01
+EDGE_BIT = 0x02
+
+
+class EventLogWriter():
+    """Class to append events to a binary event log.
+
+    The file is grown in chunks of `chunk_records` records and written through
+    a memory map, so an append is a copy into memory. The number of valid
+    records is kept in the header, and the file is truncated to its exact size
+    on `close`.
+
+    Attributes:
+        path: Full path to the event log file. Appends if the file exists.
+        chunk_records: Number of records the file is grown by when it is full.
+            Defaults to 65536 records (576 kB).
+    """
+
+    def __init__(self, path: str, chunk_records: int = 65536) -> None:
+        self.path = path
+        self._chunk_records = chunk_records
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.fstat(self._file.fileno()).st_size < HEADER.size:
+            self._file.write(HEADER.pack(HEADER_MAGIC, HEADER_VERSION, RECORD.size, 0))
+            self._file.flush()
+            self._count = 0
+        else:
+            self._count = EventLogWriter._read_header(file=self._file)
+        self._capacity = 0
+        self._mmap = None
+        self._grow()
+
+    @classmethod
+    def _read_header(cls, file) -> int:
+        """Class method to read and validate the header of an event log.
+
+        Args:
+            file: Open event log file.
+
+        Returns:
+            Number of records in the event log.
+
+        Raises:
+            ValueError if the file is not a supported event log.
+        """
+        file.seek(0)
+        magic, version, record_size, count = HEADER.unpack(file.read(HEADER.size))
+        try:
+            assert magic == HEADER_MAGIC
+            assert version == HEADER_VERSION
+            assert record_size == RECORD.size
+
+        except AssertionError:
+            errmsg = f'File {file.name} is not a supported event log.'
+            raise ValueError(errmsg) from AssertionError
+
+        return count
+
+    def _grow(self) -> None:
+        """Method to extend the file by `chunk_records` records and remap it.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+        self._capacity = self._count + self._chunk_records
+        self._file.truncate(HEADER.size + self._capacity * RECORD.size)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp_ns: int, pin_state: int, edge: bool = False) -> None:
+        """Method to append one event.
+
+        Args:
+            timestamp_ns: Epoch timestamp of the event in nanoseconds.
+            pin_state: State of the wheel pin, 0 if the loop is closed.
+            edge: True if the pin state changed with this event.
+        """
+        if self._count == self._capacity:
+            self._grow()
+        state = (pin_state & STATE_BIT) | (EDGE_BIT if edge else 0)
+        RECORD.pack_into(self._mmap, HEADER.size + self._count * RECORD.size, timestamp_ns, state)
+        self._count += 1
+        HEADER.pack_into(self._mmap, 0, HEADER_MAGIC, HEADER_VERSION, RECORD.size, self._count)
+
+    def flush(self) -> None:
+        """Method to write the mapped pages to the file.
+        """
+        self._mmap.flush()
+
+    def close(self) -> None:
+        """Method to flush the event log and truncate it to the written records.
+        """
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.truncate(HEADER.size + self._count * RECORD.size)
+        self._file.close()
+
+
+def read_event_log(path: str):
+    """Function to load an event log into NumPy arrays without copying.
+
+    The arrays are views on a read-only memory map of the file.
+
+    Args:
+        path: Full path to the event log file.
+
+    Returns:
+        Tuple of the epoch timestamps in nanoseconds (int64) and the state
+        bytes (uint8). Use `STATE_BIT` and `EDGE_BIT` to decode the state bytes.
+    """
+    import numpy as np
+
+    with open(path, 'rb') as file:
+        count = EventLogWriter._read_header(file=file)
+    dtype = np.dtype([('timestamp_ns', '<i8'), ('state', 'u1')])
+    if count == 0:
+        return np.empty(0, dtype='<i8'), np.empty(0, dtype='u1')
+    records = np.memmap(path, dtype=dtype, mode='r', offset=HEADER.size, shape=(count,))
+    return records['timestamp_ns'], records['state']
+
+
+def decode_states(states) -> Tuple:
+    """Function to split state bytes into pin states and edge flags.
+
+    Args:
+        states: State bytes as returned by `read_event_log`.
+
+    Returns:
+        Tuple of the pin states (uint8) and a boolean array marking edges.
+    """
+    return states & STATE_BIT, (states & EDGE_BIT) > 0
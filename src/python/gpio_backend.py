@@ -0,0 +1,359 @@
+"""
+================================================================================
+Description: This script contains the GPIO backends used in hamsterwheel.py.
+             Besides the RaspberryPi backend there is a synthetic backend and
+             a backend replaying a recorded edge trace, so the readout loop can
+             be run and timed off the Pi.
+================================================================================
+"""
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class GpioBackend(ABC):
+    """Interface of a GPIO backend.
+
+    The interface follows the `RPi.GPIO` module, so a backend can be used
+    wherever the module was used before. A backend must implement all methods.
+    """
+    BCM = 11
+    IN = 1
+    OUT = 0
+    PUD_UP = 22
+    LOW = 0
+    HIGH = 1
+    FALLING = 32
+    RISING = 31
+    BOTH = 33
+
+    @abstractmethod
+    def setmode(self, mode: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def setup(self, channel: int, direction: int, pull_up_down: Optional[int] = None) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def input(self, channel: int) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def output(self, channel: int, value: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_event_detect(self, channel: int, edge: int, callback: Callable[[int], None]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_event_detect(self, channel: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def cleanup(self) -> None:
+        raise NotImplementedError
+
+
+class RPiGpioBackend(GpioBackend):
+    """GPIO backend using `RPi.GPIO` on the RaspberryPi.
+    """
+
+    def __init__(self) -> None:
+        import RPi.GPIO as io
+        self._io = io
+        self.BCM = io.BCM
+        self.IN = io.IN
+        self.OUT = io.OUT
+        self.PUD_UP = io.PUD_UP
+        self.LOW = io.LOW
+        self.HIGH = io.HIGH
+        self.FALLING = io.FALLING
+        self.RISING = io.RISING
+        self.BOTH = io.BOTH
+
+    def setmode(self, mode: int) -> None:
+        self._io.setmode(mode)
+
+    def setup(self, channel: int, direction: int, pull_up_down: Optional[int] = None) -> None:
+        if pull_up_down is None:
+            self._io.setup(channel, direction)
+        else:
+            self._io.setup(channel, direction, pull_up_down=pull_up_down)
+
+    def input(self, channel: int) -> int:
+        return self._io.input(channel)
+
+    def output(self, channel: int, value: int) -> None:
+        self._io.output(channel, value)
+
+    def add_event_detect(self, channel: int, edge: int, callback: Callable[[int], None]) -> None:
+        self._io.add_event_detect(channel, edge, callback=callback)
+
+    def remove_event_detect(self, channel: int) -> None:
+        self._io.remove_event_detect(channel)
+
+    def cleanup(self) -> None:
+        self._io.cleanup()
+
+
+class _TimelineGpioBackend(GpioBackend):
+    """Base class for backends whose input pins follow a timeline of edges.
+
+    Subclasses implement `_state_at` and `_next_edge_after`, both in seconds
+    since the backend was set up. Edge callbacks are fired from a background
+    thread at the time of each edge.
+    """
+
+    def __init__(self) -> None:
+        self._start: Optional[float] = None
+        self._inputs: List[int] = []
+        self.outputs: Dict[int, int] = {}
+        self._callbacks: Dict[int, Callable[[int], None]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _elapsed(self) -> float:
+        if self._start is None:
+            self._start = time.monotonic()
+        return time.monotonic() - self._start
+
+    def _state_at(self, elapsed: float) -> int:
+        raise NotImplementedError
+
+    def _next_edge_after(self, elapsed: float) -> Optional[float]:
+        raise NotImplementedError
+
+    def setmode(self, mode: int) -> None:
+        self._elapsed()
+
+    def setup(self, channel: int, direction: int, pull_up_down: Optional[int] = None) -> None:
+        if direction == self.IN:
+            self._inputs.append(channel)
+        else:
+            self.outputs[channel] = self.LOW
+
+    def input(self, channel: int) -> int:
+        if channel not in self._inputs:
+            return self.outputs.get(channel, self.LOW)
+        return self._state_at(self._elapsed())
+
+    def output(self, channel: int, value: int) -> None:
+        self.outputs[channel] = value
+
+    def add_event_detect(self, channel: int, edge: int, callback: Callable[[int], None]) -> None:
+        self._callbacks[channel] = callback
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._fire_edges, daemon=True)
+            self._thread.start()
+
+    def remove_event_detect(self, channel: int) -> None:
+        self._callbacks.pop(channel, None)
+        if not self._callbacks and self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def cleanup(self) -> None:
+        for channel in list(self._callbacks):
+            self.remove_event_detect(channel)
+        self.outputs = {}
+
+    def _fire_edges(self) -> None:
+        """Method run in the background thread to call the registered callbacks on every edge.
+        """
+        elapsed = self._elapsed()
+        while not self._stop.is_set():
+            # Step past the current edge to avoid firing it twice due to rounding
+            next_edge = self._next_edge_after(elapsed + 1e-9)
+            if next_edge is None:
+                return
+            if self._stop.wait(max(0.0, next_edge - self._elapsed())):
+                return
+            elapsed = next_edge
+            for channel, callback in list(self._callbacks.items()):
+                callback(channel)
+
+
+class SimulatedGpioBackend(_TimelineGpioBackend):
+    """GPIO backend generating reed closures at a constant rotation rate.
+
+    Every rotation closes the reed sensor (pin state 0) once for a fraction of
+    the rotation period. All input pins follow the same wheel.
+
+    Attributes:
+        rpm: Rotations per minute of the simulated wheel. 0 keeps the wheel at rest.
+        closed_fraction: Fraction of a rotation during which the reed sensor is closed.
+    """
+
+    def __init__(self, rpm: float = 60.0, closed_fraction: float = 0.1) -> None:
+        super().__init__()
+        self._rpm = SimulatedGpioBackend._validate_rpm(rpm=rpm)
+        self._closed_fraction = SimulatedGpioBackend._validate_closed_fraction(closed_fraction=closed_fraction)
+
+    @classmethod
+    def _validate_rpm(cls, rpm: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            rpm: Rotations per minute input argument.
+
+        Returns:
+            rpm if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(rpm, (int, float))
+            assert rpm >= 0.0
+
+        except AssertionError:
+            errmsg = f'Rotation rate {rpm} is not supported. Must be a number larger or equal 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return float(rpm)
+
+    @classmethod
+    def _validate_closed_fraction(cls, closed_fraction: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            closed_fraction: Closed fraction input argument.
+
+        Returns:
+            closed_fraction if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(closed_fraction, float)
+            assert closed_fraction > 0.0
+            assert closed_fraction < 1.0
+
+        except AssertionError:
+            errmsg = f'Closed fraction {closed_fraction} is not supported. Must be float and between 0 and 1.0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return closed_fraction
+
+    def _state_at(self, elapsed: float) -> int:
+        if self._rpm == 0.0:
+            return self.HIGH
+        phase = (elapsed * self._rpm / 60.0) % 1.0
+        return self.LOW if phase < self._closed_fraction else self.HIGH
+
+    def _next_edge_after(self, elapsed: float) -> Optional[float]:
+        if self._rpm == 0.0:
+            return None
+        period = 60.0 / self._rpm
+        rotation, phase = divmod(elapsed / period, 1.0)
+        if phase < self._closed_fraction:
+            return (rotation + self._closed_fraction) * period
+        return (rotation + 1.0) * period
+
+
+class ReplayGpioBackend(_TimelineGpioBackend):
+    """GPIO backend playing back a recorded edge trace.
+
+    Attributes:
+        trace: List of (timestamp_ns, pin_state) edges, sorted by time. The
+            timestamps are taken relative to the first edge.
+        speed: Playback speed, 1.0 replays the trace in real time.
+    """
+
+    def __init__(self, trace: List[Tuple[int, int]], speed: float = 1.0) -> None:
+        super().__init__()
+        self._trace = ReplayGpioBackend._validate_trace(trace=trace)
+        self._speed = ReplayGpioBackend._validate_speed(speed=speed)
+        origin = self._trace[0][0]
+        self._offsets = [(timestamp_ns - origin) / 1e9 / self._speed for timestamp_ns, _ in self._trace]
+
+    @classmethod
+    def _validate_trace(cls, trace: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Class method to validate user input.
+
+        Args:
+            trace: Trace input argument.
+
+        Returns:
+            trace if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert len(trace) > 0
+            for (previous, _), (current, _) in zip(trace, trace[1:]):
+                assert current >= previous
+
+        except AssertionError:
+            errmsg = 'Trace is not supported. Must contain at least one edge and be sorted by time.'
+            raise ValueError(errmsg) from AssertionError
+
+        return trace
+
+    @classmethod
+    def _validate_speed(cls, speed: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            speed: Speed input argument.
+
+        Returns:
+            speed if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(speed, (int, float))
+            assert speed > 0.0
+
+        except AssertionError:
+            errmsg = f'Replay speed {speed} is not supported. Must be a number larger than 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return float(speed)
+
+    @classmethod
+    def load_trace(cls, path: str) -> List[Tuple[int, int]]:
+        """Class method to load an edge trace from a text file.
+
+        Every line holds one edge as `timestamp_ns,pin_state`.
+
+        Args:
+            path: Full path to the trace file.
+
+        Returns:
+            List of (timestamp_ns, pin_state) edges.
+        """
+        trace = []
+        with open(path, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                timestamp_ns, pin_state = line.split(',')
+                trace.append((int(timestamp_ns), int(pin_state)))
+        return trace
+
+    @property
+    def finished(self) -> bool:
+        """True once the last edge of the trace has been played back."""
+        return self._elapsed() >= self._offsets[-1]
+
+    def _state_at(self, elapsed: float) -> int:
+        index = bisect_right(self._offsets, elapsed) - 1
+        return self._trace[max(index, 0)][1]
+
+    def _next_edge_after(self, elapsed: float) -> Optional[float]:
+        index = bisect_right(self._offsets, elapsed)
+        if index >= len(self._offsets):
+            return None
+        return self._offsets[index]
@@ -1,49 +1,299 @@
+import json
 import sys
+import threading
 import time
-from typing import List, Optional
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from constants import (
+    LOG_HAMSTERWHEEL,
+    EVENT_LOG,
+    HEARTBEAT,
+    HEARTBEAT_INTERVAL,
+    LOG_FLUSH_LINES,
+    LOG_FLUSH_INTERVAL,
+    LOG_FSYNC,
+    LOG_FSYNC_INTERVAL,
+    LOG_MAX_QUEUE,
+    LOG_ROTATE_BYTES,
+    LOG_ROTATE_AGE,
+    LOG_COMPRESSION,
+    LOG_KEEP_BYTES,
+    AWS_CLIENT_NAME,
+    AWS_ENDPOINT,
+    AWS_CA_FILE,
+    AWS_KEY,
+    AWS_CERT,
+    AWS_TOPIC,
+    AWS_TOPIC_AGGREGATE,
+    AWS_TOPIC_METRICS,
+    SPOOL_MAX_MESSAGES,
+    SPOOL_RETRY_INTERVAL,
+    PUBLISH_CLOSE_TIMEOUT,
+    PUBLISH_STATS_INTERVAL,
+    PUBLISH_BATCH_SIZE,
+    PUBLISH_BATCH_INTERVAL,
+    METRICS_HOST,
+    METRICS_PORT,
+    HISTORY_SOCKET,
+    HISTORY_EVENTS,
+    HISTORY_MINUTES,
+)
+from aggregation import WindowAggregator
+from edge_capture import EdgeCapture
+from gpio_backend import GpioBackend, RPiGpioBackend
+from heartbeat import Heartbeat
+from history import HistoryServer, HistorySink, RecentHistory
+from instrumentation import REGISTRY, MetricsServer
+from log_rotation import LogRotator
+from metrics import WheelMetrics
+from poll_scheduler import PollScheduler
+from sinks import BinaryLogSink, Event, LocalFileSink, MqttSink, Sink, StdoutSink
+from utils import close_log_writers, log, open_log_writer
+
+_LOOP_JITTER_SECONDS = REGISTRY.histogram(
+    name='hamsterwheel_loop_jitter_seconds',
+    documentation='Time the polling readout loop woke up later than scheduled.',
+)
+_GPIO_READ_SECONDS = REGISTRY.histogram(
+    name='hamsterwheel_gpio_read_seconds',
+    documentation='Time to read a wheel pin.',
+)
+_EDGE_DELAY_SECONDS = REGISTRY.histogram(
+    name='hamsterwheel_edge_delay_seconds',
+    documentation='Time from the capture of an edge until the readout loop handled it.',
+)
+_EVENTS = REGISTRY.counter(
+    name='hamsterwheel_events_total',
+    documentation='Number of events fanned out to the sinks.',
+)
+
+
+class WheelConfig(NamedTuple):
+    """Configuration of one wheel read out by `HamsterWheel`.
 
-import RPi.GPIO as io
+    Attributes:
+        wheel_id: ID of the wheel, added to all its events. None only for a single wheel.
+        wheelpin: GPIO pin to communicate with the reed sensor.
+        ledpin: GPIO pin to control the LED.
+        circumference: Circumference of the wheel in meters. Defaults to 0.88 meters.
+    """
+    wheel_id: Optional[str]
+    wheelpin: int
+    ledpin: int
+    circumference: float = 0.88
+
+
+class _Wheel():
+    """Class holding the readout state of one wheel.
+
+    Attributes:
+        config: Configuration of the wheel.
+        session_timeout: Time in seconds without rotation which ends a run session.
+        window: Length in seconds of the aggregation windows, None to disable them.
+    """
+
+    def __init__(self, config: WheelConfig, session_timeout: float, window: Optional[float]) -> None:
+        self.config = config
+        self.wheel_id: Optional[str] = config.wheel_id
+        self.metrics = WheelMetrics(circumference=config.circumference, idle_timeout=session_timeout)
+        self.aggregator = WindowAggregator(window=window) if window is not None else None
+        self.last_pin_state: Optional[int] = None
+        self.last_change_ns: Optional[int] = None
+        self.last_report_ns: Optional[int] = None
+
+    def tag(self, summary: dict) -> dict:
+        """Method to add the wheel ID to a summary.
+
+        Args:
+            summary: Summary from `WheelMetrics` or `WindowAggregator`.
 
-from constants import LOG_HAMSTERWHEEL
-from utils import log
+        Returns:
+            The summary with the key 'WheelId' first, unchanged without wheel ID.
+        """
+        if self.wheel_id is None:
+            return summary
+        return {'WheelId': self.wheel_id, **summary}
 
 
 class HamsterWheel():
     """Class to handle data collection for the hamsterwheel.
 
+    The readout loop produces every reading, window summary and metrics
+    summary once as an `Event` and fans it out to the sinks. Each sink has its
+    own queue and worker thread, see `sinks.py`. The sinks are created from
+    `mode`; further sinks are passed with `sinks` or added with `add_sink`.
+
+    Several wheels are read out by one process if `wheels` is set. They share
+    the readout loop, the edge capture and the sinks, and every event carries
+    the ID of its wheel.
+
     Attributes:
         mode: Controls output location of the sensor data.
-            Currently supports: local
-        wheelpin: GPIO pin to communicate with the reed sensor.
-        wheelpin: GPIO pin to control the LED.
+            Currently supports: local, binary, stdout, aws, aws_aggregate
+        wheelpin: GPIO pin to communicate with the reed sensor of a single wheel.
+            Is required if `wheels` is not set.
+        ledpin: GPIO pin to control the LED of a single wheel.
+            Is required if `wheels` is not set.
         deadtime: Readout dead time to protect the sensor in seconds.
             Defaults to 1 second.
         local_log_path: Full path to store the readout data in local mode.
             Is required if 'local' is part of `mode`.
+        event_log_path: Full path to the binary event log in binary mode.
+            Is required if 'binary' is part of `mode`.
+        readout_mode: Controls how the reed sensor is read out.
+            'poll' samples the pin once per `deadtime`, 'edge' registers GPIO edge
+            callbacks and records every debounced edge, 'adaptive' samples the pin
+            every `fast_deadtime` while the wheel turns and backs off to `deadtime`
+            while it is idle, see `PollScheduler`. Defaults to 'poll'.
+        debouncetime: Software debounce time in seconds for the 'edge' readout mode.
+            Defaults to 5 milliseconds.
+        idle_timeout: Time in seconds without edges after which the 'edge' readout
+            loop updates the metrics and, with `keepalive`, reads the pin again.
+            Defaults to 60 seconds.
+        gpio: GPIO backend used to access the pins. Defaults to `RPiGpioBackend`.
+            Use `SimulatedGpioBackend` or `ReplayGpioBackend` to run off the Pi.
+        report: Controls which readings are written and published.
+            'all' reports every reading, 'transitions' only reports changes of the
+            pin state together with the duration of the previous state.
+            Defaults to 'all'.
+        keepalive: In 'transitions' report mode, time in seconds after which an
+            unchanged state is reported again as keep-alive. Defaults to None,
+            which disables keep-alives.
+        circumference: Circumference of a single wheel in meters, used for the
+            distance in the on-device metrics. Defaults to 0.88 meters.
+        session_timeout: Time in seconds without rotation which ends a run session.
+            Defaults to 30 seconds.
+        heartbeat_path: Full path to the heartbeat file watched by the supervisor in
+            hamsterwheel_handler.py. Defaults to None, which disables the heartbeat.
+        heartbeat_interval: Maximum time in seconds between two heartbeats of the
+            readout loop. Must be at least `deadtime`. Defaults to 1 second.
+        window: Length in seconds of the windows summarised in aws_aggregate mode.
+            Defaults to 60 seconds.
+        spool_path: Full path to the spool database. If set, every MQTT message is
+            first stored in the spool and only removed once it was published, so
+            no data is lost while the broker is unreachable. Defaults to None.
+        publish_queue_size: Maximum number of events waiting for the MQTT sink.
+            Defaults to 10000.
+        publish_overflow: Policy if the queue of the MQTT sink is full, one of
+            `Sink.supported_overflow`. Defaults to 'drop_oldest'.
+        sinks: Additional sinks the events are fanned out to. Defaults to None.
+        wheels: Configurations of several wheels read out together. Replaces
+            `wheelpin`, `ledpin` and `circumference`. Defaults to None.
+        fast_deadtime: Poll interval in seconds in 'adaptive' readout mode while
+            the wheel turns. Defaults to 20 milliseconds.
+        active_hold: Time in seconds without change after which the 'adaptive'
+            readout mode starts to back off to `deadtime`. Defaults to 2 seconds.
+        metrics_port: TCP port of the HTTP endpoint serving the instrumentation of
+            the readout loop, the logs and the sinks at /metrics in the Prometheus
+            text format. Defaults to None, which disables the endpoint.
+        metrics_host: Address the metrics endpoint listens on. Defaults to '127.0.0.1'.
+        payload_format: Payload of the readings published by the MQTT sink, see
+            `MqttSink` and `payload.py`. Defaults to 'legacy'.
+        history_socket: Full path to the Unix domain socket answering range
+            queries on the recent events with JSON, see `history.py`. Defaults
+            to None, which keeps no history.
+        history_events: Number of recent events kept in memory. Defaults to 10000.
+        history_minutes: Number of per-minute summaries kept in memory.
+            Defaults to 1440.
     """
-    supported_modes = ['local']
+    supported_modes = ['local', 'binary', 'stdout', 'aws', 'aws_aggregate']
+    supported_readout_modes = ['poll', 'edge', 'adaptive']
+    supported_reports = ['all', 'transitions']
 
     def __init__(
         self,
         mode: List[str],
-        wheelpin: int,
-        ledpin: int,
+        wheelpin: Optional[int] = None,
+        ledpin: Optional[int] = None,
         deadtime: float = 1.0,
         local_log_path: Optional[str] = None,
+        event_log_path: Optional[str] = None,
+        readout_mode: str = 'poll',
+        debouncetime: float = 0.005,
+        idle_timeout: float = 60.0,
+        gpio: Optional[GpioBackend] = None,
+        report: str = 'all',
+        keepalive: Optional[float] = None,
+        circumference: float = 0.88,
+        session_timeout: float = 30.0,
+        heartbeat_path: Optional[str] = None,
+        heartbeat_interval: float = 1.0,
+        window: float = 60.0,
+        spool_path: Optional[str] = None,
+        publish_queue_size: int = 10000,
+        publish_overflow: str = 'drop_oldest',
+        sinks: Optional[List[Sink]] = None,
+        wheels: Optional[List[WheelConfig]] = None,
+        fast_deadtime: float = 0.02,
+        active_hold: float = 2.0,
+        metrics_port: Optional[int] = None,
+        metrics_host: str = '127.0.0.1',
+        payload_format: str = 'legacy',
+        history_socket: Optional[str] = None,
+        history_events: int = 10000,
+        history_minutes: int = 1440,
     ) -> None:
         self._local_log_path = local_log_path
-        self._mode = HamsterWheel._validate_mode(mode=mode, local_log_path=local_log_path)
-        self._wheelpin = HamsterWheel._validate_pin(pin=wheelpin)
-        self._ledpin = HamsterWheel._validate_pin(pin=ledpin)
+        self._event_log_path = event_log_path
+        self._mode = HamsterWheel._validate_mode(
+            mode=mode,
+            local_log_path=local_log_path,
+            event_log_path=event_log_path,
+        )
+        wheels = HamsterWheel._validate_wheels(
+            wheels=wheels,
+            wheelpin=wheelpin,
+            ledpin=ledpin,
+            circumference=circumference,
+        )
         self._deadtime = HamsterWheel._validate_deadtime(deadtime=deadtime)
+        self._readout_mode = HamsterWheel._validate_readout_mode(readout_mode=readout_mode)
+        self._debouncetime = HamsterWheel._validate_debouncetime(debouncetime=debouncetime)
+        self._scheduler: Optional[PollScheduler] = None
+        if self._readout_mode == 'adaptive':
+            self._scheduler = PollScheduler(min_interval=fast_deadtime, max_interval=self._deadtime, hold=active_hold)
+        self._idle_timeout = idle_timeout
+        self._io = gpio if gpio is not None else RPiGpioBackend()
+        self._stopped = threading.Event()
+        self._report = HamsterWheel._validate_report(report=report)
+        self._keepalive = HamsterWheel._validate_keepalive(keepalive=keepalive)
+        window = window if 'aws_aggregate' in self._mode else None
+        self._wheels = [_Wheel(config=config, session_timeout=session_timeout, window=window) for config in wheels]
+        self._wheels_by_pin: Dict[int, _Wheel] = {wheel.config.wheelpin: wheel for wheel in self._wheels}
+        self._heartbeat_path = heartbeat_path
+        self._heartbeat_interval = HamsterWheel._validate_heartbeat_interval(heartbeat_interval=heartbeat_interval)
+        self._heartbeat: Optional[Heartbeat] = None
+        self._sinks: List[Sink] = self._mode_sinks(
+            payload_format=payload_format,
+            spool_path=spool_path,
+            publish_queue_size=publish_queue_size,
+            publish_overflow=publish_overflow,
+        )
+        for sink in sinks or []:
+            self.add_sink(sink=sink)
+        self._capture: Optional[EdgeCapture] = None
+        self._metrics_server: Optional[MetricsServer] = None
+        if metrics_port is not None:
+            self._metrics_server = MetricsServer(port=metrics_port, host=metrics_host)
+        self._history_server: Optional[HistoryServer] = None
+        if history_socket is not None:
+            history = RecentHistory(max_events=history_events, max_minutes=history_minutes)
+            self.add_sink(sink=HistorySink(history=history))
+            self._history_server = HistoryServer(history=history, path=history_socket)
 
     @classmethod
-    def _validate_mode(cls, mode: List[str], local_log_path: Optional[str] = None) -> List[str]:
+    def _validate_mode(
+        cls,
+        mode: List[str],
+        local_log_path: Optional[str] = None,
+        event_log_path: Optional[str] = None,
+    ) -> List[str]:
         """Class method to validate user input.
 
         Args:
             mode: Mode input argument.
             local_log_path: Full path to store the readout data in local mode.
+            event_log_path: Full path to the binary event log in binary mode.
 
         Returns:
             Mode if it is a part of the supported modes.
@@ -67,6 +317,14 @@ class HamsterWheel():
                 errmsg = f'local mode requires `local_log_path` which is {local_log_path} and this is not valid.'
                 raise ValueError(errmsg) from AssertionError
 
+        # Make sure that a file path for the binary event log is set
+        if 'binary' in mode:
+            try:
+                assert isinstance(event_log_path, str)
+            except AssertionError:
+                errmsg = f'binary mode requires `event_log_path` which is {event_log_path} and this is not valid.'
+                raise ValueError(errmsg) from AssertionError
+
         return mode
 
     @classmethod
@@ -93,6 +351,56 @@ class HamsterWheel():
 
         return pin
 
+    @classmethod
+    def _validate_wheels(
+        cls,
+        wheels: Optional[List[WheelConfig]],
+        wheelpin: Optional[int],
+        ledpin: Optional[int],
+        circumference: float,
+    ) -> List[WheelConfig]:
+        """Class method to validate user input.
+
+        Args:
+            wheels: Wheels input argument.
+            wheelpin: Wheel pin input argument, used if `wheels` is None.
+            ledpin: LED pin input argument, used if `wheels` is None.
+            circumference: Circumference input argument, used if `wheels` is None.
+
+        Returns:
+            List of wheel configurations. Without `wheels`, a single wheel
+            without wheel ID.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        if wheels is None:
+            try:
+                assert wheelpin is not None
+                assert ledpin is not None
+            except AssertionError:
+                errmsg = 'Either `wheels` or `wheelpin` and `ledpin` are required.'
+                raise ValueError(errmsg) from AssertionError
+            wheels = [WheelConfig(wheel_id=None, wheelpin=wheelpin, ledpin=ledpin, circumference=circumference)]
+
+        try:
+            assert isinstance(wheels, list)
+            assert len(wheels) > 0
+            assert all(isinstance(wheel, WheelConfig) for wheel in wheels)
+            if len(wheels) > 1:
+                assert all(isinstance(wheel.wheel_id, str) for wheel in wheels)
+                assert len({wheel.wheel_id for wheel in wheels}) == len(wheels)
+            assert len({wheel.wheelpin for wheel in wheels}) == len(wheels)
+
+        except AssertionError:
+            errmsg = f'Wheels {wheels} are not supported. Must be a non-empty list of `WheelConfig` with unique wheel pins and unique string wheel IDs.'
+            raise ValueError(errmsg) from AssertionError
+
+        for wheel in wheels:
+            HamsterWheel._validate_pin(pin=wheel.wheelpin)
+            HamsterWheel._validate_pin(pin=wheel.ledpin)
+        return wheels
+
     @classmethod
     def _validate_deadtime(cls, deadtime: float) -> float:
         """Class method to validate user input.
@@ -117,59 +425,561 @@ class HamsterWheel():
 
         return deadtime
 
+    @classmethod
+    def _validate_readout_mode(cls, readout_mode: str) -> str:
+        """Class method to validate user input.
+
+        Args:
+            readout_mode: Readout mode input argument.
+
+        Returns:
+            Readout mode if it is a part of the supported readout modes.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert readout_mode in HamsterWheel.supported_readout_modes
+
+        except AssertionError:
+            errmsg = f'Readout mode {readout_mode} is not among the supported readout modes {HamsterWheel.supported_readout_modes}.'
+            raise ValueError(errmsg) from AssertionError
+
+        return readout_mode
+
+    @classmethod
+    def _validate_debouncetime(cls, debouncetime: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            debouncetime: Debounce time input argument.
+
+        Returns:
+            debouncetime if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(debouncetime, float)
+            assert debouncetime >= 0.0
+            assert debouncetime < 1.0
+
+        except AssertionError:
+            errmsg = f'Debounce time {debouncetime} is not supported. Must be float and between 0 and 1.0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return debouncetime
+
+    @classmethod
+    def _validate_report(cls, report: str) -> str:
+        """Class method to validate user input.
+
+        Args:
+            report: Report input argument.
+
+        Returns:
+            Report if it is a part of the supported reports.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert report in HamsterWheel.supported_reports
+
+        except AssertionError:
+            errmsg = f'Report {report} is not among the supported reports {HamsterWheel.supported_reports}.'
+            raise ValueError(errmsg) from AssertionError
+
+        return report
+
+    @classmethod
+    def _validate_keepalive(cls, keepalive: Optional[float]) -> Optional[float]:
+        """Class method to validate user input.
+
+        Args:
+            keepalive: Keep-alive input argument.
+
+        Returns:
+            keepalive if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        if keepalive is None:
+            return keepalive
+        try:
+            assert isinstance(keepalive, float)
+            assert keepalive > 0.0
+
+        except AssertionError:
+            errmsg = f'Keep-alive {keepalive} is not supported. Must be None or a float larger than 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return keepalive
+
+    @classmethod
+    def _validate_heartbeat_interval(cls, heartbeat_interval: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            heartbeat_interval: Heartbeat interval input argument.
+
+        Returns:
+            heartbeat_interval if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(heartbeat_interval, float)
+            assert heartbeat_interval > 0.0
+
+        except AssertionError:
+            errmsg = f'Heartbeat interval {heartbeat_interval} is not supported. Must be float and larger than 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return heartbeat_interval
+
     def _setup_rpi(self) -> None:
         """Method to set up the GPIO on the RaspberryPi.
         """
         # Set Broadcom mode so we can address GPIO pins by number.
-        io.setmode(io.BCM)
+        self._io.setmode(self._io.BCM)
 
-        # Set LED pin
-        io.setup(self._ledpin, io.OUT)
-        msg = f'Set up GPIO, using led pin {self._ledpin}'
-        log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
+        for wheel in self._wheels:
+            name = '' if wheel.wheel_id is None else f' for wheel {wheel.wheel_id}'
+            # Set LED pin
+            self._io.setup(wheel.config.ledpin, self._io.OUT)
+            msg = f'Set up GPIO, using led pin {wheel.config.ledpin}{name}'
+            log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
+
+            # Set wheel pin
+            self._io.setup(wheel.config.wheelpin, self._io.IN, pull_up_down=self._io.PUD_UP)
+            msg = f'Set up GPIO, using wheel pin {wheel.config.wheelpin}{name}'
+            log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
 
-        # Set wheel pin
-        io.setup(self._wheelpin, io.IN, pull_up_down=io.PUD_UP)
-        msg = f'Set up GPIO, using wheel pin {self._wheelpin}'
+    def _mode_sinks(
+        self,
+        payload_format: str,
+        spool_path: Optional[str],
+        publish_queue_size: int,
+        publish_overflow: str,
+    ) -> List[Sink]:
+        """Method to create the sinks selected by `mode`.
+
+        Args:
+            payload_format: Payload of the readings published by the MQTT sink.
+            spool_path: Full path to the spool database of the MQTT sink.
+            publish_queue_size: Maximum number of events waiting for the MQTT sink.
+            publish_overflow: Policy if the queue of the MQTT sink is full.
+
+        Returns:
+            List of sinks.
+        """
+        sinks: List[Sink] = []
+        if 'local' in self._mode:
+            sinks.append(LocalFileSink(log_path=self._local_log_path))
+        if 'binary' in self._mode:
+            sinks.append(BinaryLogSink(path=self._event_log_path))
+        if 'stdout' in self._mode:
+            sinks.append(StdoutSink())
+        if 'aws' in self._mode or 'aws_aggregate' in self._mode:
+            sinks.append(MqttSink(
+                client_name=AWS_CLIENT_NAME,
+                endpoint=AWS_ENDPOINT,
+                ca_file=AWS_CA_FILE,
+                key=AWS_KEY,
+                cert=AWS_CERT,
+                topic=AWS_TOPIC,
+                aggregate_topic=AWS_TOPIC_AGGREGATE,
+                metrics_topic=AWS_TOPIC_METRICS,
+                log_path=LOG_HAMSTERWHEEL,
+                publish_readings='aws' in self._mode,
+                spool_path=spool_path,
+                spool_max_messages=SPOOL_MAX_MESSAGES,
+                retry_interval=SPOOL_RETRY_INTERVAL,
+                payload_format=payload_format,
+                batch_size=PUBLISH_BATCH_SIZE,
+                batch_interval=PUBLISH_BATCH_INTERVAL,
+                maxsize=publish_queue_size,
+                overflow=publish_overflow,
+                on_stats=self._log_sink_stats,
+                stats_interval=PUBLISH_STATS_INTERVAL,
+            ))
+        return sinks
+
+    def add_sink(self, sink: Sink) -> None:
+        """Method to add a sink. Must be called before `readout`.
+
+        Args:
+            sink: Sink the events are fanned out to.
+        """
+        self._sinks.append(sink)
+
+    @staticmethod
+    def _log_sink_stats(stats: dict) -> None:
+        """Method to log the counters of a sink.
+
+        Args:
+            stats: Counters from `Sink.stats`.
+        """
+        msg = f'Sink stats: {stats}'
         log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
 
+    def _emit(self, event: Event) -> None:
+        """Method to fan an event out to all sinks.
 
-    def readout(self) -> None:
-        """Method to start the readout of the reed sensor.
+        Args:
+            event: Event to queue in every sink.
+        """
+        _EVENTS.inc(labels={'kind': event.kind})
+        for sink in self._sinks:
+            sink.put(event)
+
+    def _register_gauges(self) -> None:
+        """Method to expose the queue depths and drop counters of the sinks and the edge capture.
+        """
+        REGISTRY.gauge(
+            name='hamsterwheel_sink_queue_depth',
+            documentation='Number of events waiting in the queue of a sink.',
+            callback=lambda: [({'sink': sink.name}, sink.stats()['depth']) for sink in self._sinks],
+        )
+        REGISTRY.gauge(
+            name='hamsterwheel_sink_dropped_total',
+            documentation='Number of events a sink dropped because its queue was full.',
+            callback=lambda: [({'sink': sink.name}, sink.stats()['dropped']) for sink in self._sinks],
+            kind='counter',
+        )
+        REGISTRY.gauge(
+            name='hamsterwheel_sink_failed_total',
+            documentation='Number of events a sink failed to handle.',
+            callback=lambda: [({'sink': sink.name}, sink.stats()['failed']) for sink in self._sinks],
+            kind='counter',
+        )
+        REGISTRY.gauge(
+            name='hamsterwheel_edge_buffer_dropped_total',
+            documentation='Number of edges overwritten in the ring buffer before they were handled.',
+            callback=lambda: [({}, self._capture.buffer.dropped)] if self._capture is not None else [],
+            kind='counter',
+        )
+
+    def _read_pin(self, wheel: _Wheel) -> int:
+        """Method to read the wheel pin of a wheel.
+
+        Args:
+            wheel: Wheel to read.
+
+        Returns:
+            State of the wheel pin, 0 if the loop is closed.
+        """
+        start = time.perf_counter()
+        pin_state = self._io.input(wheel.config.wheelpin)
+        _GPIO_READ_SECONDS.observe(time.perf_counter() - start)
+        return pin_state
+
+    def _wait(self, interval: float) -> None:
+        """Method to sleep until the next poll and record how late the loop woke up.
+
+        Args:
+            interval: Time in seconds until the next poll.
+        """
+        start = time.monotonic()
+        if not self._stopped.wait(interval):
+            _LOOP_JITTER_SECONDS.observe(
+                max(0.0, time.monotonic() - start - interval),
+                labels={'readout_mode': self._readout_mode},
+            )
+
+    @property
+    def metrics(self) -> dict:
+        """Current on-device metrics, see `WheelMetrics.snapshot`. Keyed by wheel ID for several wheels."""
+        if len(self._wheels) == 1:
+            return self._wheels[0].metrics.snapshot()
+        return {wheel.wheel_id: wheel.metrics.snapshot() for wheel in self._wheels}
+
+    def _report_metrics(self, wheel: _Wheel, summaries: List[dict], timestamp_ns: int) -> None:
+        """Method to log the finished sessions and days and emit them as events.
+
+        Args:
+            wheel: Wheel the summaries belong to.
+            summaries: Session and daily summaries from `WheelMetrics`.
+            timestamp_ns: Epoch timestamp in nanoseconds at which they finished.
+        """
+        for summary in summaries:
+            summary = wheel.tag(summary)
+            msg = f'Metrics: {json.dumps(summary, separators=(",", ":"))}'
+            log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
+            self._emit(Event(kind='metrics', timestamp_ns=timestamp_ns, summary=summary, wheel_id=wheel.wheel_id))
+
+    def _report_aggregates(self, wheel: _Wheel, summaries: List[dict], timestamp_ns: int) -> None:
+        """Method to emit the summaries of finished windows in aws_aggregate mode.
+
+        Args:
+            wheel: Wheel the summaries belong to.
+            summaries: Window summaries from `WindowAggregator`.
+            timestamp_ns: Epoch timestamp in nanoseconds at which they finished.
+        """
+        for summary in summaries:
+            self._emit(Event(kind='aggregate', timestamp_ns=timestamp_ns, summary=wheel.tag(summary), wheel_id=wheel.wheel_id))
+
+    def _check_transition(self, wheel: _Wheel, pin_state: int, timestamp_ns: int) -> Tuple[bool, bool, Optional[float]]:
+        """Method to decide if a reading is reported.
 
-        If readout mode 'local', puts pin_state in the logfile.
+        Args:
+            wheel: Wheel of the reading.
+            pin_state: State of the wheel pin, 0 if the loop is closed.
+            timestamp_ns: Epoch timestamp of the reading in nanoseconds.
+
+        Returns:
+            Tuple of three values: True if the reading is reported, True if it is
+            reported as keep-alive, and the duration in seconds of the previous
+            state (of the current state for keep-alives), None if unknown.
         """
-        # Set GPIO
-        self._setup_rpi()
+        changed = pin_state != wheel.last_pin_state
+        since_change = None
+        if wheel.last_change_ns is not None:
+            since_change = (timestamp_ns - wheel.last_change_ns) / 1e9
+        if changed:
+            wheel.last_change_ns = timestamp_ns
+
+        if self._report == 'all':
+            return True, False, None
+        if changed:
+            wheel.last_report_ns = timestamp_ns
+            return True, False, since_change
+        if self._keepalive is not None and timestamp_ns - wheel.last_report_ns >= self._keepalive * 1e9:
+            wheel.last_report_ns = timestamp_ns
+            return True, True, since_change
+        return False, False, None
+
+    def _record_pin_state(self, wheel: _Wheel, pin_state: int, timestamp_ns: Optional[int] = None) -> bool:
+        """Method to handle a single reading of the reed sensor of a wheel.
 
-        msg = 'Started script...'
-        log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)    
+        Args:
+            wheel: Wheel of the reading.
+            pin_state: State of the wheel pin, 0 if the loop is closed.
+            timestamp_ns: Epoch timestamp of the reading in nanoseconds.
+                Defaults to the current time.
 
+        Returns:
+            True if the pin state changed.
+        """
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        changed = pin_state != wheel.last_pin_state
+        report, keepalive, duration = self._check_transition(wheel=wheel, pin_state=pin_state, timestamp_ns=timestamp_ns)
+        wheel.last_pin_state = pin_state
+        self._report_metrics(
+            wheel=wheel,
+            summaries=wheel.metrics.update(timestamp_ns=timestamp_ns, pin_state=pin_state),
+            timestamp_ns=timestamp_ns,
+        )
+        if wheel.aggregator is not None:
+            self._report_aggregates(
+                wheel=wheel,
+                summaries=wheel.aggregator.add(timestamp_ns=timestamp_ns, pin_state=pin_state),
+                timestamp_ns=timestamp_ns,
+            )
+
+        if changed:
+            # Turn LED on while the loop is closed
+            self._io.output(wheel.config.ledpin, self._io.HIGH if pin_state == 0 else self._io.LOW)
+        if report:
+            self._emit(Event(
+                kind='reading',
+                timestamp_ns=timestamp_ns,
+                pin_state=pin_state,
+                edge=changed,
+                keepalive=keepalive,
+                duration=duration,
+                wheel_id=wheel.wheel_id,
+            ))
+        return changed
+
+    def _readout_poll(self) -> None:
+        """Method to sample the reed sensors of all wheels once per `deadtime`.
+        """
+        while not self._stopped.is_set():
+            self._beat()
+            self._wait(self._deadtime)
+            timestamp_ns = time.time_ns()
+            for wheel in self._wheels:
+                self._record_pin_state(wheel=wheel, pin_state=self._read_pin(wheel=wheel), timestamp_ns=timestamp_ns)
+
+    def _readout_adaptive(self) -> None:
+        """Method to sample the reed sensors of all wheels at the interval chosen by `PollScheduler`.
+        """
+        while not self._stopped.is_set():
+            self._beat()
+            self._wait(self._scheduler.interval)
+            timestamp_ns = time.time_ns()
+            changed = False
+            for wheel in self._wheels:
+                pin_state = self._read_pin(wheel=wheel)
+                changed = self._record_pin_state(wheel=wheel, pin_state=pin_state, timestamp_ns=timestamp_ns) or changed
+            self._scheduler.update(changed=changed, now=time.monotonic())
+
+    def _readout_edge(self) -> None:
+        """Method to record every debounced edge of the reed sensors.
+
+        Sleeps until the GPIO callbacks push edges into the shared ring buffer,
+        so the loop only wakes up when a wheel moves, `idle_timeout` or
+        `keepalive` has passed, the next heartbeat is due or, in aws_aggregate
+        mode, the current window of a wheel ends.
+        """
+        capture = EdgeCapture(
+            io=self._io,
+            pins=[wheel.config.wheelpin for wheel in self._wheels],
+            debouncetime=self._debouncetime,
+        )
+        capture.start()
+        self._capture = capture
         try:
-            # Readout loop
-            while True:
-                msg = 'Running...'
+            timeout = self._idle_timeout if self._keepalive is None else min(self._idle_timeout, self._keepalive)
+            idle_since = time.monotonic()
+            while not self._stopped.is_set():
+                wait = timeout if self._heartbeat is None else min(timeout, self._heartbeat.interval)
+                window_ends = [
+                    wheel.aggregator.window_end_ns() for wheel in self._wheels if wheel.aggregator is not None
+                ]
+                window_ends = [window_end for window_end in window_ends if window_end is not None]
+                if window_ends:
+                    wait = min(wait, max(0.0, (min(window_ends) - time.time_ns()) / 1e9))
+                woke = capture.wait(timeout=wait)
+                self._beat()
+                if not woke:
+                    now_ns = time.time_ns()
+                    for wheel in self._wheels:
+                        if wheel.aggregator is not None:
+                            self._report_aggregates(
+                                wheel=wheel,
+                                summaries=wheel.aggregator.flush(timestamp_ns=now_ns),
+                                timestamp_ns=now_ns,
+                            )
+                    if time.monotonic() - idle_since < timeout:
+                        continue
+                    idle_since = time.monotonic()
+                    for wheel in self._wheels:
+                        self._report_metrics(wheel=wheel, summaries=wheel.metrics.tick(timestamp_ns=now_ns), timestamp_ns=now_ns)
+                        if self._keepalive is not None:
+                            self._record_pin_state(wheel=wheel, pin_state=self._read_pin(wheel=wheel))
+                    continue
+                idle_since = time.monotonic()
+                for timestamp_ns, pin, pin_state in capture.drain():
+                    _EDGE_DELAY_SECONDS.observe((time.monotonic_ns() - timestamp_ns) / 1e9)
+                    self._record_pin_state(
+                        wheel=self._wheels_by_pin[pin],
+                        pin_state=pin_state,
+                        timestamp_ns=capture.to_epoch_ns(timestamp_ns),
+                    )
+        finally:
+            capture.stop()
+
+    def _beat(self) -> None:
+        """Method to signal the supervisor that the readout loop is alive.
+        """
+        if self._heartbeat is not None:
+            self._heartbeat.beat()
+
+    def stop(self) -> None:
+        """Method to make a running `readout` return after the current iteration.
+        """
+        self._stopped.set()
+
+    def _open_log_writers(self) -> None:
+        """Method to buffer and rotate the log files written from the readout loop and the sinks.
+        """
+        log_paths = [LOG_HAMSTERWHEEL]
+        if 'local' in self._mode and self._local_log_path not in log_paths:
+            log_paths.append(self._local_log_path)
+        for log_path in log_paths:
+            open_log_writer(
+                log_path=log_path,
+                flush_lines=LOG_FLUSH_LINES,
+                flush_interval=LOG_FLUSH_INTERVAL,
+                fsync=LOG_FSYNC,
+                fsync_interval=LOG_FSYNC_INTERVAL,
+                max_queue=LOG_MAX_QUEUE,
+                rotation=LogRotator(
+                    log_path=log_path,
+                    max_bytes=LOG_ROTATE_BYTES,
+                    max_age=LOG_ROTATE_AGE,
+                    compression=LOG_COMPRESSION,
+                    keep_bytes=LOG_KEEP_BYTES,
+                ),
+            )
+
+    def _close_heartbeat(self) -> None:
+        """Method to close the heartbeat file if it is open.
+        """
+        if self._heartbeat is not None:
+            self._heartbeat.close()
+            self._heartbeat = None
+
+    def _close_sinks(self) -> None:
+        """Method to handle the queued events and close all sinks.
+        """
+        for sink in self._sinks:
+            sink.close(timeout=PUBLISH_CLOSE_TIMEOUT)
+            msg = f'Closed {sink.name} sink, stats: {sink.stats()}'
+            log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
+
+    def _cleanup(self) -> None:
+        """Method to release the GPIO, close the sinks and flush the logs.
+        """
+        self._io.cleanup()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+        if self._history_server is not None:
+            self._history_server.stop()
+        if self._scheduler is not None:
+            msg = f'Poll scheduler stats: {self._scheduler.stats()}'
+            log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
+        self._close_sinks()
+        self._close_heartbeat()
+        close_log_writers()
+
+    def readout(self) -> None:
+        """Method to start the readout of the reed sensor and the sinks.
+        """
+        self._open_log_writers()
+        # Release the GPIO, close the sinks and flush the logs also if the
+        # start or the readout loop fail
+        try:
+            for sink in self._sinks:
+                sink.start()
+            if self._heartbeat_path is not None:
+                self._heartbeat = Heartbeat(path=self._heartbeat_path, interval=self._heartbeat_interval)
+            if self._metrics_server is not None:
+                self._register_gauges()
+                self._metrics_server.start()
+                msg = f'Serving metrics at http://{self._metrics_server.host}:{self._metrics_server.port}/metrics'
                 log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
-                time.sleep(self._deadtime)
-                if io.input(self._wheelpin) == 0:
-                    if 'local' in self._mode:
-                        # Turn LED on
-                        io.output(self._ledpin, io.HIGH)
-                        # Record that loop is closed
-                        msg = 'pin_state = 0'
-                        log(log_path=self._local_log_path, logmsg=msg, printout=True)
-                else:
-                    if 'local' in self._mode:
-                        # Turn LED off
-                        io.output(self._ledpin, io.LOW)
-                        # Record that loop is open
-                        msg = 'pin_state = 1'
-                        log(log_path=self._local_log_path, logmsg=msg, printout=True)
+            if self._history_server is not None:
+                self._history_server.start()
+                msg = f'Serving the recent history at {self._history_server.path}'
+                log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
+            # Set GPIO
+            self._setup_rpi()
+
+            msg = f'Started script in {self._readout_mode} readout mode with sinks {[s.name for s in self._sinks]}...'
+            log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
+
+            # Readout loop
+            if self._readout_mode == 'edge':
+                self._readout_edge()
+            elif self._readout_mode == 'adaptive':
+                self._readout_adaptive()
+            else:
+                self._readout_poll()
 
         except KeyboardInterrupt:
-            io.cleanup()
             sys.exit()
 
+        finally:
+            self._cleanup()
+
 
 if __name__ == "__main__":
     hamsterwheel = HamsterWheel(
@@ -177,6 +987,14 @@ if __name__ == "__main__":
         wheelpin=18,
         ledpin=26,
         deadtime=1.0,
-        local_log_path=LOG_HAMSTERWHEEL
+        local_log_path=LOG_HAMSTERWHEEL,
+        event_log_path=EVENT_LOG,
+        heartbeat_path=HEARTBEAT,
+        heartbeat_interval=HEARTBEAT_INTERVAL,
+        metrics_port=METRICS_PORT,
+        metrics_host=METRICS_HOST,
+        history_socket=HISTORY_SOCKET,
+        history_events=HISTORY_EVENTS,
+        history_minutes=HISTORY_MINUTES,
     )
     hamsterwheel.readout()
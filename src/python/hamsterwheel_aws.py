@@ -1,234 +1,85 @@
-from datetime import datetime
-import sys
+"""
+================================================================================
+Description: This script runs the readout of hamsterwheel.py with the readings
+             published to AWS IoT. The readout and the sinks live in
+             hamsterwheel.py; `HamsterWheel` is re-exported for existing imports
+             with the deprecated AWS methods of this script.
+================================================================================
+"""
 import time
-from typing import List, Optional
-
-import RPi.GPIO as io
-
-from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+import warnings
 
 from constants import (
-    LOG_HAMSTERWHEEL,
     AWS_CLIENT_NAME,
     AWS_ENDPOINT,
     AWS_CA_FILE,
     AWS_KEY,
     AWS_CERT,
     AWS_TOPIC,
+    AWS_TOPIC_AGGREGATE,
+    AWS_TOPIC_METRICS,
+    LOG_HAMSTERWHEEL,
+    EVENT_LOG,
+    HEARTBEAT,
+    HEARTBEAT_INTERVAL,
+    HISTORY_SOCKET,
+    HISTORY_EVENTS,
+    HISTORY_MINUTES,
+    METRICS_HOST,
+    METRICS_PORT,
+    PAYLOAD_FORMAT,
+    SPOOL,
 )
-
+from hamsterwheel import HamsterWheel as _HamsterWheel
+from payload import encode_legacy
+from sinks import MqttSink
 from utils import log
 
+__all__ = ['HamsterWheel']
 
-class HamsterWheel():
-    """Class to handle data collection for the hamsterwheel.
-
-    Attributes:
-        mode: Controls output location of the sensor data.
-            Currently supports: local
-        wheelpin: GPIO pin to communicate with the reed sensor.
-        wheelpin: GPIO pin to control the LED.
-        deadtime: Readout dead time to protect the sensor in seconds.
-            Defaults to 1 second.
-        local_log_path: Full path to store the readout data in local mode.
-            Is required if 'local' is part of `mode`.
-    """
-    supported_modes = ['local', 'aws']
 
-    def __init__(
-        self,
-        mode: List[str],
-        wheelpin: int,
-        ledpin: int,
-        deadtime: float = 1.0,
-        local_log_path: Optional[str] = None,
-    ) -> None:
-        self._local_log_path = local_log_path
-        self._mode = HamsterWheel._validate_mode(mode=mode, local_log_path=local_log_path)
-        self._wheelpin = HamsterWheel._validate_pin(pin=wheelpin)
-        self._ledpin = HamsterWheel._validate_pin(pin=ledpin)
-        self._deadtime = HamsterWheel._validate_deadtime(deadtime=deadtime)
+class HamsterWheel(_HamsterWheel):
+    """Class of hamsterwheel.py with the deprecated AWS methods of this script.
 
-    @classmethod
-    def _validate_mode(cls, mode: List[str], local_log_path: Optional[str] = None) -> List[str]:
-        """Class method to validate user input.
-
-        Args:
-            mode: Mode input argument.
-            local_log_path: Full path to store the readout data in local mode.
-
-        Returns:
-            Mode if it is a part of the supported modes.
-
-        Raises:
-            ValueError if the user input is not supported.
-        """
-        try:
-            assert isinstance(mode, list)
-            for set_mode in mode:
-                assert set_mode in HamsterWheel.supported_modes
-        except AssertionError:
-            errmsg = f'Mode {mode} is not among the supported modes {HamsterWheel.supported_modes}.'
-            raise ValueError(errmsg) from AssertionError
-
-        # Make sure that a file path for local storage is set
-        if 'local' in mode:
-            try:
-                assert isinstance(local_log_path, str)
-            except AssertionError:
-                errmsg = f'local mode requires `local_log_path` which is {local_log_path} and this is not valid.'
-                raise ValueError(errmsg) from AssertionError
-
-        return mode
-
-    @classmethod
-    def _validate_pin(cls, pin: int) -> int:
-        """Class method to validate user input.
-
-        Args:
-            pin: pin input argument.
-
-        Returns:
-            Pin if it is valid.
-
-        Raises:
-            ValueError if the user input is not supported.
-        """
-        try:
-            assert isinstance(pin, int)
-            assert pin > 0
-            assert pin < 40
-
-        except AssertionError:
-            errmsg = f'Pin {pin} is supported. Must be smaller 40 and larger 0.'
-            raise ValueError(errmsg) from AssertionError
-
-        return pin
+    The 'aws' mode publishes the readings with `sinks.MqttSink`.
+    """
 
-    @classmethod
-    def _validate_deadtime(cls, deadtime: float) -> float:
-        """Class method to validate user input.
+    def setup_aws(self):
+        """Method to set up communication with AWS.
 
-        Args:
-            deadtime: Deadtime input argument.
+        Deprecated, the 'aws' mode creates the client in `sinks.MqttSink`.
 
         Returns:
-            deadtime if it is valid.
-
-        Raises:
-            ValueError if the user input is not supported.
-        """
-        try:
-            assert isinstance(deadtime, float)
-            assert deadtime > 0.0
-            assert deadtime < 5.0
-
-        except AssertionError:
-            errmsg = f'Deadtime {deadtime} is supported. Must be float and between 0 and 5.0.'
-            raise ValueError(errmsg) from AssertionError
-
-        return deadtime
-
-    def _setup_rpi(self) -> None:
-        """Method to set up the GPIO on the RaspberryPi.
+            AWSIoTMQTTClient, not yet connected.
         """
-        # Set Broadcom mode so we can address GPIO pins by number.
-        io.setmode(io.BCM)
-
-        # Set LED pin
-        io.setup(self._ledpin, io.OUT)
-        msg = f'Set up GPIO, using led pin {self._ledpin}'
-        log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
-
-        # Set wheel pin
-        io.setup(self._wheelpin, io.IN, pull_up_down=io.PUD_UP)
-        msg = f'Set up GPIO, using wheel pin {self._wheelpin}'
-        log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
-
-    def setup_aws(self) -> AWSIoTMQTTClient:
-        """Method to set up communication with AWS.
-
-        """
-        mqtt_client = AWSIoTMQTTClient(AWS_CLIENT_NAME)
-        mqtt_client.configureEndpoint(AWS_ENDPOINT, 8883)
-
-        mqtt_client.configureCredentials(
-            CAFilePath=AWS_CA_FILE,
-            KeyPath=AWS_KEY,
-            CertificatePath=AWS_CERT
+        warnings.warn('setup_aws is deprecated, use the aws mode or MqttSink.', DeprecationWarning, stacklevel=2)
+        sink = MqttSink(
+            client_name=AWS_CLIENT_NAME,
+            endpoint=AWS_ENDPOINT,
+            ca_file=AWS_CA_FILE,
+            key=AWS_KEY,
+            cert=AWS_CERT,
+            topic=AWS_TOPIC,
+            aggregate_topic=AWS_TOPIC_AGGREGATE,
+            metrics_topic=AWS_TOPIC_METRICS,
+            log_path=LOG_HAMSTERWHEEL,
         )
-        return mqtt_client
-    
-    def send_message(self, topic: str, message: str, mqtt_client: AWSIoTMQTTClient) -> None:
+        return sink.create_client()
+
+    def send_message(self, topic: str, message: str, mqtt_client) -> None:
         """Method to send a message to the AWS mqtt endpoint.
 
+        Deprecated, the 'aws' mode publishes the readings with `sinks.MqttSink`.
+
         Args:
             topic: Topic to publish to.
             message: Message to send.
             mqtt_client: MQTT connection.
         """
-
-        now = datetime.now().strftime("%Y-%m-%d %I:%M:%S")
-        mqtt_client.publish(
-            topic,
-            "{\"Timestamp\" :\"" + str(now) +
-            "\", \"Message\":\"" + message + "\"}", 0)
+        warnings.warn('send_message is deprecated, use the aws mode or MqttSink.', DeprecationWarning, stacklevel=2)
+        mqtt_client.publish(topic, encode_legacy(timestamp_ns=time.time_ns(), message=message), 0)
         msg = f'Published to topic {topic} with message {message}.'
         log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
-        
-
-    def readout(self) -> None:
-        """Method to start the readout of the reed sensor.
-
-        If readout mode 'local', puts pin_state in the logfile.
-        If readout mode 'aws', sends message to specified endpoint.
-        """
-        # Set GPIO
-        self._setup_rpi()
-        # Set AWS if selected
-        if 'aws' in self._mode:
-            mqtt_client = self.setup_aws()
-            mqtt_connection = mqtt_client.connect()
-
-        msg = 'Started script...'
-        log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
-      
-        try:
-            # Readout loop
-            while True:
-                msg = 'Running...'
-                log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
-                time.sleep(self._deadtime)
-                if io.input(self._wheelpin) == 0:
-                    msg = '0'
-                    if 'local' in self._mode:
-                        # Turn LED on
-                        io.output(self._ledpin, io.HIGH)
-                        log(log_path=self._local_log_path, logmsg=msg, printout=True)
-                    if 'aws' in self._mode:
-                        if mqtt_client is None:
-                            msg = 'Error, MQTT client not initialized.'
-                            log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
-                        else:
-                            self.send_message(topic=AWS_TOPIC, message=msg, mqtt_client=mqtt_client)
-                else:
-                    msg = '1'
-                    if 'local' in self._mode:
-                        # Turn LED off
-                        io.output(self._ledpin, io.LOW)  
-                        log(log_path=self._local_log_path, logmsg=msg, printout=True)
-                    if 'aws' in self._mode:
-                        if mqtt_client is None:
-                            msg = 'Error, MQTT client not initialized.'
-                            log(log_path=LOG_HAMSTERWHEEL, logmsg=msg, printout=True)
-                        else:
-                            self.send_message(topic=AWS_TOPIC, message=msg, mqtt_client=mqtt_client)
-
-        except KeyboardInterrupt:
-            io.cleanup()
-            if mqtt_client:
-                mqtt_client.disconnect()
-            sys.exit()
 
 
 if __name__ == "__main__":
@@ -237,6 +88,16 @@ if __name__ == "__main__":
         wheelpin=4,
         ledpin=26,
         deadtime=1.0,
-        local_log_path=LOG_HAMSTERWHEEL
+        local_log_path=LOG_HAMSTERWHEEL,
+        event_log_path=EVENT_LOG,
+        spool_path=SPOOL,
+        heartbeat_path=HEARTBEAT,
+        heartbeat_interval=HEARTBEAT_INTERVAL,
+        metrics_port=METRICS_PORT,
+        metrics_host=METRICS_HOST,
+        payload_format=PAYLOAD_FORMAT,
+        history_socket=HISTORY_SOCKET,
+        history_events=HISTORY_EVENTS,
+        history_minutes=HISTORY_MINUTES,
     )
     hamsterwheel.readout()
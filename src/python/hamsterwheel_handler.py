@@ -1,34 +1,67 @@
+import fcntl
 import os
-import subprocess
-import time
+import signal
+import sys
 
+from supervisor import Supervisor
 from utils import log
 
 from constants import (
-    HAMSTERWHEEL_LOG_FILE_PATH,
-    HAMSTERWHEEL_PATH,
-    HAMSTERWHEEL_HANDLER_LOG_FILE_PATH
+    HAMSTERWHEEL_AWS_SCRIPT,
+    HAMSTERWHEEL_SCRIPT,
+    HEARTBEAT,
+    HEARTBEAT_DEADLINE,
+    HEARTBEAT_STARTUP_TIMEOUT,
+    LOG_SUPERVISOR,
+    RESTART_MAX_BACKOFF,
+    RESTART_MIN_BACKOFF,
+    SUPERVISOR_KILL_TIMEOUT,
+    SUPERVISOR_LOCK,
+    SUPERVISOR_STATS,
+    SUPERVISOR_STOP_TIMEOUT,
 )
 
-# Check if the log file is populating for the hamsterwheel script. If it i
-# Get file size, wait two seconds, get the file size again, and a third time
-file_size_1 = os.stat(HAMSTERWHEEL_LOG_FILE_PATH).st_size
-# Wait for 2 seconds
-time.sleep(2)
-# Get new file size
-file_size_2 = os.stat(HAMSTERWHEEL_LOG_FILE_PATH).st_size
-# Wait for 2 seconds
-time.sleep(2)
-# Get new file size
-file_size_3 = os.stat(HAMSTERWHEEL_LOG_FILE_PATH).st_size
+# Readout scripts which can be selected by name
+SCRIPTS = {
+    'hamsterwheel': HAMSTERWHEEL_SCRIPT,
+    'aws': HAMSTERWHEEL_AWS_SCRIPT,
+}
 
-# If all three readings have the same file size, the feed is stale
-if (file_size_1 == file_size_2) & (file_size_1 == file_size_3):
-    # Add to a logfile that the script was started
-    msg = f'Starting hamsterwheel script. Logfile sizes: [{file_size_1}, {file_size_2}, {file_size_3}]'
-    log(log_path=HAMSTERWHEEL_HANDLER_LOG_FILE_PATH, logmsg=msg)
-    subprocess.call(['sh', HAMSTERWHEEL_PATH])
+if __name__ == '__main__':
+    # Only one supervisor may run. The lock is released by the kernel when the
+    # process exits, so a second supervisor, e.g. started by a leftover cron
+    # entry of the old handler, exits instead of starting a second readout
+    lock_file = open(SUPERVISOR_LOCK, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        msg = f'Supervisor is already running, {SUPERVISOR_LOCK} is locked, exiting'
+        log(log_path=LOG_SUPERVISOR, logmsg=msg, printout=True)
+        sys.exit(0)
 
-else:
-    msg = f'Hamsterwheel script was running. Logfile sizes: [{file_size_1}, {file_size_2}, {file_size_3}]'
-    log(log_path=HAMSTERWHEEL_HANDLER_LOG_FILE_PATH, logmsg=msg)
+    # Script to supervise: the first argument, else the HAMSTERWHEEL_SCRIPT
+    # environment variable, else hamsterwheel.py. Either is a name of SCRIPTS,
+    # e.g. 'aws' for hamsterwheel_aws.py, or the path to a script
+    script = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('HAMSTERWHEEL_SCRIPT', 'hamsterwheel')
+    script = SCRIPTS.get(script, script)
+
+    # Run the script and restart it as soon as it exits or its readout loop
+    # stops writing the heartbeat
+    supervisor = Supervisor(
+        command=[sys.executable, script],
+        heartbeat_path=HEARTBEAT,
+        log_path=LOG_SUPERVISOR,
+        stats_path=SUPERVISOR_STATS,
+        deadline=HEARTBEAT_DEADLINE,
+        startup_timeout=HEARTBEAT_STARTUP_TIMEOUT,
+        min_backoff=RESTART_MIN_BACKOFF,
+        max_backoff=RESTART_MAX_BACKOFF,
+        stop_timeout=SUPERVISOR_STOP_TIMEOUT,
+        kill_timeout=SUPERVISOR_KILL_TIMEOUT,
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.stop())
+
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        supervisor.stop()
@@ -0,0 +1,96 @@
+"""
+================================================================================
+Description: This script contains the heartbeat written by the readout loop in
+             hamsterwheel.py and read by the supervisor in
+             hamsterwheel_handler.py
+================================================================================
+"""
+import os
+import struct
+import time
+from typing import Optional, Tuple
+
+# Monotonic timestamp in nanoseconds and process id of the writer
+HEARTBEAT = struct.Struct('<qI')
+
+
+class Heartbeat():
+    """Class to signal that the readout loop is alive.
+
+    The heartbeat is a 12-byte file, overwritten in place with the current
+    `time.monotonic_ns()` and the process id. The file stays open, so a beat
+    is a single `pwrite` without allocation. Beats closer together than a
+    quarter of `interval` are skipped.
+
+    Attributes:
+        path: Full path to the heartbeat file.
+        interval: Maximum time in seconds between two beats of a healthy loop.
+            Defaults to 1 second.
+    """
+
+    def __init__(self, path: str, interval: float = 1.0) -> None:
+        self.path = path
+        self.interval = Heartbeat._validate_interval(interval=interval)
+        self._min_gap_ns = int(interval * 1e9 / 4)
+        self._pid = os.getpid()
+        self._last_ns = 0
+        self._fd: Optional[int] = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+
+    @classmethod
+    def _validate_interval(cls, interval: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            interval: Heartbeat interval input argument.
+
+        Returns:
+            interval if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(interval, float)
+            assert interval > 0.0
+
+        except AssertionError:
+            errmsg = f'Heartbeat interval {interval} is not supported. Must be float and larger than 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return interval
+
+    def beat(self) -> None:
+        """Method to write the current time to the heartbeat file.
+        """
+        now_ns = time.monotonic_ns()
+        if self._fd is None or now_ns - self._last_ns < self._min_gap_ns:
+            return
+        os.pwrite(self._fd, HEARTBEAT.pack(now_ns, self._pid), 0)
+        self._last_ns = now_ns
+
+    def close(self) -> None:
+        """Method to close the heartbeat file.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def read_heartbeat(path: str) -> Optional[Tuple[int, int]]:
+    """Function to read the last beat of a heartbeat file.
+
+    Args:
+        path: Full path to the heartbeat file.
+
+    Returns:
+        Tuple of the monotonic timestamp in nanoseconds and the process id of
+        the writer, or None if the file does not exist or is incomplete.
+    """
+    try:
+        with open(path, 'rb') as file:
+            data = file.read(HEARTBEAT.size)
+    except FileNotFoundError:
+        return None
+    if len(data) < HEARTBEAT.size:
+        return None
+    return HEARTBEAT.unpack(data)
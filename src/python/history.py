@@ -0,0 +1,468 @@
+"""
+================================================================================
+Description: This script contains the in-memory history of the recent events
+             of the readout daemon and the local server answering range
+             queries on it with JSON, so dashboards and health checks need
+             neither the SD card nor the cloud:
+
+                 curl --unix-socket hamsterwheel_history.sock \
+                     'http://localhost/events?last=3600&wheel=cage1'
+
+             GET /events   Events, optionally filtered by `kind` and `limit`ed
+                           to the newest ones.
+             GET /minutes  Per-minute summaries of the readings. 'Readings'
+                           counts the reported readings, which depends on the
+                           report mode: every reading in 'all', only the
+                           changes and keep-alives in 'transitions'. 'Edges'
+                           and 'Rotations' are the same in both modes.
+             GET /summary  Totals per wheel and the time of its last reading.
+             All endpoints take `start` and `end` as epoch seconds or `last` as
+             seconds before now, and `wheel` to select a wheel.
+================================================================================
+"""
+from collections import deque
+import json
+import os
+import threading
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sinks import Event, Sink
+
+NS_PER_MINUTE = 60_000_000_000
+
+
+def event_to_dict(event: Event) -> dict:
+    """Function to convert an event into a JSON serializable dictionary.
+
+    Args:
+        event: Event of the readout loop.
+
+    Returns:
+        Dictionary with the kind, the epoch timestamp in milliseconds and the
+        fields of the event which are set.
+    """
+    fields = {'Kind': event.kind, 'Timestamp': event.timestamp_ns // 1_000_000}
+    if event.wheel_id is not None:
+        fields['WheelId'] = event.wheel_id
+    if event.pin_state is not None:
+        fields['PinState'] = event.pin_state
+        fields['Edge'] = event.edge
+        fields['Keepalive'] = event.keepalive
+    if event.duration is not None:
+        fields['Duration'] = round(event.duration, 3)
+    if event.summary is not None:
+        fields['Summary'] = event.summary
+    return fields
+
+
+class RecentHistory():
+    """Class to keep the recent events and per-minute summaries in memory.
+
+    The events are kept in a ring of `max_events` entries sorted by their
+    timestamps, so a time range is found by bisection. Events are usually
+    emitted in that order; an event older than the newest kept one, e.g. of
+    another wheel or after the clock was set back, is moved to its place and
+    counted in `reordered`. In a full ring an event older than all kept events
+    is not kept.
+
+    The per-minute summaries count the reported readings, the edges, the
+    rotations (the reed sensor closes, as in `WindowAggregator`) and the
+    keep-alives of every wheel. The number of readings depends on the report
+    mode of the daemon, in 'transitions' mode it is the number of edges and
+    keep-alives. All methods are thread safe.
+
+    Attributes:
+        max_events: Maximum number of events kept. Defaults to 10000.
+        max_minutes: Maximum number of per-minute summaries kept, over all
+            wheels. Defaults to 1440, one day of a single wheel.
+    """
+
+    def __init__(self, max_events: int = 10000, max_minutes: int = 1440) -> None:
+        self.max_events = RecentHistory._validate_size(size=max_events)
+        self.max_minutes = RecentHistory._validate_size(size=max_minutes)
+        self._events: List[Optional[Event]] = [None] * self.max_events
+        self._next = 0
+        self._count = 0
+        self._minutes: Deque[dict] = deque()
+        self._minute_index: Dict[Tuple[Optional[str], int], dict] = {}
+        self._reordered = 0
+        self._last_readings: Dict[Optional[str], Event] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _validate_size(cls, size: int) -> int:
+        """Class method to validate user input.
+
+        Args:
+            size: Size input argument.
+
+        Returns:
+            size if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(size, int)
+            assert size > 0
+
+        except AssertionError:
+            errmsg = f'Size {size} is not supported. Must be an integer larger than 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return size
+
+    @property
+    def reordered(self) -> int:
+        """Number of events which were older than the newest kept event."""
+        return self._reordered
+
+    def add(self, event: Event) -> None:
+        """Method to add an event.
+
+        Args:
+            event: Event of the readout loop.
+        """
+        with self._lock:
+            self._insert(event=event)
+            if event.kind == 'reading':
+                last = self._last_readings.get(event.wheel_id)
+                if last is None or event.timestamp_ns >= last.timestamp_ns:
+                    self._last_readings[event.wheel_id] = event
+                self._add_to_minute(event=event)
+
+    def _insert(self, event: Event) -> None:
+        """Method to insert an event at the position of its timestamp. Must be called with the lock held.
+
+        Args:
+            event: Event of the readout loop.
+        """
+        if self._count and event.timestamp_ns < self._event(index=self._count - 1).timestamp_ns:
+            self._reordered += 1
+            if self._count == self.max_events and event.timestamp_ns < self._event(index=0).timestamp_ns:
+                return
+        if self._count == self.max_events:
+            # The oldest event is overwritten
+            self._count -= 1
+        self._next = (self._next + 1) % self.max_events
+        self._count += 1
+        # Shift the newer events by one, usually none
+        index = self._count - 1
+        while index > 0 and self._event(index=index - 1).timestamp_ns > event.timestamp_ns:
+            self._events[self._position(index=index)] = self._event(index=index - 1)
+            index -= 1
+        self._events[self._position(index=index)] = event
+
+    def _add_to_minute(self, event: Event) -> None:
+        """Method to count a reading in the summary of its minute.
+
+        Args:
+            event: Reading event.
+        """
+        minute_start = event.timestamp_ns - event.timestamp_ns % NS_PER_MINUTE
+        minute = self._minute_index.get((event.wheel_id, minute_start))
+        if minute is None:
+            minute = {
+                '_start_ns': minute_start,
+                'MinuteStart': minute_start // 1_000_000,
+                'Readings': 0,
+                'Edges': 0,
+                'Rotations': 0,
+                'Keepalives': 0,
+            }
+            if event.wheel_id is not None:
+                minute['WheelId'] = event.wheel_id
+            if len(self._minutes) == self.max_minutes:
+                oldest = self._minutes.popleft()
+                del self._minute_index[(oldest.get('WheelId'), oldest['_start_ns'])]
+            self._minute_index[(event.wheel_id, minute_start)] = minute
+            self._minutes.append(minute)
+        minute['Readings'] += 1
+        if event.edge:
+            minute['Edges'] += 1
+        if event.edge and event.pin_state == 0:
+            minute['Rotations'] += 1
+        if event.keepalive:
+            minute['Keepalives'] += 1
+
+    def _position(self, index: int) -> int:
+        """Method to get the slot in the ring of a position, 0 being the oldest kept event.
+
+        Args:
+            index: Position of the event.
+
+        Returns:
+            Index into the ring.
+        """
+        return (self._next - self._count + index) % self.max_events
+
+    def _event(self, index: int) -> Event:
+        """Method to get an event by its position, 0 being the oldest kept event.
+
+        Args:
+            index: Position of the event.
+
+        Returns:
+            Event.
+        """
+        return self._events[self._position(index=index)]
+
+    def _bisect(self, timestamp_ns: int) -> int:
+        """Method to find the position of the first event not older than a timestamp.
+
+        Args:
+            timestamp_ns: Epoch timestamp in nanoseconds.
+
+        Returns:
+            Position of the event, `_count` if all events are older.
+        """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._event(index=middle).timestamp_ns < timestamp_ns:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def events(
+        self,
+        start_ns: Optional[int] = None,
+        end_ns: Optional[int] = None,
+        wheel_id: Optional[str] = None,
+        kind: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Event]:
+        """Method to get the events in a time range.
+
+        Args:
+            start_ns: Epoch timestamp in nanoseconds of the oldest event. Defaults
+                to None, which starts at the oldest kept event.
+            end_ns: Epoch timestamp in nanoseconds the events are older than.
+                Defaults to None, which ends at the newest event.
+            wheel_id: If set, only events of this wheel are returned. Defaults to None.
+            kind: If set, only events of this kind are returned. Defaults to None.
+            limit: If set, only the newest `limit` matching events are returned.
+                Defaults to None.
+
+        Returns:
+            List of events, oldest first.
+        """
+        with self._lock:
+            first = self._bisect(timestamp_ns=start_ns) if start_ns is not None else 0
+            last = self._bisect(timestamp_ns=end_ns) if end_ns is not None else self._count
+            events = []
+            # Walk from the newest event so `limit` stops the scan early
+            for index in range(last - 1, first - 1, -1):
+                event = self._event(index=index)
+                if wheel_id is not None and event.wheel_id != wheel_id:
+                    continue
+                if kind is not None and event.kind != kind:
+                    continue
+                events.append(event)
+                if limit is not None and len(events) >= limit:
+                    break
+        events.reverse()
+        return events
+
+    def minutes(
+        self,
+        start_ns: Optional[int] = None,
+        end_ns: Optional[int] = None,
+        wheel_id: Optional[str] = None,
+    ) -> List[dict]:
+        """Method to get the per-minute summaries of a time range.
+
+        Args:
+            start_ns: Epoch timestamp in nanoseconds. Minutes ending before are
+                left out. Defaults to None.
+            end_ns: Epoch timestamp in nanoseconds. Minutes starting at or after
+                it are left out. Defaults to None.
+            wheel_id: If set, only summaries of this wheel are returned. Defaults to None.
+
+        Returns:
+            List of summaries, oldest first.
+        """
+        with self._lock:
+            minutes = [
+                {key: value for key, value in minute.items() if not key.startswith('_')}
+                for minute in self._minutes
+                if (start_ns is None or minute['_start_ns'] + NS_PER_MINUTE > start_ns)
+                and (end_ns is None or minute['_start_ns'] < end_ns)
+                and (wheel_id is None or minute.get('WheelId') == wheel_id)
+            ]
+        # Minutes of late readings are appended after newer ones
+        minutes.sort(key=lambda minute: minute['MinuteStart'])
+        return minutes
+
+    def summary(
+        self,
+        start_ns: Optional[int] = None,
+        end_ns: Optional[int] = None,
+        wheel_id: Optional[str] = None,
+    ) -> dict:
+        """Method to summarise the per-minute summaries of a time range per wheel.
+
+        Args:
+            start_ns: See `minutes`. Defaults to None.
+            end_ns: See `minutes`. Defaults to None.
+            wheel_id: If set, only this wheel is summarised. Defaults to None.
+
+        Returns:
+            Dictionary with the totals per wheel, the time of the last reading of
+            every wheel, the number and age of the kept events and the number of
+            events which arrived out of order.
+        """
+        wheels: Dict[str, dict] = {}
+        for minute in self.minutes(start_ns=start_ns, end_ns=end_ns, wheel_id=wheel_id):
+            totals = wheels.setdefault(minute.get('WheelId', ''), {'Minutes': 0, 'Readings': 0, 'Edges': 0, 'Rotations': 0, 'Keepalives': 0})
+            totals['Minutes'] += 1
+            for key in ('Readings', 'Edges', 'Rotations', 'Keepalives'):
+                totals[key] += minute[key]
+        with self._lock:
+            for wheel, event in self._last_readings.items():
+                if wheel_id is None or wheel == wheel_id:
+                    totals = wheels.setdefault(wheel or '', {'Minutes': 0, 'Readings': 0, 'Edges': 0, 'Rotations': 0, 'Keepalives': 0})
+                    totals['LastReading'] = event.timestamp_ns // 1_000_000
+                    totals['LastPinState'] = event.pin_state
+            oldest = self._event(index=0).timestamp_ns // 1_000_000 if self._count else None
+            return {'Wheels': wheels, 'Events': self._count, 'OldestEvent': oldest, 'ReorderedEvents': self._reordered}
+
+
+class HistorySink(Sink):
+    """Sink adding all events to a `RecentHistory`.
+
+    Attributes:
+        history: History the events are added to.
+    """
+
+    def __init__(self, history: RecentHistory, **kwargs) -> None:
+        super().__init__(name='history', **kwargs)
+        self.history = history
+
+    def handle(self, event: Event) -> None:
+        self.history.add(event=event)
+
+
+def _time_range(query: Dict[str, List[str]]) -> Tuple[Optional[int], Optional[int]]:
+    """Function to get the time range of a query.
+
+    Args:
+        query: Parsed query string.
+
+    Returns:
+        Tuple of the start and end as epoch timestamps in nanoseconds, None if not set.
+    """
+    start_ns, end_ns = None, None
+    if 'last' in query:
+        start_ns = time.time_ns() - int(float(query['last'][0]) * 1e9)
+    if 'start' in query:
+        start_ns = int(float(query['start'][0]) * 1e9)
+    if 'end' in query:
+        end_ns = int(float(query['end'][0]) * 1e9)
+    return start_ns, end_ns
+
+
+class HistoryServer():
+    """HTTP server answering range queries on a `RecentHistory` with JSON.
+
+    The server listens on a Unix domain socket, so access is controlled by
+    the file permissions and no TCP port is opened. It runs in a daemon thread
+    and only reads from memory.
+
+    Attributes:
+        history: History to query.
+        path: Full path to the Unix domain socket. A stale socket file is replaced.
+    """
+
+    def __init__(self, history: RecentHistory, path: str) -> None:
+        self.history = history
+        self.path = path
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _query(self, endpoint: str, query: Dict[str, List[str]]) -> Optional[object]:
+        """Method to answer a query.
+
+        Args:
+            endpoint: Path of the request.
+            query: Parsed query string.
+
+        Returns:
+            JSON serializable response, or None if the endpoint does not exist.
+
+        Raises:
+            ValueError if a parameter is not a number.
+        """
+        start_ns, end_ns = _time_range(query=query)
+        wheel_id = query.get('wheel', [None])[0]
+        if endpoint == '/events':
+            limit = int(query['limit'][0]) if 'limit' in query else None
+            events = self.history.events(
+                start_ns=start_ns, end_ns=end_ns, wheel_id=wheel_id, kind=query.get('kind', [None])[0], limit=limit,
+            )
+            return {'Events': [event_to_dict(event=event) for event in events]}
+        if endpoint == '/minutes':
+            return {'Minutes': self.history.minutes(start_ns=start_ns, end_ns=end_ns, wheel_id=wheel_id)}
+        if endpoint == '/summary':
+            return self.history.summary(start_ns=start_ns, end_ns=end_ns, wheel_id=wheel_id)
+        return None
+
+    def start(self) -> None:
+        """Method to start serving in a daemon thread.
+        """
+        from http.server import BaseHTTPRequestHandler
+        from socketserver import ThreadingUnixStreamServer
+        from urllib.parse import parse_qs, urlsplit
+
+        answer = self._query
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                url = urlsplit(self.path)
+                try:
+                    response = answer(endpoint=url.path, query=parse_qs(url.query))
+                except ValueError as exc:
+                    self._send(status=400, response={'Error': str(exc)})
+                    return
+                if response is None:
+                    self._send(status=404, response={'Error': f'Unknown endpoint {url.path}'})
+                    return
+                self._send(status=200, response=response)
+
+            def _send(self, status: int, response: object) -> None:
+                body = json.dumps(response, separators=(',', ':')).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def address_string(self) -> str:
+                # Clients of a Unix domain socket have no address
+                return self.server.server_address
+
+            def log_message(self, format: str, *args) -> None:
+                # Keep the queries out of the standard error
+                pass
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = ThreadingUnixStreamServer(self.path, Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='history', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Method to stop the server and remove the socket file.
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,315 @@
+"""
+================================================================================
+Description: This script contains the counters and histograms of the readout
+             daemon and the HTTP server exposing them in the Prometheus text
+             format
+================================================================================
+"""
+from bisect import bisect_left
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Labels, float]
+
+# Upper bounds in seconds of the latency histograms, from 50 us to 10 s
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0,
+)
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    """Function to convert labels into a hashable key.
+
+    Args:
+        labels: Label names and values, or None.
+
+    Returns:
+        Sorted tuple of (name, value) pairs.
+    """
+    if not labels:
+        return ()
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    """Function to format labels in the Prometheus text format.
+
+    Args:
+        labels: Tuple of (name, value) pairs.
+
+    Returns:
+        '{name="value",...}', or an empty string without labels.
+    """
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in labels)
+    return f'{{{pairs}}}'
+
+
+class Counter():
+    """Monotonically increasing counter, optionally split by labels.
+
+    Attributes:
+        name: Name of the metric.
+        documentation: Help text of the metric.
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, labels: Optional[Dict[str, str]] = None) -> None:
+        """Method to increase the counter.
+
+        Args:
+            amount: Amount to add. Defaults to 1.
+            labels: Labels of the counter. Defaults to None.
+        """
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Sample]:
+        """Method to get the current values.
+
+        Returns:
+            List of (name, labels, value) tuples.
+        """
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram():
+    """Histogram with fixed buckets, optionally split by labels.
+
+    Attributes:
+        name: Name of the metric.
+        documentation: Help text of the metric.
+        buckets: Sorted upper bounds of the buckets. Defaults to `LATENCY_BUCKETS`.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # Per labels: bucket counts, the last one is +Inf, and the sum
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        """Method to add an observation.
+
+        Args:
+            value: Observed value, e.g. a latency in seconds.
+            labels: Labels of the histogram. Defaults to None.
+        """
+        key = _labels(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = values
+            values[0][index] += 1
+            values[1][0] += value
+
+    def samples(self) -> List[Sample]:
+        """Method to get the cumulative bucket counts, the sum and the count.
+
+        Returns:
+            List of (name, labels, value) tuples.
+        """
+        samples = []
+        with self._lock:
+            for key, (counts, (total,)) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    samples.append((f'{self.name}_bucket', key + (('le', le),), cumulative))
+                samples.append((f'{self.name}_sum', key, total))
+                samples.append((f'{self.name}_count', key, cumulative))
+        return samples
+
+
+class Gauge():
+    """Gauge whose values are read from a callback when the metrics are collected.
+
+    Attributes:
+        name: Name of the metric.
+        documentation: Help text of the metric.
+        callback: Function returning a list of (labels, value) tuples.
+        kind: Prometheus type of the metric, 'gauge' or 'counter' for totals
+            kept elsewhere. Defaults to 'gauge'.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], List[Tuple[Dict[str, str], float]]],
+        kind: str = 'gauge',
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self._callback = callback
+
+    def samples(self) -> List[Sample]:
+        """Method to get the current values from the callback.
+
+        Returns:
+            List of (name, labels, value) tuples.
+        """
+        return [(self.name, _labels(labels), value) for labels, value in self._callback()]
+
+
+class Registry():
+    """Collection of metrics rendered together.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        """Method to add a metric, or get the registered metric of the same name.
+
+        Args:
+            metric: Counter, Histogram or Gauge.
+
+        Returns:
+            The registered metric.
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        """Method to get or create a counter. See `Counter`."""
+        return self._register(Counter(name=name, documentation=documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        """Method to get or create a histogram. See `Histogram`."""
+        return self._register(Histogram(name=name, documentation=documentation, buckets=buckets))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], List[Tuple[Dict[str, str], float]]],
+        kind: str = 'gauge',
+    ) -> Gauge:
+        """Method to register a gauge, replacing a gauge of the same name. See `Gauge`."""
+        gauge = Gauge(name=name, documentation=documentation, callback=callback, kind=kind)
+        with self._lock:
+            self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        """Method to render all metrics in the Prometheus text format.
+
+        Returns:
+            Text with the HELP, TYPE and sample lines of every metric.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Registry used by the readout daemon, the sinks and `utils.log`
+REGISTRY = Registry()
+
+
+class MetricsServer():
+    """HTTP server exposing a registry in the Prometheus text format at /metrics.
+
+    The server runs in a daemon thread and renders the metrics on every request,
+    so it costs nothing while nobody scrapes it.
+
+    Attributes:
+        port: TCP port to listen on.
+        host: Address to listen on. Defaults to '127.0.0.1'.
+        registry: Registry to expose. Defaults to `REGISTRY`.
+    """
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY) -> None:
+        self.port = MetricsServer._validate_port(port=port)
+        self.host = host
+        self._registry = registry
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def _validate_port(cls, port: int) -> int:
+        """Class method to validate user input.
+
+        Args:
+            port: Port input argument.
+
+        Returns:
+            port if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(port, int)
+            assert 0 <= port < 65536
+
+        except AssertionError:
+            errmsg = f'Port {port} is not supported. Must be an integer between 0 and 65535.'
+            raise ValueError(errmsg) from AssertionError
+
+        return port
+
+    def start(self) -> None:
+        """Method to start serving in a daemon thread.
+        """
+        # Imported here, so the daemon does not load http.server unless a server is started
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self._registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                # Keep the scrapes out of the standard error
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Method to stop the server.
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
@@ -0,0 +1,299 @@
+"""
+================================================================================
+Description: This script contains the rotation of the log files written by the
+             buffered log writer in utils.py. A log is closed as a segment once
+             it reaches a size or an age, e.g.
+
+                 hamsterwheel.log                       open segment
+                 hamsterwheel.log.20210301-060000.gz    closed segments
+                 hamsterwheel.log.index.json            time range per segment
+
+             Closed segments are compressed in the background and the oldest
+             are deleted beyond the retention limits. The index lets readers
+             open only the segments overlapping a time window. Its times are
+             the timestamps of the log lines, the wall-clock time of the device.
+================================================================================
+"""
+from datetime import datetime
+import gzip
+import json
+import os
+import shutil
+import threading
+from typing import IO, Dict, List, Optional, Union
+
+Segment = Dict[str, Union[str, int]]
+
+# Suffix of the compressed segments per compression
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def first_timestamp(path: str) -> Optional[float]:
+    """Function to get the time of the first line of a log file.
+
+    Args:
+        path: Full path to the log file.
+
+    Returns:
+        Epoch timestamp of the first line, the modification time if it has no
+        timestamp, or None if the file does not exist or is empty.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, 'r') as file:
+        # Lines are preceded by a newline, so the first one may be empty
+        for line in file:
+            if line.strip():
+                try:
+                    return datetime.fromisoformat(line.split(' - ', 1)[0]).timestamp()
+                except ValueError:
+                    break
+    return os.path.getmtime(path)
+
+
+def open_segment(path: str) -> IO[bytes]:
+    """Function to open a segment for reading, compressed or not.
+
+    zstandard is only imported for '.zst' segments.
+
+    Args:
+        path: Full path to the segment.
+
+    Returns:
+        Binary file object with the uncompressed lines.
+    """
+    if path.endswith(SUFFIXES['gzip']):
+        return gzip.open(path, 'rb')
+    if path.endswith(SUFFIXES['zstd']):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+class LogRotator():
+    """Class to rotate, compress and expire the segments of a log file.
+
+    `due` tells the writer of `log_path` when to rotate, `rotate` closes the
+    current file as a segment. The compression runs in a daemon thread per
+    segment; segments left uncompressed by an earlier process are compressed
+    when the rotator is created.
+
+    Attributes:
+        log_path: Full path to the log file.
+        max_bytes: Size in bytes at which the log is rotated. Defaults to None,
+            which never rotates by size.
+        max_age: Time in seconds after the first line at which the log is rotated.
+            Defaults to None, which never rotates by time.
+        compression: 'gzip', 'zstd' or None to keep the segments uncompressed.
+            zstd needs the zstandard package. Defaults to 'gzip'.
+        keep_segments: Maximum number of closed segments. Defaults to None.
+        keep_bytes: Maximum size in bytes of all closed segments. Defaults to None.
+    """
+    supported_compression = [None, 'gzip', 'zstd']
+
+    def __init__(
+        self,
+        log_path: str,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+        compression: Optional[str] = 'gzip',
+        keep_segments: Optional[int] = None,
+        keep_bytes: Optional[int] = None,
+    ) -> None:
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression = LogRotator._validate_compression(compression=compression)
+        self.keep_segments = keep_segments
+        self.keep_bytes = keep_bytes
+        self.index_path = f'{log_path}.index.json'
+        self._directory = os.path.dirname(os.path.abspath(log_path))
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._segments: List[Segment] = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as file:
+                self._segments = json.load(file)
+        for segment in list(self._segments):
+            if not os.path.exists(self._path(segment=segment)):
+                self._segments.remove(segment)
+            elif self.compression is not None and not str(segment['file']).endswith(SUFFIXES[self.compression]):
+                self._start_compression(segment=segment)
+
+    @classmethod
+    def _validate_compression(cls, compression: Optional[str]) -> Optional[str]:
+        """Class method to validate user input.
+
+        Args:
+            compression: Compression input argument.
+
+        Returns:
+            compression if it is a part of the supported compressions.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert compression in LogRotator.supported_compression
+
+        except AssertionError:
+            errmsg = f'Compression {compression} is not among the supported compressions {LogRotator.supported_compression}.'
+            raise ValueError(errmsg) from AssertionError
+
+        return compression
+
+    def _path(self, segment: Segment) -> str:
+        """Method to get the full path of a segment.
+
+        Args:
+            segment: Entry of the index.
+
+        Returns:
+            Full path to the segment file.
+        """
+        return os.path.join(self._directory, str(segment['file']))
+
+    def _save_index(self) -> None:
+        """Method to atomically write the index. Must be called with the lock held.
+        """
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self._segments, file, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def due(self, size: int, first: Optional[float], now: float) -> bool:
+        """Method to check if the log has to be rotated.
+
+        Args:
+            size: Current size of the log in bytes.
+            first: Epoch timestamp of the first line of the log, None if it is empty.
+            now: Epoch timestamp of the next line.
+
+        Returns:
+            True if the log reached `max_bytes` or `max_age`.
+        """
+        if size == 0 or first is None:
+            return False
+        if self.max_bytes is not None and size >= self.max_bytes:
+            return True
+        return self.max_age is not None and now - first >= self.max_age
+
+    def rotate(self, first: float, last: float) -> str:
+        """Method to close the log as a segment. The log must be closed by the writer.
+
+        Args:
+            first: Epoch timestamp of the first line of the log.
+            last: Epoch timestamp of the last line of the log.
+
+        Returns:
+            Full path to the segment.
+        """
+        start = datetime.fromtimestamp(first)
+        name = f'{os.path.basename(self.log_path)}.{start:%Y%m%d-%H%M%S}'
+        path = os.path.join(self._directory, name)
+        # Segments of the same second get a counter
+        counter = 1
+        while any(os.path.exists(f'{path}{suffix}') for suffix in ['', *SUFFIXES.values()]):
+            path = os.path.join(self._directory, f'{name}-{counter}')
+            counter += 1
+        os.replace(self.log_path, path)
+        segment: Segment = {
+            'file': os.path.basename(path),
+            'start': str(start),
+            'end': str(datetime.fromtimestamp(last)),
+            'bytes': os.path.getsize(path),
+        }
+        with self._lock:
+            self._segments.append(segment)
+            self._expire()
+            self._save_index()
+        if self.compression is not None:
+            self._start_compression(segment=segment)
+        return path
+
+    def _start_compression(self, segment: Segment) -> None:
+        """Method to compress a segment in a daemon thread.
+
+        Args:
+            segment: Entry of the index.
+        """
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        thread = threading.Thread(target=self._compress, args=(segment,), name='log-compression', daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _compress(self, segment: Segment) -> None:
+        """Method to compress a segment and replace it in the index.
+
+        Args:
+            segment: Entry of the index.
+        """
+        path = self._path(segment=segment)
+        compressed_path = f'{path}{SUFFIXES[self.compression]}'
+        tmp_path = f'{compressed_path}.tmp'
+        try:
+            with open(path, 'rb') as source:
+                if self.compression == 'zstd':
+                    import zstandard
+                    with open(tmp_path, 'wb') as target:
+                        zstandard.ZstdCompressor().copy_stream(source, target)
+                else:
+                    with gzip.open(tmp_path, 'wb') as target:
+                        shutil.copyfileobj(source, target)
+        except FileNotFoundError:
+            # Expired before it was compressed
+            return
+        os.replace(tmp_path, compressed_path)
+        with self._lock:
+            if segment in self._segments:
+                segment['file'] = os.path.basename(compressed_path)
+                segment['bytes'] = os.path.getsize(compressed_path)
+                self._expire()
+                self._save_index()
+            else:
+                os.remove(compressed_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _expire(self) -> None:
+        """Method to delete the oldest segments beyond the retention limits.
+        Must be called with the lock held.
+        """
+        while self._segments:
+            total_bytes = sum(int(segment['bytes']) for segment in self._segments)
+            too_many = self.keep_segments is not None and len(self._segments) > self.keep_segments
+            too_large = self.keep_bytes is not None and total_bytes > self.keep_bytes
+            if not (too_many or too_large):
+                break
+            path = self._path(segment=self._segments.pop(0))
+            if os.path.exists(path):
+                os.remove(path)
+
+    def segments(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+        """Method to find the segments overlapping a time window, oldest first.
+
+        Args:
+            start: Start of the window, as in the log lines. Defaults to None.
+            end: End of the window, as in the log lines. Defaults to None.
+
+        Returns:
+            Full paths to the closed segments in the window, followed by the
+            log itself if it exists. Open them with `open_segment`.
+        """
+        with self._lock:
+            paths = [
+                self._path(segment=segment)
+                for segment in self._segments
+                if (start is None or datetime.fromisoformat(str(segment['end'])) >= start)
+                and (end is None or datetime.fromisoformat(str(segment['start'])) <= end)
+            ]
+        if os.path.exists(self.log_path):
+            paths.append(self.log_path)
+        return paths
+
+    def wait(self) -> None:
+        """Method to wait for the running compressions.
+        """
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -0,0 +1,249 @@
+"""
+================================================================================
+Description: This script contains the streaming metrics computed on the device
+             in hamsterwheel.py: RPM, distance, run sessions and daily summaries
+================================================================================
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Union
+
+Summary = Dict[str, Union[int, float, str]]
+
+
+class WheelMetrics():
+    """Class to compute running statistics of the wheel from the readings of the reed sensor.
+
+    Every closure of the reed sensor (pin state changes to 0) counts as one
+    rotation. The first reading only sets the initial state, so a wheel which
+    stands with the loop closed at the start is not counted. All values are
+    updated incrementally with constant memory.
+
+    A run session starts with the first rotation and ends once no rotation
+    was seen for `idle_timeout` seconds. Daily summaries are closed at local
+    midnight. The active time of a session running at midnight is split: the
+    time up to its last rotation before midnight counts to the closing day,
+    the rest to the day the session ends.
+
+    Attributes:
+        circumference: Circumference of the wheel in meters.
+        idle_timeout: Time in seconds without rotation which ends a session.
+            Defaults to 30 seconds.
+        smoothing: Weight of the newest value in the exponential moving average
+            of the RPM, between 0 and 1. Defaults to 0.3.
+    """
+
+    def __init__(self, circumference: float, idle_timeout: float = 30.0, smoothing: float = 0.3) -> None:
+        self._circumference = WheelMetrics._validate_positive(name='Circumference', value=circumference)
+        self._idle_timeout_ns = int(WheelMetrics._validate_positive(name='Idle timeout', value=idle_timeout) * 1e9)
+        self._smoothing = WheelMetrics._validate_smoothing(smoothing=smoothing)
+        self._last_state: Optional[int] = None
+        self._last_closure: Optional[int] = None
+        self.rotations = 0
+        self.rpm = 0.0
+        self.smoothed_rpm = 0.0
+        self._session_start: Optional[int] = None
+        # Start of the session time not yet counted as active time of a day
+        self._active_from: Optional[int] = None
+        self._session_rotations = 0
+        self._session_max_rpm = 0.0
+        self.sessions = 0
+        self._day: Optional[str] = None
+        self._day_end: Optional[int] = None
+        self._reset_day()
+
+    @classmethod
+    def _validate_positive(cls, name: str, value: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            name: Name of the input argument used in the error message.
+            value: Input argument.
+
+        Returns:
+            value if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(value, float)
+            assert value > 0.0
+
+        except AssertionError:
+            errmsg = f'{name} {value} is not supported. Must be float and larger than 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return value
+
+    @classmethod
+    def _validate_smoothing(cls, smoothing: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            smoothing: Smoothing input argument.
+
+        Returns:
+            smoothing if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(smoothing, float)
+            assert smoothing > 0.0
+            assert smoothing <= 1.0
+
+        except AssertionError:
+            errmsg = f'Smoothing {smoothing} is not supported. Must be float and between 0 and 1.0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return smoothing
+
+    @property
+    def distance(self) -> float:
+        """Total distance in meters since the start."""
+        return self.rotations * self._circumference
+
+    def _reset_day(self) -> None:
+        """Method to clear the values of the daily summary.
+        """
+        self._day_rotations = 0
+        self._day_sessions = 0
+        self._day_active_ns = 0
+        self._day_max_rpm = 0.0
+
+    def _start_day(self, timestamp_ns: int) -> None:
+        """Method to start the daily summary of the local day of `timestamp_ns`.
+
+        Args:
+            timestamp_ns: Epoch timestamp in nanoseconds.
+        """
+        day = datetime.fromtimestamp(timestamp_ns / 1e9).date()
+        midnight = datetime.combine(day + timedelta(days=1), datetime.min.time())
+        self._day = day.isoformat()
+        self._day_end = int(midnight.timestamp() * 1e9)
+        self._reset_day()
+
+    def _end_session(self) -> Summary:
+        """Method to finish the current session at its last rotation.
+
+        Returns:
+            Summary of the finished session.
+        """
+        duration_ns = self._last_closure - self._session_start
+        self._day_active_ns += self._last_closure - self._active_from
+        summary = {
+            'Type': 'session',
+            'Start': self._session_start // 1_000_000,
+            'Duration': round(duration_ns / 1e9, 3),
+            'Rotations': self._session_rotations,
+            'Distance': round(self._session_rotations * self._circumference, 2),
+            'MaxRpm': round(self._session_max_rpm, 1),
+        }
+        self._session_start = None
+        return summary
+
+    def _end_day(self) -> Summary:
+        """Method to finish the daily summary.
+
+        Returns:
+            Summary of the finished day.
+        """
+        return {
+            'Type': 'daily',
+            'Day': self._day,
+            'Rotations': self._day_rotations,
+            'Distance': round(self._day_rotations * self._circumference, 2),
+            'Sessions': self._day_sessions,
+            'ActiveTime': round(self._day_active_ns / 1e9, 3),
+            'MaxRpm': round(self._day_max_rpm, 1),
+        }
+
+    def tick(self, timestamp_ns: int) -> List[Summary]:
+        """Method to advance the time without a new reading.
+
+        Ends the current session after `idle_timeout` and the daily summary at
+        midnight.
+
+        Args:
+            timestamp_ns: Current epoch timestamp in nanoseconds.
+
+        Returns:
+            Summaries of the finished sessions and days, oldest first.
+        """
+        summaries: List[Summary] = []
+        if self._session_start is not None and timestamp_ns - self._last_closure > self._idle_timeout_ns:
+            summaries.append(self._end_session())
+            self.rpm = 0.0
+            self.smoothed_rpm = 0.0
+        if self._day_end is None:
+            self._start_day(timestamp_ns=timestamp_ns)
+        elif timestamp_ns >= self._day_end:
+            if self._session_start is not None:
+                # Count the running session up to its last rotation of the day
+                active_until = max(self._active_from, min(self._last_closure, self._day_end))
+                self._day_active_ns += active_until - self._active_from
+                self._active_from = active_until
+            summaries.append(self._end_day())
+            self._start_day(timestamp_ns=timestamp_ns)
+        return summaries
+
+    def update(self, timestamp_ns: int, pin_state: int) -> List[Summary]:
+        """Method to add a reading of the reed sensor.
+
+        Args:
+            timestamp_ns: Epoch timestamp of the reading in nanoseconds.
+            pin_state: State of the wheel pin, 0 if the loop is closed.
+
+        Returns:
+            Summaries of the sessions and days finished before the reading, oldest first.
+        """
+        summaries = self.tick(timestamp_ns=timestamp_ns)
+        # The first reading is the initial state, not an edge
+        if pin_state == 0 and self._last_state is not None and self._last_state != 0:
+            self._add_rotation(timestamp_ns=timestamp_ns)
+        self._last_state = pin_state
+        return summaries
+
+    def _add_rotation(self, timestamp_ns: int) -> None:
+        """Method to count a rotation.
+
+        Args:
+            timestamp_ns: Epoch timestamp of the closure in nanoseconds.
+        """
+        self.rotations += 1
+        self._day_rotations += 1
+        if self._session_start is None:
+            self._session_start = timestamp_ns
+            self._active_from = timestamp_ns
+            self._session_rotations = 0
+            self._session_max_rpm = 0.0
+            self.sessions += 1
+            self._day_sessions += 1
+        else:
+            rpm = 60e9 / max(timestamp_ns - self._last_closure, 1)
+            self.rpm = rpm
+            self.smoothed_rpm = rpm if self.smoothed_rpm == 0.0 else (
+                self._smoothing * rpm + (1.0 - self._smoothing) * self.smoothed_rpm
+            )
+            self._session_max_rpm = max(self._session_max_rpm, rpm)
+            self._day_max_rpm = max(self._day_max_rpm, rpm)
+        self._session_rotations += 1
+        self._last_closure = timestamp_ns
+
+    def snapshot(self) -> Summary:
+        """Method to get the current values.
+
+        Returns:
+            Dictionary with the RPM, the smoothed RPM, the total rotations and
+            distance, the number of sessions and the running daily values.
+        """
+        return {
+            'Rpm': round(self.rpm, 1),
+            'SmoothedRpm': round(self.smoothed_rpm, 1),
+            'Rotations': self.rotations,
+            'Distance': round(self.distance, 2),
+            'Sessions': self.sessions,
+            'DayRotations': self._day_rotations,
+            'DayDistance': round(self._day_rotations * self._circumference, 2),
+        }
@@ -0,0 +1,217 @@
+"""
+================================================================================
+Description: This script contains the versioned payload schema of the readings
+             published by the MQTT sink in sinks.py. The matching decoders are
+             in analysis/decode.py.
+
+             Version 1 is the legacy message with one reading per message:
+                 {"Timestamp" :"%Y-%m-%d %I:%M:%S", "Message":"0"}
+
+             Version 2 batches readings and uses integer epoch milliseconds:
+                 {"v":2,"dev":"rpi","wheel":"cage1","boot":3735928559,"seq":7,
+                  "t0":1614621600000,"dt":[0,180,20],"s":[0,1,0],"e":[0,1],
+                  "d":[877,180,null],"k":[2]}
+             `dt` are the offsets in milliseconds from `t0`, `s` the pin states,
+             `e` the indices of readings at which the state changed, `d` the
+             durations in milliseconds of the previous state (of the current
+             state for keep-alives, null if unknown) and `k` the indices of
+             keep-alive readings. `wheel`, `e`, `d` and `k` are left out if not
+             needed. `boot` is a random ID drawn at every start of the daemon,
+             `seq` counts the batches since then, so together they tell a
+             restart from a replay. Offsets are signed, as the wall clock may
+             step backwards within a batch.
+
+             The binary encoding of version 2 packs the same batch into
+                 header    '<BBHIIq': version, flags, count, boot, seq, t0
+                 strings   device and wheel ID, each as uint8 length + UTF-8
+                 offsets   count x int32 milliseconds from t0
+                 states    count x uint8, bit 0 pin state, bit 1 keep-alive,
+                           bit 2 edge
+                 durations count x uint32 milliseconds, 0xFFFFFFFF if unknown,
+                           only if the durations flag is set
+             The first byte of a JSON payload is '{', so the version byte
+             also tells both encodings apart.
+================================================================================
+"""
+from array import array
+from datetime import datetime
+import json
+import os
+import struct
+import sys
+from typing import List, NamedTuple, Optional
+
+SCHEMA_VERSION = 2
+BINARY_HEADER = struct.Struct('<BBHIIq')
+# Flags of the binary header
+FLAG_WHEEL = 0x1
+FLAG_DURATIONS = 0x2
+# Bits of a binary state byte
+STATE_KEEPALIVE = 0x2
+STATE_EDGE = 0x4
+# Binary duration of a reading without duration
+DURATION_UNKNOWN = 0xFFFFFFFF
+# Largest number of readings in a batch, limited by the uint16 count
+MAX_BATCH = 65535
+# Range of the signed binary offsets
+_MIN_OFFSET = -2**31
+_MAX_OFFSET = 2**31 - 1
+# ID of this start of the daemon, sent with every batch
+BOOT_ID = int.from_bytes(os.urandom(4), 'little')
+
+
+class Reading(NamedTuple):
+    """Reading of a batch.
+
+    Attributes:
+        timestamp_ms: Epoch timestamp in milliseconds.
+        pin_state: State of the wheel pin, 0 if the loop is closed.
+        keepalive: True if the reading is a keep-alive.
+        edge: True if the pin state changed.
+        duration: Duration in seconds of the previous state (of the current
+            state for keep-alives), None if unknown.
+    """
+    timestamp_ms: int
+    pin_state: int
+    keepalive: bool = False
+    edge: bool = False
+    duration: Optional[float] = None
+
+
+def _duration_ms(reading: Reading) -> Optional[int]:
+    """Function to get the duration of a reading in milliseconds.
+
+    Args:
+        reading: Reading.
+
+    Returns:
+        Duration in milliseconds, None if unknown.
+    """
+    return None if reading.duration is None else int(round(reading.duration * 1000))
+
+
+def encode_legacy(
+    timestamp_ns: int,
+    message: str,
+    wheel_id: Optional[str] = None,
+    duration: Optional[float] = None,
+    keepalive: bool = False,
+) -> str:
+    """Function to encode a single reading as a version 1 message.
+
+    Args:
+        timestamp_ns: Epoch timestamp in nanoseconds, sent in local time
+            without AM/PM, see the header of this script.
+        message: Message, the pin state for readings.
+        wheel_id: ID of the wheel. Defaults to None.
+        duration: Duration in seconds of the previous state. Defaults to None.
+        keepalive: True if the reading is a keep-alive. Defaults to False.
+
+    Returns:
+        JSON payload.
+    """
+    now = datetime.fromtimestamp(timestamp_ns / 1e9).strftime("%Y-%m-%d %I:%M:%S")
+    extra = ""
+    if wheel_id is not None:
+        extra += ", \"WheelId\":\"" + wheel_id + "\""
+    if duration is not None:
+        extra += ", \"Duration\":" + f'{duration:.3f}'
+    if keepalive:
+        extra += ", \"KeepAlive\":true"
+    return "{\"Timestamp\" :\"" + str(now) + "\", \"Message\":\"" + message + "\"" + extra + "}"
+
+
+def encode_json(
+    device_id: str,
+    seq: int,
+    readings: List[Reading],
+    wheel_id: Optional[str] = None,
+    boot_id: int = BOOT_ID,
+) -> str:
+    """Function to encode a batch of readings as version 2 JSON.
+
+    Args:
+        device_id: ID of the device, e.g. the MQTT client name.
+        seq: Sequence number of the batch since the start of the daemon.
+        readings: Readings of the batch, oldest first.
+        wheel_id: ID of the wheel. Defaults to None.
+        boot_id: ID of the start of the daemon. Defaults to `BOOT_ID`.
+
+    Returns:
+        JSON payload.
+    """
+    t0 = readings[0].timestamp_ms
+    batch = {'v': SCHEMA_VERSION, 'dev': device_id}
+    if wheel_id is not None:
+        batch['wheel'] = wheel_id
+    batch['boot'] = boot_id
+    batch['seq'] = seq
+    batch['t0'] = t0
+    batch['dt'] = [reading.timestamp_ms - t0 for reading in readings]
+    batch['s'] = [reading.pin_state for reading in readings]
+    edges = [i for i, reading in enumerate(readings) if reading.edge]
+    if edges:
+        batch['e'] = edges
+    durations = [_duration_ms(reading=reading) for reading in readings]
+    if any(duration is not None for duration in durations):
+        batch['d'] = durations
+    keepalives = [i for i, reading in enumerate(readings) if reading.keepalive]
+    if keepalives:
+        batch['k'] = keepalives
+    return json.dumps(batch, separators=(',', ':'))
+
+
+def _encode_string(value: str) -> bytes:
+    """Function to encode a string with a uint8 length prefix.
+
+    Args:
+        value: String of at most 255 UTF-8 bytes.
+
+    Returns:
+        Length prefixed UTF-8 bytes.
+    """
+    encoded = value.encode()
+    return bytes((len(encoded),)) + encoded
+
+
+def encode_binary(
+    device_id: str,
+    seq: int,
+    readings: List[Reading],
+    wheel_id: Optional[str] = None,
+    boot_id: int = BOOT_ID,
+) -> bytes:
+    """Function to encode a batch of readings in the version 2 binary encoding.
+
+    Args:
+        device_id: ID of the device, e.g. the MQTT client name.
+        seq: Sequence number of the batch since the start of the daemon,
+            stored modulo 2**32.
+        readings: Readings of the batch, oldest first, at most `MAX_BATCH`.
+        wheel_id: ID of the wheel. Defaults to None.
+        boot_id: ID of the start of the daemon. Defaults to `BOOT_ID`.
+
+    Returns:
+        Binary payload.
+    """
+    t0 = readings[0].timestamp_ms
+    durations = [_duration_ms(reading=reading) for reading in readings]
+    has_durations = any(duration is not None for duration in durations)
+    flags = (FLAG_WHEEL if wheel_id is not None else 0) | (FLAG_DURATIONS if has_durations else 0)
+    header = BINARY_HEADER.pack(SCHEMA_VERSION, flags, len(readings), boot_id & 0xFFFFFFFF, seq & 0xFFFFFFFF, t0)
+    strings = _encode_string(device_id) + (_encode_string(wheel_id) if wheel_id is not None else b'')
+    # Offsets beyond the int32 range (a clock step of more than 24 days) are clamped
+    offsets = array('i', [min(max(reading.timestamp_ms - t0, _MIN_OFFSET), _MAX_OFFSET) for reading in readings])
+    columns = [offsets]
+    if has_durations:
+        columns.append(array('I', [
+            DURATION_UNKNOWN if duration is None else min(max(duration, 0), DURATION_UNKNOWN - 1) for duration in durations
+        ]))
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+    states = bytes(
+        reading.pin_state | (STATE_KEEPALIVE if reading.keepalive else 0) | (STATE_EDGE if reading.edge else 0)
+        for reading in readings
+    )
+    return header + strings + offsets.tobytes() + states + (columns[1].tobytes() if has_durations else b'')
@@ -0,0 +1,152 @@
+"""
+================================================================================
+Description: This script contains the adaptive poll scheduler used by the
+             'adaptive' readout mode in hamsterwheel.py
+================================================================================
+"""
+from typing import Dict, Optional, Tuple, Union
+
+
+class PollScheduler():
+    """Class to choose the time until the next poll of the reed sensors.
+
+    The scheduler polls every `min_interval` while the wheel turns. Once no
+    pin changed for `hold` seconds, the interval is multiplied by `backoff`
+    after every poll until it reaches `max_interval`. The first change sets
+    the interval back to `min_interval`, so a wheel starting to turn is
+    detected after at most `max_interval`.
+
+    `hold` must cover the time between two changes of a slowly turning
+    wheel, otherwise the scheduler backs off in the middle of a rotation.
+
+    Attributes:
+        min_interval: Poll interval in seconds while the wheel turns.
+        max_interval: Poll interval in seconds while the wheel is idle. It is
+            the maximum detection latency.
+        hold: Time in seconds without change until the backoff starts.
+            Defaults to 2 seconds.
+        backoff: Factor the interval grows by per idle poll. Defaults to 2.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, hold: float = 2.0, backoff: float = 2.0) -> None:
+        self._min_interval, self._max_interval = PollScheduler._validate_intervals(
+            min_interval=min_interval,
+            max_interval=max_interval,
+        )
+        self._hold = PollScheduler._validate_hold(hold=hold)
+        self._backoff = PollScheduler._validate_backoff(backoff=backoff)
+        self._interval = self._min_interval
+        self._last_change: Optional[float] = None
+        self._polls = 0
+        self._fast_polls = 0
+
+    @classmethod
+    def _validate_intervals(cls, min_interval: float, max_interval: float) -> Tuple[float, float]:
+        """Class method to validate user input.
+
+        Args:
+            min_interval: Minimum interval input argument.
+            max_interval: Maximum interval input argument.
+
+        Returns:
+            Tuple of min_interval and max_interval if they are valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(min_interval, float)
+            assert isinstance(max_interval, float)
+            assert min_interval > 0.0
+            assert min_interval <= max_interval
+
+        except AssertionError:
+            errmsg = f'Intervals {min_interval} and {max_interval} are not supported. Must be float, larger than 0 and the minimum not larger than the maximum.'
+            raise ValueError(errmsg) from AssertionError
+
+        return min_interval, max_interval
+
+    @classmethod
+    def _validate_hold(cls, hold: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            hold: Hold input argument.
+
+        Returns:
+            hold if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(hold, float)
+            assert hold >= 0.0
+
+        except AssertionError:
+            errmsg = f'Hold {hold} is not supported. Must be float and not negative.'
+            raise ValueError(errmsg) from AssertionError
+
+        return hold
+
+    @classmethod
+    def _validate_backoff(cls, backoff: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            backoff: Backoff input argument.
+
+        Returns:
+            backoff if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(backoff, float)
+            assert backoff > 1.0
+
+        except AssertionError:
+            errmsg = f'Backoff {backoff} is not supported. Must be float and larger than 1.'
+            raise ValueError(errmsg) from AssertionError
+
+        return backoff
+
+    @property
+    def interval(self) -> float:
+        """Time in seconds until the next poll."""
+        return self._interval
+
+    def update(self, changed: bool, now: float) -> float:
+        """Method to update the interval after a poll.
+
+        Args:
+            changed: True if a pin state changed in the poll.
+            now: Monotonic time of the poll in seconds.
+
+        Returns:
+            Time in seconds until the next poll.
+        """
+        self._polls += 1
+        if changed or self._last_change is None:
+            self._last_change = now
+        if changed or now - self._last_change < self._hold:
+            self._interval = self._min_interval
+        else:
+            self._interval = min(self._interval * self._backoff, self._max_interval)
+        if self._interval == self._min_interval:
+            self._fast_polls += 1
+        return self._interval
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Method to get the counters of the scheduler.
+
+        Returns:
+            Dictionary with the number of polls, the number of polls at
+            `min_interval` and the current interval in seconds.
+        """
+        return {
+            'polls': self._polls,
+            'fast_polls': self._fast_polls,
+            'interval': self._interval,
+        }
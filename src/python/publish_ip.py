@@ -1,44 +1,92 @@
+import argparse
+import fcntl
+import json
 import os
-from datetime import datetime
+import select
+import signal
+import socket
+import struct
 import subprocess
+import threading
 import time
-from typing import List
-from subprocess import Popen, PIPE
+from typing import List, Optional
+import warnings
+
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
 
+from payload import SCHEMA_VERSION
 from utils import log
 
 from constants import (
     BASH_GET_WLAN,
     LOG_PUBLISHIP,
+    PUBLISHIP_STATE,
+    PUBLISHIP_INTERVAL,
+    PUBLISHIP_REFRESH_INTERVAL,
     AWS_CLIENT_NAME,
     AWS_ENDPOINT,
     AWS_CA_FILE,
     AWS_KEY,
     AWS_CERT,
+    AWS_TOPIC_PUBLISH_IP,
 )
 
+# Network interfaces and IPv4 routing table as exposed by the kernel
+SYS_CLASS_NET = '/sys/class/net'
+PROC_NET_ROUTE = '/proc/net/route'
+# Route flag of a usable route, see route(8)
+RTF_UP = 0x1
+# Operational states of an interface which can carry traffic. Interfaces
+# without carrier detection, e.g. tunnels, report 'unknown'
+USABLE_OPERSTATES = ('up', 'unknown')
+# ioctl request to get the IPv4 address of an interface, see netdevice(7)
+SIOCGIFADDR = 0x8915
+# Netlink multicast groups for link and IPv4 address changes, see rtnetlink(7)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
 
 class PublishIp():
     """Class to send the IP address of the RaspberryPi and the user name to
     AWS IoT.
 
+    The address is read in-process: the interface from /sys/class/net and its
+    IPv4 address with an ioctl. It is only published if it changed since the
+    last publish, which is kept in `state_path` across restarts. The MQTT
+    connection is opened once and reused.
+
+    `monitor` keeps running and checks the address whenever the kernel reports
+    a link or address change over netlink, and at the latest every `interval`.
+
     Attributes:
-        username: username on the RaspberryPi. The output from the scripts to retrieve
-            the `ifconfig`-content will be stored in the home folder of this user.
-        path_to_bash: Full path to the script to retrieve ifconfig information.
+        username: username on the RaspberryPi, published with the IP address.
+        interface: Network interface to read the IP address from. Defaults to None,
+            which uses the active interface found by `find_interface`.
+        state_path: Full path to the file with the last published IP address.
+            Defaults to None, which only keeps it in memory.
+        topic: Topic to publish to. Defaults to 'topic/publish_ip'.
+        path_to_bash: Deprecated, only used by `run_bash`. Full path to the
+            script to retrieve ifconfig information.
     """
 
     def __init__(
         self,
         username: str = None,
-        path_to_bash: str = None
+        interface: Optional[str] = None,
+        state_path: Optional[str] = None,
+        topic: str = 'topic/publish_ip',
+        path_to_bash: str = None,
     ) -> None:
         self.username = PublishIp._get_username() if username == None else username
-        if path_to_bash:
-            self.path_to_bash = path_to_bash
-        else:
-            self.path_to_bash = PublishIp._path_get_wlan_info(username=self.username)
+        self.path_to_bash = path_to_bash
+        self.interface = interface
+        self.state_path = state_path
+        self.topic = topic
+        self._mqtt_client: Optional[AWSIoTMQTTClient] = None
+        self._connected = False
+        self._last_ip = self._load_state()
+        self._last_publish = 0.0
+        self._stopped = threading.Event()
 
     @classmethod
     def _get_username(cls) -> str:
@@ -53,21 +101,29 @@ class PublishIp():
 
         return username
 
-    @classmethod
-    def _path_get_wlan_info(cls, username: str) -> str:
-        """Class method to retrieve the path to the bash script which executes
-        the code to read the output of the `ifconfig`-command
-
-        Args:
-            username: Linux username.
+    def _load_state(self) -> Optional[str]:
+        """Method to load the last published IP address.
 
         Returns:
-            Path to the bash script to retrieve `ifconfig`.
+            IP address, or None if none was published yet.
         """
-        path_to_bash = f'/home/{username}/{BASH_GET_WLAN}'
-        msg = f'Path to bash is {path_to_bash}'
-        log(log_path=LOG_PUBLISHIP, logmsg=msg, printout=True)
-        return path_to_bash
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, 'r') as file:
+            return file.read().strip() or None
+
+    def _save_state(self, ip_address: str) -> None:
+        """Method to atomically store the last published IP address.
+
+        Args:
+            ip_address: Published IP address.
+        """
+        if self.state_path is None:
+            return
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(ip_address)
+        os.replace(tmp_path, self.state_path)
 
     def setup_aws(self) -> AWSIoTMQTTClient:
         """Method to set up communication with AWS.
@@ -83,149 +139,282 @@ class PublishIp():
         )
         return mqtt_client
 
-    def read_ifconfig(self) -> List[str]:
-        """Method to retrieve the content of the ifconfig file. Will be stored in the users home
-        directory.
+    def connect(self) -> None:
+        """Method to connect to AWS, reusing the connection if it is open.
+        """
+        if self._connected:
+            return
+        if self._mqtt_client is None:
+            self._mqtt_client = self.setup_aws()
+        self._connected = bool(self._mqtt_client.connect())
+
+    def disconnect(self) -> None:
+        """Method to close the connection to AWS.
+        """
+        if self._mqtt_client is not None and self._connected:
+            self._mqtt_client.disconnect()
+        self._connected = False
+
+    def publish_message(self, message: str = None, mqtt_client: Optional[AWSIoTMQTTClient] = None) -> bool:
+        """Method to publish message to AWS with the IP address.
+
+        The message follows version 2 of the payload schema in `payload.py`,
+        with the epoch timestamp in milliseconds in 'ts'.
+
+        Args:
+            message: IP address to publish.
+            mqtt_client: Deprecated, the connection is kept by the class. A
+                client passed as in `publish_message(mqtt_client, message)` is
+                used for this and later publishes. Defaults to None.
 
         Returns:
-            Content of ifconfig.
-        
-        Raises:
-            ValueError if retrieval was not successful.
+            True if the message was published. A failed publish closes the
+            connection, so the next publish reconnects.
         """
         assert self.username is not None
 
-        # Load the wlan information from file
-        ifconfig_file = f'/home/{self.username}/ifconfig.txt'
-        file_content: List[str] = []
-        with open(ifconfig_file, 'r') as file:
-            file_content = file.readlines()
-            file.close()
-
-        msg = f'Read {len(file_content)} lines in ~/ifconfig.txt'
+        if isinstance(message, AWSIoTMQTTClient) or mqtt_client is not None:
+            warnings.warn(
+                'The mqtt_client argument of publish_message is deprecated, use publish_message(message=...).',
+                DeprecationWarning,
+                stacklevel=2,
+            )
+            if isinstance(message, AWSIoTMQTTClient):
+                # Positional arguments of the old signature
+                message, mqtt_client = mqtt_client, message
+            if mqtt_client is not self._mqtt_client:
+                self._mqtt_client = mqtt_client
+                self._connected = False
+
+        payload = json.dumps(
+            {'v': SCHEMA_VERSION, 'dev': AWS_CLIENT_NAME, 'ts': time.time_ns() // 1_000_000, 'username': self.username, 'ip': message},
+            separators=(',', ':'),
+        )
+        try:
+            self.connect()
+            published = self._mqtt_client.publish(self.topic, payload, 0)
+        except Exception as exc:
+            published = False
+            msg = f'Could not publish to topic {self.topic}: {exc}'
+            log(log_path=LOG_PUBLISHIP, logmsg=msg, printout=True)
+        if not published:
+            self._connected = False
+            return False
+        msg = f'Published to topic {self.topic} with message {message}.'
         log(log_path=LOG_PUBLISHIP, logmsg=msg, printout=True)
-        
-        return file_content
+        return True
 
-    def run_bash(self) -> None:
-        """Method to run the bash script to retrieve the ifconfig content.
+    def default_route_interface(self) -> Optional[str]:
+        """Method to find the device of the default route with the lowest metric.
 
-        Will be stored in the home directory in a file named "ifconfig.txt:.
+        Returns:
+            Device name as string, or None if there is no default route.
         """
-        assert self.path_to_bash is not None
-        subprocess.call(['sh', self.path_to_bash])
-        msg = 'Started bash to read ifconfig.'
-        log(log_path=LOG_PUBLISHIP, logmsg=msg, printout=True)
-        time.sleep(0.1)
-    
-    def clean_ifconfig_file(self, file_content: List[str]) -> List[str]:
-        """Method to clean the ifconfig file content.
+        routes = []
+        try:
+            with open(PROC_NET_ROUTE, 'r') as file:
+                # Columns: Iface Destination Gateway Flags RefCnt Use Metric ...
+                for line in file.readlines()[1:]:
+                    fields = line.split()
+                    if len(fields) > 6 and fields[1] == '00000000' and int(fields[3], 16) & RTF_UP:
+                        routes.append((int(fields[6]), fields[0]))
+        except (OSError, ValueError):
+            return None
+
+        return min(routes)[1] if routes else None
+
+    def find_interface(self) -> Optional[str]:
+        """Method to find the device name looking for an active Ethernet or WiFi device.
+
+        The device of the default route is used if it is usable, i.e. its
+        operational state is 'up' or 'unknown'. Otherwise, of several usable
+        devices, the one with the highest interface index is used, as with the
+        last "state UP" device in `ip addr show`.
+
+        Returns:
+            Device name as string, or None if no device is usable.
+        """
+        interfaces = []
+        for name in os.listdir(SYS_CLASS_NET):
+            if name == 'lo':
+                continue
+            try:
+                with open(os.path.join(SYS_CLASS_NET, name, 'operstate'), 'r') as file:
+                    operstate = file.read().strip()
+                with open(os.path.join(SYS_CLASS_NET, name, 'ifindex'), 'r') as file:
+                    ifindex = int(file.read())
+            except (OSError, ValueError):
+                continue
+            if operstate in USABLE_OPERSTATES:
+                interfaces.append((ifindex, name))
+
+        default_interface = self.default_route_interface()
+        if default_interface in [name for _, name in interfaces]:
+            return default_interface
+        return max(interfaces)[1] if interfaces else None
+
+    def parse_ip(self, interface: str) -> Optional[str]:
+        """Method to find the IPv4 address of a network device.
 
         Args:
-            file_content: Content of the ifconfig file.
+            interface: Device name.
 
         Returns:
-            Cleaned ifconfig file.
+            IP address of the interface device, or None if it has none.
         """
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            try:
+                ifreq = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, struct.pack('256s', interface.encode()[:15]))
+            except OSError:
+                return None
 
-        # Clean the file info to extract only wlan0 content
-        nr_extract: int = 0
-        for i, line in enumerate(file_content):
-            if 'wlan0' in line:
-                nr_extract = i
-
-        file_content = [f.strip() for f in file_content[nr_extract:]]
+        return socket.inet_ntoa(ifreq[20:24])
 
-        return file_content
+    def current_ip(self) -> Optional[str]:
+        """Method to read the current IP address.
 
-    def publish_message(self, mqtt_client: AWSIoTMQTTClient, message: str) -> None:
-        """Method to publish message to AWS with the ifconfig wlan information.
+        Returns:
+            IP address of `interface`, or of the active device if it is not set.
+            None if there is no address.
         """
-        assert self.username is not None
+        interface = self.interface if self.interface is not None else self.find_interface()
+        if interface is None:
+            return None
+        return self.parse_ip(interface=interface)
 
-        now = datetime.now().strftime("%Y-%m-%d %I:%M:%S")
-        
-        topic = f'topic/publish_ip'
-        mqtt_connection = mqtt_client.connect()
-        mqtt_client.publish(
-            topic,
-            "{\"Timestamp\" :\"" + str(now) +
-            "\", \"username\" :\"" + str(self.username) +
-            "\", \"ip\":\"" + message + "\"}", 0)
-        msg = f'Published to topic {topic} with message {message}.'
-        log(log_path=LOG_PUBLISHIP, logmsg=msg, printout=True)
+    def publish_if_changed(self, refresh_interval: Optional[float] = None) -> bool:
+        """Method to publish the IP address if it changed since the last publish.
 
-    def find_interface(self) -> str:
-        """Method to find the device name looking for an active Ethernet or WiFi device
+        Args:
+            refresh_interval: Time in seconds after which an unchanged address is
+                published again. Defaults to None, which never publishes it again.
 
         Returns:
-            Device name as string.
+            True if the address was published.
         """
-        find_device = "ip addr show"
-        interface_parse = self.run_cmd(cmd=find_device)
-        for line in interface_parse.splitlines():
-            if "state UP" in line:
-                dev_name = line.split(':')[1]
+        ip_address = self.current_ip()
+        if ip_address is None:
+            return False
+        refresh = refresh_interval is not None and time.monotonic() - self._last_publish >= refresh_interval
+        if ip_address == self._last_ip and not refresh:
+            return False
+        if not self.publish_message(message=ip_address):
+            return False
+        if ip_address != self._last_ip:
+            self._save_state(ip_address=ip_address)
+        self._last_ip = ip_address
+        self._last_publish = time.monotonic()
+        return True
+
+    def _open_netlink(self) -> Optional[socket.socket]:
+        """Method to subscribe to the link and address changes of the kernel.
 
-        return dev_name
+        Returns:
+            Netlink socket, or None if netlink is not available.
+        """
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        except (AttributeError, OSError) as exc:
+            msg = f'Netlink is not available, polling every interval: {exc}'
+            log(log_path=LOG_PUBLISHIP, logmsg=msg, printout=True)
+            return None
+        sock.setblocking(False)
+        return sock
+
+    def monitor(self, interval: float = 60.0, refresh_interval: Optional[float] = None) -> None:
+        """Method to publish the IP address whenever it changes, until `stop` is called.
 
-    def parse_ip(self, interface: str) -> str:
-        """Method to find an active IP on the first live network device.
+        Args:
+            interval: Maximum time in seconds between two checks. Defaults to 60 seconds.
+            refresh_interval: Time in seconds after which an unchanged address is
+                published again. Defaults to None, which never publishes it again.
+        """
+        netlink = self._open_netlink()
+        msg = f'Monitoring the IP address, last published {self._last_ip}'
+        log(log_path=LOG_PUBLISHIP, logmsg=msg, printout=True)
+        try:
+            while not self._stopped.is_set():
+                self.publish_if_changed(refresh_interval=refresh_interval)
+                if netlink is None:
+                    self._stopped.wait(interval)
+                    continue
+                readable, _, _ = select.select([netlink], [], [], interval)
+                if readable:
+                    # Drain the notifications, a change triggers a single check
+                    while True:
+                        try:
+                            netlink.recv(65536)
+                        except BlockingIOError:
+                            break
+                    # Give DHCP a moment to settle before reading the address
+                    self._stopped.wait(1.0)
+        finally:
+            if netlink is not None:
+                netlink.close()
+            self.disconnect()
+
+    def stop(self) -> None:
+        """Method to make a running `monitor` return.
+        """
+        self._stopped.set()
+
+    @classmethod
+    def _path_get_wlan_info(cls, username: str) -> str:
+        """Class method to retrieve the path to the bash script which executes
+        the code to read the output of the `ifconfig`-command
 
         Args:
-            interface: Device name.
-        
+            username: Linux username.
+
         Returns:
-            IP address of the interface device
+            Path to the bash script to retrieve `ifconfig`.
         """
-        find_ip = f"ip addr show {interface}"
-        find_ip = f"ip addr show {interface}"
-        ip_parse = self.run_cmd(cmd=find_ip)
-        for line in ip_parse.splitlines():
-            if "inet " in line:
-                ip = line.split(' ')[5]
-                ip = ip.split('/')[0]
+        return f'/home/{username}/{BASH_GET_WLAN}'
 
-        return ip
+    def run_bash(self) -> None:
+        """Method to run the bash script to retrieve the ifconfig content.
 
-    def run_cmd(self, cmd: str) -> str:
-        """Method to run a command via Popen.
+        Deprecated, `current_ip` reads the address without a subprocess.
+        Will be stored in the home directory in a file named "ifconfig.txt".
+        """
+        warnings.warn('run_bash is deprecated, use current_ip.', DeprecationWarning, stacklevel=2)
+        path_to_bash = self.path_to_bash or PublishIp._path_get_wlan_info(username=self.username)
+        subprocess.call(['sh', path_to_bash])
+        msg = 'Started bash to read ifconfig.'
+        log(log_path=LOG_PUBLISHIP, logmsg=msg, printout=True)
+        time.sleep(0.1)
+
+    def read_ifconfig(self) -> List[str]:
+        """Method to retrieve the content of the ifconfig file written by `run_bash`.
+
+        Deprecated, `current_ip` reads the address without a subprocess.
 
-        Args:
-            cmd: Command to run.
-        
         Returns:
-            Response from the command.
+            Content of ifconfig.
         """
-        p = Popen(cmd, shell=True, stdout=PIPE)
-        output = p.communicate()[0]
+        warnings.warn('read_ifconfig is deprecated, use current_ip.', DeprecationWarning, stacklevel=2)
+        assert self.username is not None
+        with open(f'/home/{self.username}/ifconfig.txt', 'r') as file:
+            file_content = file.readlines()
 
-        return output.decode('ascii')
+        msg = f'Read {len(file_content)} lines in ~/ifconfig.txt'
+        log(log_path=LOG_PUBLISHIP, logmsg=msg, printout=True)
+        return file_content
 
 
 if __name__ == "__main__":
-    # -------------------------------------------------------------------------------- #
-    # Use below commented out commented oll the content in ifconfig
-    # -------------------------------------------------------------------------------- #
-    # publish_ip = PublishIp()
-    # # Run the bash to retrieve ifconfig and save to ifconfig.txt
-    # publish_ip.run_bash()
-    # # Read ifconfig content
-    # ifconfig_content = publish_ip.read_ifconfig()
-    # # Clean ifconfig content
-    # ifconfig_content = publish_ip.clean_ifconfig_file(file_content=ifconfig_content)
-    # # Connect to AWS
-    # mqtt_client = publish_ip.setup_aws()
-    # # Publish mesage
-    # message = ''.join(ifconfig_content)
-    # publish_ip.publish_message(mqtt_client=mqtt_client, message=message)
-    # -------------------------------------------------------------------------------- #
-    # Use below to find only IP address
-    # -------------------------------------------------------------------------------- #
-    publish_ip = PublishIp()
-    interface = publish_ip.find_interface()
-    ip_address = publish_ip.parse_ip(interface=interface)
-    # # Connect to AWS
-    mqtt_client = publish_ip.setup_aws()
-    # # Publish mesage
-    publish_ip.publish_message(mqtt_client=mqtt_client, message=ip_address)
+    parser = argparse.ArgumentParser(description='Publish the IP address of the RaspberryPi to AWS IoT.')
+    parser.add_argument('--once', action='store_true', help='Publish once if the address changed and exit, e.g. from cron.')
+    args = parser.parse_args()
+
+    publish_ip = PublishIp(state_path=PUBLISHIP_STATE, topic=AWS_TOPIC_PUBLISH_IP)
+    if args.once:
+        publish_ip.publish_if_changed()
+        publish_ip.disconnect()
+    else:
+        signal.signal(signal.SIGTERM, lambda signum, frame: publish_ip.stop())
+        try:
+            publish_ip.monitor(interval=PUBLISHIP_INTERVAL, refresh_interval=PUBLISHIP_REFRESH_INTERVAL)
+        except KeyboardInterrupt:
+            publish_ip.stop()
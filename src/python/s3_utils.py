@@ -0,0 +1,138 @@
+"""
+================================================================================
+Description: This script contains the S3 helpers used by the analysis to
+             download the MQTT messages. They live apart from utils.py, so the
+             readout daemon does not import boto3.
+================================================================================
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+from utils import logger
+
+
+def _load_manifest(manifest_path: str) -> Dict[str, str]:
+    """Function to load the manifest of previously downloaded S3 objects.
+
+    Args:
+        manifest_path: Full path to the manifest file.
+
+    Returns:
+        Dictionary mapping the local target path to the ETag of the downloaded object.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+
+def _save_manifest(manifest_path: str, manifest: Dict[str, str]) -> None:
+    """Function to atomically write the manifest of downloaded S3 objects.
+
+    Args:
+        manifest_path: Full path to the manifest file.
+        manifest: Dictionary mapping the local target path to the ETag.
+    """
+    tmp_path = f'{manifest_path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, manifest_path)
+
+
+def download_s3_folder(
+    bucket_name: str,
+    s3_folder: str,
+    local_dir: str = None,
+    max_workers: int = 16,
+    manifest_path: str = '.s3_manifest.json',
+    progress_every: int = 1000,
+    s3_resource=None,
+) -> Dict[str, float]:
+    """
+    Download the contents of a folder directory
+    Only objects which are new or changed since the last download are fetched.
+    The ETags of the downloaded objects are kept in a manifest file.
+    Args:
+        bucket_name: the name of the s3 bucket
+        s3_folder: the folder path in the s3 bucket
+        local_dir: a relative or absolute directory path in the local file system
+        max_workers: number of parallel downloads
+        manifest_path: path to the manifest of downloaded objects. Keep it outside
+            of `local_dir` so it is not mistaken for a downloaded message.
+        progress_every: log the progress after this many downloads
+        s3_resource: boto3 S3 resource, e.g. for a local S3 stand-in. Defaults to
+            a resource created with the default session.
+    Returns:
+        Dictionary with the number of listed, skipped, downloaded and failed
+        objects, the downloaded bytes and the throughput.
+    """
+    if s3_resource is None:
+        import boto3
+
+        s3_resource = boto3.resource('s3')
+    bucket = s3_resource.Bucket(bucket_name)
+    # The low-level client is thread-safe, the resource is not
+    client = s3_resource.meta.client
+    manifest = _load_manifest(manifest_path=manifest_path)
+
+    start = time.monotonic()
+    listed = 0
+    pending: List[Tuple[str, str, str, int]] = []
+    for obj in bucket.objects.filter(Prefix=s3_folder):
+        if obj.key[-1] == '/':
+            continue
+        listed += 1
+        target = obj.key if local_dir is None \
+            else os.path.join(local_dir, os.path.relpath(obj.key, s3_folder))
+        if manifest.get(target) == obj.e_tag and os.path.exists(target):
+            continue
+        pending.append((obj.key, target, obj.e_tag, obj.size))
+
+    for directory in {os.path.dirname(target) for _, target, _, _ in pending}:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def download(key: str, target: str) -> None:
+        client.download_file(bucket_name, key, target)
+
+    downloaded = 0
+    failed = 0
+    downloaded_bytes = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(download, key, target): (target, e_tag, size)
+            for key, target, e_tag, size in pending
+        }
+        for future in as_completed(futures):
+            target, e_tag, size = futures[future]
+            if future.exception() is not None:
+                failed += 1
+                logger.info(f"## Failed to download {target}: {future.exception()}")
+                continue
+            manifest[target] = e_tag
+            downloaded += 1
+            downloaded_bytes += size
+            if downloaded % progress_every == 0:
+                elapsed = time.monotonic() - start
+                logger.info(
+                    f"## Downloaded {downloaded}/{len(pending)} objects, "
+                    f"{downloaded / elapsed:.1f} objects/s, {downloaded_bytes / elapsed / 1e6:.2f} MB/s."
+                )
+                _save_manifest(manifest_path=manifest_path, manifest=manifest)
+
+    _save_manifest(manifest_path=manifest_path, manifest=manifest)
+    elapsed = time.monotonic() - start
+    stats = {
+        'listed': listed,
+        'skipped': listed - len(pending),
+        'downloaded': downloaded,
+        'failed': failed,
+        'bytes': downloaded_bytes,
+        'seconds': round(elapsed, 3),
+        'objects_per_second': round(downloaded / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+    logger.info(f"## Synced s3://{bucket_name}/{s3_folder}: {stats}.")
+    return stats
@@ -0,0 +1,830 @@
+"""
+================================================================================
+Description: This script contains the sinks the readout loop in hamsterwheel.py
+             fans its events out to. Every sink has its own bounded queue and
+             worker thread, so a slow sink neither blocks the readout loop nor
+             the other sinks.
+================================================================================
+"""
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime
+import json
+import os
+import threading
+import time
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from event_log import EventLogWriter
+from instrumentation import REGISTRY
+from payload import MAX_BATCH, Reading, encode_binary, encode_json, encode_legacy
+from spool import MessageSpool
+from utils import BufferedLogWriter, log, logger, open_log_writer
+
+Stats = Dict[str, Union[int, float]]
+
+_SINK_LATENCY_SECONDS = REGISTRY.histogram(
+    name='hamsterwheel_sink_latency_seconds',
+    documentation='Time from queueing an event in a sink until it was handled.',
+)
+_PUBLISH_SECONDS = REGISTRY.histogram(
+    name='hamsterwheel_publish_seconds',
+    documentation='Time of a single MQTT publish call.',
+)
+_PUBLISH_FAILURES = REGISTRY.counter(
+    name='hamsterwheel_publish_failures_total',
+    documentation='Number of failed MQTT publish calls.',
+)
+
+
+class Event(NamedTuple):
+    """Event produced by the readout loop.
+
+    Attributes:
+        kind: 'reading' for a reported pin state, 'aggregate' for a window summary
+            from `WindowAggregator`, 'metrics' for a session or daily summary
+            from `WheelMetrics`.
+        timestamp_ns: Epoch timestamp of the event in nanoseconds.
+        pin_state: State of the wheel pin for readings, 0 if the loop is closed.
+        edge: True if the pin state of a reading changed.
+        keepalive: True if a reading is reported as keep-alive.
+        duration: Duration in seconds of the previous state of a reading (of the
+            current state for keep-alives), None if unknown or not reported.
+        summary: Summary of 'aggregate' and 'metrics' events.
+        wheel_id: ID of the wheel of the event, None if only one wheel is read out.
+    """
+    kind: str
+    timestamp_ns: int
+    pin_state: Optional[int] = None
+    edge: bool = False
+    keepalive: bool = False
+    duration: Optional[float] = None
+    summary: Optional[dict] = None
+    wheel_id: Optional[str] = None
+
+
+def format_reading(event: Event) -> str:
+    """Function to format a reading as in the local log.
+
+    Args:
+        event: Reading event.
+
+    Returns:
+        'pin_state = N' with the keep-alive or the previous state duration if set,
+        prefixed with 'wheel_id = X, ' if the event has a wheel ID.
+    """
+    msg = f'pin_state = {event.pin_state}'
+    if event.wheel_id is not None:
+        msg = f'wheel_id = {event.wheel_id}, {msg}'
+    if event.keepalive:
+        return f'{msg}, keepalive, state_duration = {event.duration:.3f}'
+    if event.duration is not None:
+        return f'{msg}, previous_state_duration = {event.duration:.3f}'
+    return msg
+
+
+class Sink(ABC):
+    """Base class of a sink with a bounded queue and a worker thread.
+
+    `put` only appends the event to the queue. The worker calls `handle` for
+    every event and `flush` whenever the queue is empty. Subclasses must
+    implement `handle` and may override `open`, `flush`, `idle` and `shutdown`.
+
+    If the queue is full, `overflow` decides what happens:
+        drop_oldest: The oldest queued event is dropped.
+        drop_newest: The new event is dropped.
+        coalesce: The new event replaces the newest queued event of the same
+            kind and wheel, or the oldest event if there is none.
+        block: `put` waits until there is space in the queue.
+
+    Attributes:
+        name: Name of the sink used in logs and stats.
+        maxsize: Maximum number of queued events. Defaults to 10000.
+        overflow: Overflow policy. Defaults to 'drop_oldest'.
+        on_stats: Optional function called with `stats()` every `stats_interval`
+            seconds from the worker thread.
+        stats_interval: Seconds between two calls of `on_stats`. Defaults to 300.
+        idle_interval: Seconds without events after which the worker calls `idle`.
+            Defaults to None, which disables `idle`.
+    """
+    supported_overflow = ['drop_oldest', 'drop_newest', 'coalesce', 'block']
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 10000,
+        overflow: str = 'drop_oldest',
+        on_stats: Optional[Callable[[Stats], None]] = None,
+        stats_interval: float = 300.0,
+        idle_interval: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self._maxsize = Sink._validate_maxsize(maxsize=maxsize)
+        self._overflow = Sink._validate_overflow(overflow=overflow)
+        self._on_stats = on_stats
+        self._stats_interval = stats_interval
+        self._idle_interval = idle_interval
+        self._queue: Deque[Tuple[Event, int]] = deque()
+        self._condition = threading.Condition(threading.Lock())
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._enqueued = 0
+        self._handled = 0
+        self._failed = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._hook_failures = 0
+        self._abandoned = 0
+        self._latency_sum_ns = 0
+        self._latency_max_ns = 0
+
+    @classmethod
+    def _validate_maxsize(cls, maxsize: int) -> int:
+        """Class method to validate user input.
+
+        Args:
+            maxsize: Queue size input argument.
+
+        Returns:
+            maxsize if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(maxsize, int)
+            assert maxsize > 0
+
+        except AssertionError:
+            errmsg = f'Queue size {maxsize} is not supported. Must be a positive integer.'
+            raise ValueError(errmsg) from AssertionError
+
+        return maxsize
+
+    @classmethod
+    def _validate_overflow(cls, overflow: str) -> str:
+        """Class method to validate user input.
+
+        Args:
+            overflow: Overflow policy input argument.
+
+        Returns:
+            overflow if it is a part of the supported overflow policies.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert overflow in Sink.supported_overflow
+
+        except AssertionError:
+            errmsg = f'Overflow policy {overflow} is not among the supported policies {Sink.supported_overflow}.'
+            raise ValueError(errmsg) from AssertionError
+
+        return overflow
+
+    def open(self) -> None:
+        """Method to acquire the resources of the sink, called by `start`.
+        """
+
+    @abstractmethod
+    def handle(self, event: Event) -> None:
+        """Method to write or send a single event, called from the worker thread.
+
+        Args:
+            event: Event to handle.
+        """
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Method called from the worker thread whenever the queue is empty.
+        """
+
+    def idle(self) -> None:
+        """Method called from the worker thread every `idle_interval` seconds without events.
+        """
+
+    def shutdown(self) -> None:
+        """Method to release the resources of the sink, called by `close`.
+        """
+
+    def start(self) -> None:
+        """Method to open the sink and start the worker thread.
+        """
+        self.open()
+        self._thread = threading.Thread(target=self._run, name=f'sink-{self.name}', daemon=True)
+        self._thread.start()
+
+    def put(self, event: Event) -> bool:
+        """Method to queue an event.
+
+        Args:
+            event: Event to queue.
+
+        Returns:
+            True if the event was queued, False if it was dropped.
+        """
+        item = (event, time.monotonic_ns())
+        with self._condition:
+            self._enqueued += 1
+            if len(self._queue) >= self._maxsize:
+                if self._overflow == 'drop_newest':
+                    self._dropped += 1
+                    return False
+                if self._overflow == 'block':
+                    self._condition.wait_for(lambda: len(self._queue) < self._maxsize or self._closed)
+                elif self._overflow == 'coalesce' and self._coalesce(item=item):
+                    return True
+                else:
+                    self._queue.popleft()
+                    self._dropped += 1
+            self._queue.append(item)
+            self._condition.notify_all()
+        return True
+
+    def _coalesce(self, item: Tuple[Event, int]) -> bool:
+        """Method to replace the newest queued event of the kind and wheel of `item`.
+
+        Keeps the enqueue time of the replaced event, so the latency covers the
+        whole time the kind was waiting. Must be called with the lock held.
+
+        Args:
+            item: Tuple of event and enqueue time.
+
+        Returns:
+            True if an event was replaced.
+        """
+        for index in range(len(self._queue) - 1, -1, -1):
+            queued = self._queue[index][0]
+            if queued.kind == item[0].kind and queued.wheel_id == item[0].wheel_id:
+                self._queue[index] = (item[0], self._queue[index][1])
+                self._coalesced += 1
+                return True
+        return False
+
+    def stats(self) -> Stats:
+        """Method to get the counters of the sink.
+
+        Returns:
+            Dictionary with the queue depth, the event counters, the failed calls
+            of `flush`, `idle` and `on_stats`, the events left queued by a worker
+            which did not stop in time, and the mean and maximum
+            enqueue-to-handled latency in milliseconds.
+        """
+        with self._condition:
+            done = self._handled + self._failed
+            return {
+                'depth': len(self._queue),
+                'enqueued': self._enqueued,
+                'handled': self._handled,
+                'failed': self._failed,
+                'dropped': self._dropped,
+                'coalesced': self._coalesced,
+                'hook_failures': self._hook_failures,
+                'abandoned': self._abandoned,
+                'latency_mean_ms': round(self._latency_sum_ns / done / 1e6, 3) if done else 0.0,
+                'latency_max_ms': round(self._latency_max_ns / 1e6, 3),
+            }
+
+    def _run(self) -> None:
+        """Method run in the worker thread to handle the queued events.
+        """
+        next_stats = time.monotonic() + self._stats_interval
+        timeout = self._stats_interval if self._idle_interval is None else min(self._stats_interval, self._idle_interval)
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._closed, timeout=timeout)
+                if not self._queue and self._closed:
+                    return
+                item = self._queue.popleft() if self._queue else None
+                empty = not self._queue
+                self._condition.notify_all()
+
+            if item is not None:
+                event, enqueued_ns = item
+                try:
+                    self.handle(event)
+                    failed = False
+                except Exception:
+                    failed = True
+                latency_ns = time.monotonic_ns() - enqueued_ns
+                with self._condition:
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._handled += 1
+                    self._latency_sum_ns += latency_ns
+                    self._latency_max_ns = max(self._latency_max_ns, latency_ns)
+                _SINK_LATENCY_SECONDS.observe(latency_ns / 1e9, labels={'sink': self.name})
+                if empty:
+                    self._call_hook(hook=self.flush)
+            elif self._idle_interval is not None:
+                self._call_hook(hook=self.idle)
+
+            if self._on_stats is not None and time.monotonic() >= next_stats:
+                self._call_hook(hook=lambda: self._on_stats(self.stats()))
+                next_stats = time.monotonic() + self._stats_interval
+
+    def _call_hook(self, hook: Callable[[], None]) -> None:
+        """Method to call a hook from the worker thread without letting it end the thread.
+
+        Args:
+            hook: Hook to call, e.g. `flush` or `idle`.
+        """
+        try:
+            hook()
+        except Exception as exc:
+            with self._condition:
+                self._hook_failures += 1
+            logger.warning(f'Sink {self.name}: {getattr(hook, "__name__", "hook")} failed: {exc!r}')
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Method to handle the remaining events, stop the worker thread and close the sink.
+
+        If the worker is still busy after `timeout`, the remaining events are
+        counted as abandoned and the sink is left to the worker instead of being
+        flushed and shut down underneath it.
+
+        Args:
+            timeout: Maximum time in seconds to wait for the queue to be handled.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                with self._condition:
+                    self._abandoned += len(self._queue)
+                    abandoned = self._abandoned
+                logger.warning(f'Sink {self.name}: worker did not stop within {timeout} s, abandoned {abandoned} events.')
+                return
+        self._call_hook(hook=self.flush)
+        self._call_hook(hook=self.shutdown)
+
+
+class LocalFileSink(Sink):
+    """Sink writing the readings to a local log file.
+
+    The lines are handed to the `BufferedLogWriter` registered for `log_path`
+    (see `utils.open_log_writer`), so they share the file handle and the fsync
+    policy with other messages logged to the same file.
+
+    Attributes:
+        log_path: Full path to the log file.
+    """
+
+    def __init__(self, log_path: str, **kwargs) -> None:
+        super().__init__(name='local', **kwargs)
+        self.log_path = log_path
+        self._writer: Optional[BufferedLogWriter] = None
+
+    def open(self) -> None:
+        self._writer = open_log_writer(log_path=self.log_path)
+
+    def handle(self, event: Event) -> None:
+        if event.kind == 'reading':
+            self._writer.write(logmsg=format_reading(event=event))
+
+
+class BinaryLogSink(Sink):
+    """Sink appending the readings to a binary event log, see `event_log.py`.
+
+    The records have no room for a wheel ID, so every wheel gets its own log
+    next to `path`, e.g. `events_cage1.bin`. Readings without wheel ID go to
+    `path` itself.
+
+    Attributes:
+        path: Full path to the event log file.
+    """
+
+    def __init__(self, path: str, **kwargs) -> None:
+        super().__init__(name='binary', **kwargs)
+        self.path = path
+        self._event_logs: Dict[Optional[str], EventLogWriter] = {}
+
+    def wheel_path(self, wheel_id: Optional[str]) -> str:
+        """Method to get the path of the event log of a wheel.
+
+        Args:
+            wheel_id: ID of the wheel, None for the readings without wheel ID.
+
+        Returns:
+            Full path to the event log of the wheel.
+        """
+        if wheel_id is None:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f'{root}_{wheel_id}{ext}'
+
+    def handle(self, event: Event) -> None:
+        if event.kind != 'reading':
+            return
+        event_log = self._event_logs.get(event.wheel_id)
+        if event_log is None:
+            event_log = EventLogWriter(path=self.wheel_path(wheel_id=event.wheel_id))
+            self._event_logs[event.wheel_id] = event_log
+        event_log.append(timestamp_ns=event.timestamp_ns, pin_state=event.pin_state, edge=event.edge)
+
+    def shutdown(self) -> None:
+        for event_log in self._event_logs.values():
+            event_log.close()
+        self._event_logs = {}
+
+
+class StdoutSink(Sink):
+    """Sink printing all events to the standard output.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(name='stdout', **kwargs)
+
+    def handle(self, event: Event) -> None:
+        timestamp = datetime.fromtimestamp(event.timestamp_ns / 1e9)
+        if event.kind == 'reading':
+            print(f'{timestamp} - {format_reading(event=event)}')
+        else:
+            print(f'{timestamp} - {event.kind}: {json.dumps(event.summary, separators=(",", ":"))}')
+
+
+class MqttSink(Sink):
+    """Sink publishing the events to AWS IoT.
+
+    Readings are published to `topic`, window summaries to `aggregate_topic`
+    and session and daily summaries to `metrics_topic`. AWSIoTPythonSDK is
+    only imported when the sink is opened.
+
+    `payload_format` selects the payload of the readings, see `payload.py`:
+        legacy: One version 1 JSON message per reading.
+        json: Version 2 JSON batches of up to `batch_size` readings per wheel,
+            published at the latest `batch_interval` seconds after their
+            first reading.
+        binary: Version 2 batches in the binary encoding.
+
+    If `spool_path` is set, every message is first stored in a `MessageSpool`
+    and only removed once it was published. A failed publish pauses the
+    publishing for `retry_interval` seconds; the spool is also drained when no
+    new events arrive. Without spool, messages which could not be published are
+    kept in order, at most `MAX_BATCH` of them, and retried in the same way.
+
+    Attributes:
+        client_name: Client id of the MQTT connection.
+        endpoint: AWS IoT endpoint.
+        ca_file: Full path to the root CA certificate.
+        key: Full path to the private key of the device.
+        cert: Full path to the certificate of the device.
+        topic: Topic of the readings.
+        aggregate_topic: Topic of the window summaries.
+        metrics_topic: Topic of the session and daily summaries.
+        log_path: Full path to the log of the published messages.
+        publish_readings: If False, readings are not published. Defaults to True.
+        spool_path: Full path to the spool database. Defaults to None.
+        spool_max_messages: Maximum number of spooled messages. Defaults to 500000.
+        retry_interval: Seconds between two attempts to publish the spool after
+            a failure. Defaults to 10 seconds.
+        payload_format: Payload of the readings, 'legacy', 'json' or 'binary'.
+            Defaults to 'legacy'.
+        batch_size: Maximum number of readings in a batch. Defaults to 50.
+        batch_interval: Maximum time in seconds a reading waits in a batch.
+            Defaults to 5 seconds.
+    """
+    supported_payload_formats = ['legacy', 'json', 'binary']
+
+    def __init__(
+        self,
+        client_name: str,
+        endpoint: str,
+        ca_file: str,
+        key: str,
+        cert: str,
+        topic: str,
+        aggregate_topic: str,
+        metrics_topic: str,
+        log_path: str,
+        publish_readings: bool = True,
+        spool_path: Optional[str] = None,
+        spool_max_messages: int = 500000,
+        retry_interval: float = 10.0,
+        payload_format: str = 'legacy',
+        batch_size: int = 50,
+        batch_interval: float = 5.0,
+        **kwargs,
+    ) -> None:
+        self._payload_format = MqttSink._validate_payload_format(payload_format=payload_format)
+        self._batch_size = MqttSink._validate_batch_size(batch_size=batch_size)
+        self._batch_interval = batch_interval
+        idle_intervals = [retry_interval]
+        if self._payload_format != 'legacy':
+            idle_intervals.append(batch_interval)
+        kwargs.setdefault('idle_interval', min(idle_intervals))
+        super().__init__(name='mqtt', **kwargs)
+        self._client_name = client_name
+        self._endpoint = endpoint
+        self._ca_file = ca_file
+        self._key = key
+        self._cert = cert
+        self._topics = {'reading': topic, 'aggregate': aggregate_topic, 'metrics': metrics_topic}
+        self._log_path = log_path
+        self._publish_readings = publish_readings
+        self._spool_path = spool_path
+        self._spool_max_messages = spool_max_messages
+        self._retry_interval = retry_interval
+        self._spool: Optional[MessageSpool] = None
+        self._client = None
+        self._connected = False
+        self._retry_at = 0.0
+        # Messages which could not be published, and when to retry them
+        self._pending: Deque[Tuple[str, Union[str, bytes]]] = deque()
+        self._pending_retry_at = 0.0
+        # Readings waiting for their batch per wheel ID, and when the batch started
+        self._batches: Dict[Optional[str], List[Reading]] = {}
+        self._batch_started: Dict[Optional[str], float] = {}
+        self._seq = 0
+
+    @classmethod
+    def _validate_payload_format(cls, payload_format: str) -> str:
+        """Class method to validate user input.
+
+        Args:
+            payload_format: Payload format input argument.
+
+        Returns:
+            payload_format if it is a part of the supported payload formats.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert payload_format in MqttSink.supported_payload_formats
+
+        except AssertionError:
+            errmsg = f'Payload format {payload_format} is not among the supported formats {MqttSink.supported_payload_formats}.'
+            raise ValueError(errmsg) from AssertionError
+
+        return payload_format
+
+    @classmethod
+    def _validate_batch_size(cls, batch_size: int) -> int:
+        """Class method to validate user input.
+
+        Args:
+            batch_size: Batch size input argument.
+
+        Returns:
+            batch_size if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(batch_size, int)
+            assert 0 < batch_size <= MAX_BATCH
+
+        except AssertionError:
+            errmsg = f'Batch size {batch_size} is not supported. Must be an integer between 1 and {MAX_BATCH}.'
+            raise ValueError(errmsg) from AssertionError
+
+        return batch_size
+
+    def create_client(self):
+        """Method to create an MQTT client for the endpoint and credentials of the sink.
+
+        Returns:
+            AWSIoTMQTTClient, not yet connected.
+        """
+        from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+
+        client = AWSIoTMQTTClient(self._client_name)
+        client.configureEndpoint(self._endpoint, 8883)
+        client.configureCredentials(CAFilePath=self._ca_file, KeyPath=self._key, CertificatePath=self._cert)
+        return client
+
+    def open(self) -> None:
+        if self._spool_path is not None:
+            self._spool = MessageSpool(path=self._spool_path, max_messages=self._spool_max_messages)
+        self._client = self.create_client()
+        if self._spool is not None:
+            # Fail fast while offline, the spool keeps the messages instead
+            self._client.configureOfflinePublishQueueing(0)
+        self._connect()
+
+    def _connect(self) -> None:
+        """Method to connect to the AWS mqtt endpoint.
+
+        Without spool a failed connection raises. With spool the failure is
+        logged and the connection is retried when the spool is drained.
+        """
+        if self._spool is None:
+            self._client.connect()
+            self._connected = True
+            return
+        try:
+            self._connected = bool(self._client.connect())
+        except Exception as exc:
+            msg = f'Could not connect to AWS, spooling messages: {exc}'
+            log(log_path=self._log_path, logmsg=msg, printout=True)
+
+    def _drain_spool(self) -> None:
+        """Method to publish the spooled messages, at most once per `retry_interval` after a failure.
+        """
+        if time.monotonic() < self._retry_at:
+            return
+        if not self._connected:
+            self._connect()
+        published = 0
+        if self._connected:
+            published = self._spool.drain(publish=self._client_publish)
+        if self._spool.depth > 0:
+            self._retry_at = time.monotonic() + self._retry_interval
+            msg = f'Published {published} spooled messages, spool depth {self._spool.depth}, dropped {self._spool.dropped}.'
+            log(log_path=self._log_path, logmsg=msg, printout=True)
+
+    def _client_publish(self, topic: str, payload: Union[str, bytes]) -> bool:
+        """Method to publish a message with the MQTT client and record its latency.
+
+        Args:
+            topic: Topic to publish to.
+            payload: Message to publish.
+
+        Returns:
+            True if the message was published.
+        """
+        start = time.perf_counter()
+        published = False
+        try:
+            published = self._client.publish(topic, payload, 0)
+        finally:
+            _PUBLISH_SECONDS.observe(time.perf_counter() - start)
+            if not published:
+                _PUBLISH_FAILURES.inc()
+        return published
+
+    def _publish(self, topic: str, payload: Union[str, bytes]) -> bool:
+        """Method to publish a message, going through the spool if it is enabled.
+
+        Args:
+            topic: Topic to publish to.
+            payload: Message to publish.
+
+        Returns:
+            True if the message was published or spooled.
+        """
+        if self._spool is None:
+            return self._client_publish(topic, payload)
+        self._spool.put(topic=topic, payload=payload)
+        self._drain_spool()
+        return True
+
+    def _publish_message(self, topic: str, payload: Union[str, bytes]) -> bool:
+        """Method to publish a message after the pending ones, keeping it if that fails.
+
+        Args:
+            topic: Topic to publish to.
+            payload: Message to publish.
+
+        Returns:
+            True if the message was published or spooled.
+        """
+        self._pending.append((topic, payload))
+        if len(self._pending) > MAX_BATCH:
+            with self._condition:
+                self._dropped += 1
+            self._pending.popleft()
+        self._publish_pending()
+        return not self._pending
+
+    def _publish_pending(self) -> None:
+        """Method to publish the pending messages in order, at most once per `retry_interval` after a failure.
+        """
+        if time.monotonic() < self._pending_retry_at:
+            return
+        while self._pending:
+            topic, payload = self._pending[0]
+            try:
+                published = self._publish(topic, payload)
+            except Exception as exc:
+                published = False
+                msg = f'Could not publish to topic {topic}: {exc}.'
+                log(log_path=self._log_path, logmsg=msg, printout=True)
+            if not published:
+                self._pending_retry_at = time.monotonic() + self._retry_interval
+                msg = f'Could not publish to topic {topic}, {len(self._pending)} messages pending.'
+                log(log_path=self._log_path, logmsg=msg, printout=True)
+                return
+            self._pending.popleft()
+
+    def _publish_batch(self, wheel_id: Optional[str]) -> None:
+        """Method to publish the batch of a wheel, in parts of at most `batch_size` readings.
+
+        Readings are only removed from the batch once they were published or
+        spooled. After a failure the rest of the batch is kept and retried
+        `batch_interval` seconds later; beyond `MAX_BATCH` readings the oldest
+        are dropped.
+
+        Args:
+            wheel_id: Wheel ID of the batch.
+        """
+        readings = self._batches.get(wheel_id)
+        encode = encode_json if self._payload_format == 'json' else encode_binary
+        while readings:
+            part = readings[:self._batch_size]
+            payload = encode(device_id=self._client_name, seq=self._seq, readings=part, wheel_id=wheel_id)
+            try:
+                published = self._publish(self._topics['reading'], payload)
+            except Exception as exc:
+                published = False
+                msg = f'Could not publish batch of {len(part)} readings: {exc}'
+                log(log_path=self._log_path, logmsg=msg, printout=True)
+            if not published:
+                if len(readings) > MAX_BATCH:
+                    with self._condition:
+                        self._dropped += len(readings) - MAX_BATCH
+                    del readings[:len(readings) - MAX_BATCH]
+                self._batch_started[wheel_id] = time.monotonic()
+                return
+            self._seq += 1
+            del readings[:len(part)]
+            msg = f'Published to topic {self._topics["reading"]} batch of {len(part)} readings ({len(payload)} bytes).'
+            log(log_path=self._log_path, logmsg=msg, printout=True)
+        self._batches.pop(wheel_id, None)
+        self._batch_started.pop(wheel_id, None)
+
+    def _publish_due_batches(self, force: bool = False) -> None:
+        """Method to publish the batches whose first reading waited `batch_interval`.
+
+        Args:
+            force: If True, all batches are published. Defaults to False.
+        """
+        now = time.monotonic()
+        for wheel_id, started in list(self._batch_started.items()):
+            if force or now - started >= self._batch_interval:
+                self._publish_batch(wheel_id=wheel_id)
+
+    def handle(self, event: Event) -> None:
+        topic = self._topics[event.kind]
+        if event.kind == 'reading':
+            if not self._publish_readings:
+                return
+            if self._payload_format != 'legacy':
+                batch = self._batches.setdefault(event.wheel_id, [])
+                if not batch:
+                    self._batch_started[event.wheel_id] = time.monotonic()
+                batch.append(Reading(
+                    timestamp_ms=event.timestamp_ns // 1_000_000,
+                    pin_state=event.pin_state,
+                    keepalive=event.keepalive,
+                    edge=event.edge,
+                    duration=event.duration,
+                ))
+                if len(batch) == self._batch_size:
+                    self._publish_batch(wheel_id=event.wheel_id)
+                self._publish_due_batches()
+                return
+            message = str(event.pin_state)
+            payload = encode_legacy(
+                timestamp_ns=event.timestamp_ns,
+                message=message,
+                wheel_id=event.wheel_id,
+                duration=event.duration,
+                keepalive=event.keepalive,
+            )
+            if not self._publish_message(topic, payload):
+                return
+            msg = f'Published to topic {topic} with message {message}.'
+        elif event.kind == 'aggregate':
+            payload = json.dumps(event.summary, separators=(',', ':'))
+            if not self._publish_message(topic, payload):
+                return
+            # Latency between the end of the window and the publish
+            window_end_ms = event.summary['WindowStart'] + int(event.summary['Window'] * 1000)
+            latency_ms = time.time_ns() // 1_000_000 - window_end_ms
+            msg = f'Published to topic {topic} with summary {payload} ({len(payload)} bytes, {latency_ms} ms after window end).'
+        else:
+            self._publish_message(topic, json.dumps(event.summary, separators=(',', ':')))
+            return
+        log(log_path=self._log_path, logmsg=msg, printout=True)
+
+    def idle(self) -> None:
+        self._publish_due_batches()
+        if self._pending:
+            self._publish_pending()
+        if self._spool is not None and self._spool.depth > 0:
+            self._drain_spool()
+
+    def shutdown(self) -> None:
+        if self._client is not None:
+            self._publish_due_batches(force=True)
+            self._pending_retry_at = 0.0
+            self._publish_pending()
+            if self._pending:
+                with self._condition:
+                    self._dropped += len(self._pending)
+                msg = f'Dropped {len(self._pending)} pending messages on shutdown.'
+                log(log_path=self._log_path, logmsg=msg, printout=True)
+                self._pending.clear()
+            self._client.disconnect()
+            self._client = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
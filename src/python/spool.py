@@ -0,0 +1,150 @@
+"""
+================================================================================
+Description: This script contains the disk-backed spool used to store MQTT
+             messages in the MQTT sink of sinks.py until they are published
+================================================================================
+"""
+import sqlite3
+import threading
+from typing import Callable, List, Tuple, Union
+
+
+class MessageSpool():
+    """Class to persist MQTT messages in an SQLite database until they are published.
+
+    Messages are appended with `put` and published in insertion order with
+    `drain`. A message is only removed from the spool after it was published,
+    so messages survive network outages and restarts of the script.
+
+    Attributes:
+        path: Full path to the SQLite database file.
+        max_messages: Maximum number of spooled messages. If the spool is full,
+            the oldest messages are dropped. Defaults to 500000 messages.
+    """
+
+    def __init__(self, path: str, max_messages: int = 500000) -> None:
+        self.path = path
+        self._max_messages = MessageSpool._validate_max_messages(max_messages=max_messages)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Write-ahead logging keeps appends cheap while the spool is drained
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS spool '
+            '(id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, payload TEXT NOT NULL)'
+        )
+        self._depth = self._connection.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+        self.dropped = 0
+
+    @classmethod
+    def _validate_max_messages(cls, max_messages: int) -> int:
+        """Class method to validate user input.
+
+        Args:
+            max_messages: Maximum number of messages input argument.
+
+        Returns:
+            max_messages if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(max_messages, int)
+            assert max_messages > 0
+
+        except AssertionError:
+            errmsg = f'Maximum number of messages {max_messages} is not supported. Must be a positive integer.'
+            raise ValueError(errmsg) from AssertionError
+
+        return max_messages
+
+    @property
+    def depth(self) -> int:
+        """Number of messages waiting in the spool."""
+        return self._depth
+
+    def put(self, topic: str, payload: Union[str, bytes]) -> None:
+        """Method to append a message to the spool.
+
+        Args:
+            topic: Topic to publish to.
+            payload: Message to publish.
+        """
+        with self._lock:
+            self._connection.execute('INSERT INTO spool (topic, payload) VALUES (?, ?)', (topic, payload))
+            self._depth += 1
+            if self._depth > self._max_messages:
+                excess = self._depth - self._max_messages
+                self._connection.execute(
+                    'DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)', (excess,)
+                )
+                self._depth -= excess
+                self.dropped += excess
+
+    def _peek(self, batch_size: int) -> List[Tuple[int, str, str]]:
+        """Method to read the oldest messages without removing them.
+
+        Args:
+            batch_size: Maximum number of messages to read.
+
+        Returns:
+            List of (id, topic, payload) tuples.
+        """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT id, topic, payload FROM spool ORDER BY id LIMIT ?', (batch_size,)
+            ).fetchall()
+
+    def _remove(self, ids: List[int]) -> None:
+        """Method to remove published messages.
+
+        Args:
+            ids: Ids of the published messages.
+        """
+        with self._lock:
+            # Messages dropped by `put` in the meantime are not counted twice
+            cursor = self._connection.executemany('DELETE FROM spool WHERE id = ?', [(i,) for i in ids])
+            self._depth -= cursor.rowcount
+
+    def drain(self, publish: Callable[[str, str], bool], batch_size: int = 100) -> int:
+        """Method to publish the spooled messages in batches, oldest first.
+
+        Draining stops at the first message which could not be published. That
+        message and all newer ones stay in the spool.
+
+        Args:
+            publish: Function publishing a message, called with topic and payload.
+                Must return True on success. Exceptions count as failure.
+            batch_size: Number of messages read from the spool at once.
+
+        Returns:
+            Number of published messages.
+        """
+        published = 0
+        while True:
+            batch = self._peek(batch_size=batch_size)
+            if not batch:
+                return published
+            done: List[int] = []
+            failed = False
+            for message_id, topic, payload in batch:
+                try:
+                    failed = not publish(topic, payload)
+                except Exception:
+                    failed = True
+                if failed:
+                    break
+                done.append(message_id)
+            if done:
+                self._remove(ids=done)
+                published += len(done)
+            if failed:
+                return published
+
+    def close(self) -> None:
+        """Method to close the database connection.
+        """
+        with self._lock:
+            self._connection.close()
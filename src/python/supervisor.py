@@ -0,0 +1,248 @@
+"""
+================================================================================
+Description: This script contains the supervisor used in hamsterwheel_handler.py
+             to restart the readout script when it crashes or stops beating
+================================================================================
+"""
+from datetime import datetime
+import json
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+from heartbeat import read_heartbeat
+from utils import log
+
+
+class Supervisor():
+    """Class to run a command and restart it when it fails.
+
+    The command must write a heartbeat (see `heartbeat.Heartbeat`) to
+    `heartbeat_path`. The process is restarted if it exits, if it does not
+    beat within `startup_timeout` after the start, or if its last beat is
+    older than `deadline`. A failed process is stopped with SIGINT and killed
+    after `kill_timeout`, so a hung readout is replaced within about a second.
+    Only `stop` gives the process `stop_timeout` to exit, so the readout
+    script can close its sinks and flush its logs.
+
+    Restarts wait for a backoff that doubles after every failure, up to
+    `max_backoff`, and is reset once the process ran healthy for
+    `max_backoff`. Every restart is logged with its reason, and the restart
+    count and the downtime (last beat until the first beat of the new
+    process) are kept in `stats()` and written to `stats_path`.
+
+    Attributes:
+        command: Command to run, e.g. `[sys.executable, 'hamsterwheel.py']`.
+        heartbeat_path: Full path to the heartbeat file of the command.
+        log_path: Full path to the log of the supervisor.
+        stats_path: Optional full path to a JSON file with the restart statistics.
+        deadline: Maximum age of the last beat in seconds. Defaults to 5 seconds.
+        startup_timeout: Maximum time in seconds until the first beat of a new
+            process. Defaults to 30 seconds.
+        min_backoff: Wait time in seconds before the first restart. Defaults to 1 second.
+        max_backoff: Maximum wait time in seconds before a restart. Defaults to 60 seconds.
+        stop_timeout: Time in seconds a stopped process gets to exit before it
+            is killed. Must cover closing the sinks and flushing the logs of the
+            readout script, see SUPERVISOR_STOP_TIMEOUT. Defaults to 95 seconds.
+        kill_timeout: Time in seconds a failed process gets to exit before it
+            is killed and restarted. Defaults to 1 second.
+        check_interval: Time in seconds between two checks. Defaults to 0.1 seconds.
+    """
+
+    def __init__(
+        self,
+        command: List[str],
+        heartbeat_path: str,
+        log_path: str,
+        stats_path: Optional[str] = None,
+        deadline: float = 5.0,
+        startup_timeout: float = 30.0,
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        stop_timeout: float = 95.0,
+        kill_timeout: float = 1.0,
+        check_interval: float = 0.1,
+    ) -> None:
+        self._command = command
+        self._heartbeat_path = heartbeat_path
+        self._log_path = log_path
+        self._stats_path = stats_path
+        self._deadline_ns = int(Supervisor._validate_positive(name='Deadline', value=deadline) * 1e9)
+        self._startup_timeout_ns = int(
+            Supervisor._validate_positive(name='Startup timeout', value=startup_timeout) * 1e9
+        )
+        self._min_backoff = Supervisor._validate_positive(name='Minimum backoff', value=min_backoff)
+        self._max_backoff = Supervisor._validate_positive(name='Maximum backoff', value=max_backoff)
+        self._stop_timeout = Supervisor._validate_positive(name='Stop timeout', value=stop_timeout)
+        self._kill_timeout = Supervisor._validate_positive(name='Kill timeout', value=kill_timeout)
+        self._check_interval = Supervisor._validate_positive(name='Check interval', value=check_interval)
+        self._stopped = threading.Event()
+        self._process: Optional[subprocess.Popen] = None
+        self._started_ns = 0
+        self._first_beat_ns: Optional[int] = None
+        self._last_beat_ns: Optional[int] = None
+        self._down_since_ns: Optional[int] = None
+        self._backoff = self._min_backoff
+        self._restarts = 0
+        self._downtime_ns = 0
+        self._last_downtime_ns = 0
+        self._last_reason: Optional[str] = None
+
+    @classmethod
+    def _validate_positive(cls, name: str, value: float) -> float:
+        """Class method to validate user input.
+
+        Args:
+            name: Name of the input argument used in the error message.
+            value: Input argument.
+
+        Returns:
+            value if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(value, float)
+            assert value > 0.0
+
+        except AssertionError:
+            errmsg = f'{name} {value} is not supported. Must be float and larger than 0.'
+            raise ValueError(errmsg) from AssertionError
+
+        return value
+
+    def stats(self) -> Dict[str, Union[int, float, str, None]]:
+        """Method to get the restart statistics.
+
+        Returns:
+            Dictionary with the number of restarts, the total and the last
+            downtime in seconds, the reason of the last restart and the pid
+            of the running process.
+        """
+        return {
+            'restarts': self._restarts,
+            'downtime_s': round(self._downtime_ns / 1e9, 3),
+            'last_downtime_s': round(self._last_downtime_ns / 1e9, 3),
+            'last_reason': self._last_reason,
+            'pid': self._process.pid if self._process is not None else None,
+        }
+
+    def _write_stats(self) -> None:
+        """Method to atomically write the restart statistics to `stats_path`.
+        """
+        if self._stats_path is None:
+            return
+        tmp_path = f'{self._stats_path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({**self.stats(), 'updated': datetime.now().isoformat()}, file)
+        os.replace(tmp_path, self._stats_path)
+
+    def _start(self) -> None:
+        """Method to start the command.
+        """
+        self._process = subprocess.Popen(self._command)
+        self._started_ns = time.monotonic_ns()
+        self._first_beat_ns = None
+        self._last_beat_ns = None
+        msg = f'Started {" ".join(self._command)} with pid {self._process.pid}'
+        log(log_path=self._log_path, logmsg=msg, printout=True)
+
+    def _stop_process(self, timeout: float) -> None:
+        """Method to stop the process, first with SIGINT and then with SIGKILL.
+
+        Args:
+            timeout: Time in seconds between SIGINT and SIGKILL.
+        """
+        if self._process is None or self._process.poll() is not None:
+            return
+        self._process.send_signal(signal.SIGINT)
+        try:
+            self._process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+    def _check(self) -> Optional[str]:
+        """Method to check if the process is healthy.
+
+        Returns:
+            Reason why the process is not healthy, or None if it is.
+        """
+        now_ns = time.monotonic_ns()
+        returncode = self._process.poll()
+        if returncode is not None:
+            return f'exited with code {returncode}'
+
+        heartbeat = read_heartbeat(path=self._heartbeat_path)
+        if heartbeat is not None and heartbeat[1] == self._process.pid and heartbeat[0] >= self._started_ns:
+            if self._first_beat_ns is None:
+                self._first_beat_ns = heartbeat[0]
+                self._recovered(beat_ns=heartbeat[0])
+            self._last_beat_ns = heartbeat[0]
+
+        if self._last_beat_ns is None:
+            if now_ns - self._started_ns > self._startup_timeout_ns:
+                return f'no heartbeat within {self._startup_timeout_ns / 1e9:.1f} s after the start'
+            return None
+        if now_ns - self._last_beat_ns > self._deadline_ns:
+            return f'no heartbeat for {(now_ns - self._last_beat_ns) / 1e9:.1f} s'
+        return None
+
+    def _recovered(self, beat_ns: int) -> None:
+        """Method to record the downtime once a restarted process beats.
+
+        Args:
+            beat_ns: Monotonic timestamp of the first beat in nanoseconds.
+        """
+        if self._down_since_ns is None:
+            return
+        self._last_downtime_ns = beat_ns - self._down_since_ns
+        self._downtime_ns += self._last_downtime_ns
+        self._down_since_ns = None
+        msg = f'Recovered after {self._last_downtime_ns / 1e9:.3f} s, {self._restarts} restarts in total'
+        log(log_path=self._log_path, logmsg=msg, printout=True)
+        self._write_stats()
+
+    def _failed(self, reason: str) -> None:
+        """Method to stop a failed process and wait for the backoff.
+
+        Args:
+            reason: Reason of the failure.
+        """
+        now_ns = time.monotonic_ns()
+        if self._down_since_ns is None:
+            self._down_since_ns = self._last_beat_ns if self._last_beat_ns is not None else now_ns
+        if self._first_beat_ns is not None and now_ns - self._first_beat_ns > self._max_backoff * 1e9:
+            self._backoff = self._min_backoff
+        self._stop_process(timeout=self._kill_timeout)
+        self._restarts += 1
+        self._last_reason = reason
+        msg = f'Process {self._process.pid} {reason}, restarting in {self._backoff:.1f} s'
+        log(log_path=self._log_path, logmsg=msg, printout=True)
+        self._write_stats()
+        self._stopped.wait(self._backoff)
+        self._backoff = min(self._backoff * 2, self._max_backoff)
+
+    def run(self) -> None:
+        """Method to run and watch the command until `stop` is called.
+        """
+        self._start()
+        try:
+            while not self._stopped.wait(self._check_interval):
+                reason = self._check()
+                if reason is None:
+                    continue
+                self._failed(reason=reason)
+                if not self._stopped.is_set():
+                    self._start()
+        finally:
+            self._stop_process(timeout=self._stop_timeout)
+
+    def stop(self) -> None:
+        """Method to make a running `run` stop the process and return.
+        """
+        self._stopped.set()
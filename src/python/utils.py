@@ -4,23 +4,328 @@ Author:      Heiko Kromer - 2022
 Description: This script contains utility functions used in hamsterwheel.py
 ================================================================================
 """
-from typing import Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 from datetime import datetime
+import atexit
 import logging
+import queue
+import threading
+import time
 import sys
 import os
 
-import boto3
+from instrumentation import REGISTRY
+from log_rotation import LogRotator, first_timestamp
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+_LOG_WRITE_SECONDS = REGISTRY.histogram(
+    name='hamsterwheel_log_write_seconds',
+    documentation='Time to write log messages to the log file, per write.',
+)
+_LOG_QUEUE_DELAY_SECONDS = REGISTRY.histogram(
+    name='hamsterwheel_log_queue_delay_seconds',
+    documentation='Time the oldest message of a batch waited for the buffered log writer.',
+)
+_LOG_DROPPED = REGISTRY.counter(
+    name='hamsterwheel_log_dropped_total',
+    documentation='Number of log messages dropped by the buffered log writer, on a full queue or a failed write.',
+)
+
+
+class BufferedLogWriter():
+    """Class to append log messages to a file from a background thread.
+
+    `write` only puts the message on a queue. A background thread formats the
+    messages, keeps the log file open and writes them in batches, so the file
+    system sees one write per batch instead of one open/write/close per message.
+
+    If `rotation` is set, the log is closed as a segment before the batch
+    that follows once it is due, see `log_rotation.py`.
+
+    The queue holds at most `max_queue` messages; `write` drops messages
+    beyond it instead of blocking the caller. A batch which cannot be written,
+    e.g. on a full SD card, is dropped and reported, and the thread carries on
+    with the next one. Both are counted in `dropped`.
+
+    Attributes:
+        log_path: Full path to the filename with the log.
+        flush_lines: Number of queued messages that triggers a flush.
+            Defaults to 256.
+        flush_interval: Maximum time in seconds a message stays queued before
+            it is flushed. Defaults to 5 seconds.
+        fsync: Controls when the written data is synced to the storage.
+            'never' leaves it to the OS, 'always' syncs after every flush and
+            'periodic' syncs at most once per `fsync_interval`. Defaults to 'never'.
+        fsync_interval: Minimum time in seconds between two syncs in 'periodic'
+            fsync mode. Defaults to 60 seconds.
+        rotation: Rotation of the log file. Defaults to None, which lets the log grow.
+        max_queue: Maximum number of queued messages. Defaults to 100000.
+    """
+    supported_fsync = ['never', 'always', 'periodic']
+
+    def __init__(
+        self,
+        log_path: str,
+        flush_lines: int = 256,
+        flush_interval: float = 5.0,
+        fsync: str = 'never',
+        fsync_interval: float = 60.0,
+        rotation: Optional[LogRotator] = None,
+        max_queue: int = 100000,
+    ) -> None:
+        self.log_path = log_path
+        self._flush_lines = BufferedLogWriter._validate_flush_lines(flush_lines=flush_lines)
+        self._flush_interval = flush_interval
+        self._fsync = BufferedLogWriter._validate_fsync(fsync=fsync)
+        self._fsync_interval = fsync_interval
+        self._last_fsync = time.monotonic()
+        self._queue: queue.Queue = queue.Queue(maxsize=BufferedLogWriter._validate_max_queue(max_queue=max_queue))
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._write_errors = 0
+        self._rotation = rotation
+        self._file = open(log_path, 'a')
+        # Size and time range of the log, to decide when to rotate it
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._first = first_timestamp(path=log_path)
+        self._last = os.path.getmtime(log_path) if self._first is not None else None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def _validate_flush_lines(cls, flush_lines: int) -> int:
+        """Class method to validate user input.
+
+        Args:
+            flush_lines: Flush lines input argument.
+
+        Returns:
+            flush_lines if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(flush_lines, int)
+            assert flush_lines > 0
+
+        except AssertionError:
+            errmsg = f'Flush lines {flush_lines} is not supported. Must be a positive integer.'
+            raise ValueError(errmsg) from AssertionError
+
+        return flush_lines
+
+    @classmethod
+    def _validate_max_queue(cls, max_queue: int) -> int:
+        """Class method to validate user input.
+
+        Args:
+            max_queue: Maximum queue size input argument.
+
+        Returns:
+            max_queue if it is valid.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert isinstance(max_queue, int)
+            assert max_queue > 0
+
+        except AssertionError:
+            errmsg = f'Maximum queue size {max_queue} is not supported. Must be a positive integer.'
+            raise ValueError(errmsg) from AssertionError
+
+        return max_queue
+
+    @classmethod
+    def _validate_fsync(cls, fsync: str) -> str:
+        """Class method to validate user input.
+
+        Args:
+            fsync: Fsync policy input argument.
+
+        Returns:
+            fsync if it is a part of the supported fsync policies.
+
+        Raises:
+            ValueError if the user input is not supported.
+        """
+        try:
+            assert fsync in BufferedLogWriter.supported_fsync
+
+        except AssertionError:
+            errmsg = f'Fsync policy {fsync} is not among the supported policies {BufferedLogWriter.supported_fsync}.'
+            raise ValueError(errmsg) from AssertionError
+
+        return fsync
+
+    @property
+    def dropped(self) -> int:
+        """Number of messages dropped on a full queue or a failed write."""
+        return self._dropped
+
+    @property
+    def write_errors(self) -> int:
+        """Number of batches which could not be written."""
+        return self._write_errors
+
+    def write(self, logmsg: str, printout: bool = False) -> None:
+        """Method to queue a message for the log file.
+
+        Args:
+            logmsg: Message to be appended to the log file.
+            printout: If True, `logmsg` is also printed out. Defaults to False.
+        """
+        try:
+            self._queue.put_nowait((time.time(), logmsg, printout))
+        except queue.Full:
+            self._drop(count=1)
+
+    def _drop(self, count: int) -> None:
+        """Method to count dropped messages.
+
+        Args:
+            count: Number of dropped messages.
+        """
+        with self._dropped_lock:
+            self._dropped += count
+        _LOG_DROPPED.inc(count)
+
+    def close(self) -> None:
+        """Method to flush all queued messages and close the log file.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._file.close()
+        if self._rotation is not None:
+            self._rotation.wait()
+
+    def _run(self) -> None:
+        """Method run in the background thread to collect and flush batches of messages.
+        """
+        closing = False
+        while not closing:
+            batch: List[Tuple[float, str, bool]] = []
+            deadline = None
+            while len(batch) < self._flush_lines:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self._flush_interval
+                batch.append(item)
+            if batch:
+                try:
+                    self._flush(batch=batch)
+                except (OSError, ValueError) as exc:
+                    self._write_errors += 1
+                    self._drop(count=len(batch))
+                    logger.error(f'Could not write {len(batch)} messages to {self.log_path}, dropped {self._dropped} so far: {exc!r}')
+                    self._reopen()
+
+    def _reopen(self) -> None:
+        """Method to reopen the log file if a failed write or rotation left it closed.
+        """
+        if not self._file.closed:
+            return
+        try:
+            self._file = open(self.log_path, 'a')
+            self._size = os.fstat(self._file.fileno()).st_size
+        except OSError as exc:
+            logger.error(f'Could not reopen {self.log_path}: {exc!r}')
+
+    def _flush(self, batch: List[Tuple[float, str, bool]]) -> None:
+        """Method to write a batch of messages to the log file.
+
+        Args:
+            batch: List of (timestamp, logmsg, printout) tuples.
+        """
+        start = time.perf_counter()
+        _LOG_QUEUE_DELAY_SECONDS.observe(max(0.0, time.time() - batch[0][0]))
+        if self._rotation is not None and self._rotation.due(size=self._size, first=self._first, now=batch[0][0]):
+            self._rotate()
+        lines = []
+        for timestamp, logmsg, printout in batch:
+            # Add the timestamp of the `write` call to the log
+            logmsg = f'{datetime.fromtimestamp(timestamp)} - {logmsg}'
+            if printout:
+                logger.info(f"## Added log message: {logmsg}.")
+            lines.append('\n')
+            lines.append(logmsg)
+        self._file.write(''.join(lines))
+        self._file.flush()
+        self._size = os.fstat(self._file.fileno()).st_size
+        if self._first is None:
+            self._first = batch[0][0]
+        self._last = batch[-1][0]
+
+        now = time.monotonic()
+        if self._fsync == 'always' or (self._fsync == 'periodic' and now - self._last_fsync >= self._fsync_interval):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+        _LOG_WRITE_SECONDS.observe(time.perf_counter() - start, labels={'writer': 'buffered'})
+
+    def _rotate(self) -> None:
+        """Method to close the log file as a segment and start a new one.
+        """
+        self._file.close()
+        self._rotation.rotate(first=self._first, last=self._last)
+        self._file = open(self.log_path, 'a')
+        self._size = 0
+        self._first = None
+        self._last = None
+        self._last_fsync = time.monotonic()
+
+
+# Buffered writers registered per log file, used by `log` if present
+_log_writers: Dict[str, BufferedLogWriter] = {}
+
+
+def open_log_writer(log_path: str, **kwargs) -> BufferedLogWriter:
+    """Function to register a buffered writer for a logfile.
+
+    Subsequent calls of `log` with the same `log_path` only queue the message.
+
+    Args:
+        log_path: Full path to the filename with the log.
+        kwargs: Keyword arguments passed to `BufferedLogWriter`.
+
+    Returns:
+        The buffered writer registered for `log_path`.
+    """
+    if log_path not in _log_writers:
+        _log_writers[log_path] = BufferedLogWriter(log_path=log_path, **kwargs)
+    return _log_writers[log_path]
+
+
+def close_log_writers() -> None:
+    """Function to flush and close all registered buffered writers.
+    """
+    while _log_writers:
+        _, writer = _log_writers.popitem()
+        writer.close()
+
+
+atexit.register(close_log_writers)
+
 
 def log(log_path: str, logmsg: str, printout: bool = False) -> None:
     """Function to add a line to a logfile.
 
+    If a buffered writer is registered for `log_path` with `open_log_writer`,
+    the message is only queued and written in the background.
+
     Args:
         log_path: Full path to the filename with the log.
         logmsg: Message to be appended to the log file.
@@ -29,6 +334,12 @@ def log(log_path: str, logmsg: str, printout: bool = False) -> None:
     Returns:
         None.
     """
+    writer = _log_writers.get(log_path)
+    if writer is not None:
+        writer.write(logmsg=logmsg, printout=printout)
+        return
+
+    start = time.perf_counter()
     # Add the current timestamp to the log
     logmsg = f'{datetime.now()} - {logmsg}'
 
@@ -39,26 +350,4 @@ def log(log_path: str, logmsg: str, printout: bool = False) -> None:
         file.write('\n')
         file.write(logmsg)
         file.close()
-
-
-
-
-s3 = boto3.resource('s3')
-
-def download_s3_folder(bucket_name: str, s3_folder: str, local_dir: str =None):
-    """
-    Download the contents of a folder directory
-    Args:
-        bucket_name: the name of the s3 bucket
-        s3_folder: the folder path in the s3 bucket
-        local_dir: a relative or absolute directory path in the local file system
-    """
-    bucket = s3.Bucket(bucket_name)
-    for obj in bucket.objects.filter(Prefix=s3_folder):
-        target = obj.key if local_dir is None \
-            else os.path.join(local_dir, os.path.relpath(obj.key, s3_folder))
-        if not os.path.exists(os.path.dirname(target)):
-            os.makedirs(os.path.dirname(target))
-        if obj.key[-1] == '/':
-            continue
-        bucket.download_file(obj.key, target)
+    _LOG_WRITE_SECONDS.observe(time.perf_counter() - start, labels={'writer': 'direct'})
@@ -0,0 +1,15 @@
+"""
+================================================================================
+Description: This script makes the flat modules in src/python and analysis
+             importable from the tests, as the scripts are run from their folder
+
+             python -m pytest tests
+================================================================================
+"""
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for folder in [os.path.join(ROOT, 'src', 'python'), os.path.join(ROOT, 'analysis')]:
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
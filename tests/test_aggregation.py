@@ -0,0 +1,29 @@
+from aggregation import WindowAggregator
+
+T0 = 1_614_578_400 * 1_000_000_000
+S = 1_000_000_000
+
+
+def test_windows_count_rotations_and_report_empty_windows():
+    aggregator = WindowAggregator(window=10.0)
+    summaries = []
+    # Closed for 1 s every 2 s during the first window
+    for i in range(5):
+        summaries += aggregator.add(timestamp_ns=T0 + 2 * i * S, pin_state=0)
+        summaries += aggregator.add(timestamp_ns=T0 + (2 * i + 1) * S, pin_state=1)
+    summaries += aggregator.flush(timestamp_ns=T0 + 30 * S)
+
+    first, empty = summaries[0], summaries[1]
+    assert first['WindowStart'] == T0 // 1_000_000 and first['Window'] == 10.0
+    assert first['Rotations'] == 5 and first['ClosedTime'] == 5.0
+    assert first['MaxRpm'] == 30.0 and first['Samples'] == 10
+    assert len(summaries) == 3 and empty['Rotations'] == 0 and empty['Samples'] == 0
+
+
+def test_restarts_after_a_clock_jump():
+    aggregator = WindowAggregator(window=1.0)
+    aggregator.add(timestamp_ns=T0, pin_state=0)
+    jump_ns = T0 + (WindowAggregator.max_gap_windows + 5) * S
+
+    assert aggregator.flush(timestamp_ns=jump_ns) == []
+    assert aggregator.window_end_ns() == jump_ns + S
@@ -0,0 +1,55 @@
+import numpy as np
+
+import decode
+import payload
+from payload import Reading
+
+
+def _v1(timestamp: str, message: str, wheel_id: str = None) -> bytes:
+    extra = '' if wheel_id is None else f', "WheelId":"{wheel_id}"'
+    return ('{"Timestamp" :"' + timestamp + '", "Message":"' + message + '"' + extra + '}').encode()
+
+
+def test_decode_payloads_mixed_versions():
+    payloads = [
+        _v1('2021-03-01 06:00:00', '1'),
+        payload.encode_binary(device_id='dev', seq=0, readings=[Reading(1_614_578_401_000, 0, False)]),
+        payload.encode_json(device_id='dev', seq=1, readings=[Reading(1_614_578_402_000, 1, False)]).encode(),
+        b'{"v":2,"dev":"dev","ts":1614578403000,"username":"u","ip":"192.0.2.1"}',
+        b'',
+    ]
+    timestamps_ns, states = decode.decode_payloads(payloads=payloads)
+
+    assert timestamps_ns.dtype == np.int64 and states.dtype == np.uint8
+    assert timestamps_ns.tolist() == [1_614_578_400_000_000_000, 1_614_578_401_000_000_000, 1_614_578_402_000_000_000]
+    assert states.tolist() == [1, 0, 1]
+
+
+def test_decode_payloads_filters_wheels_of_all_versions():
+    payloads = [
+        _v1('2021-03-01 06:00:00', '1', wheel_id='cage0'),
+        _v1('2021-03-01 06:00:01', '0', wheel_id='cage1'),
+        _v1('2021-03-01 06:00:02', '1'),
+        payload.encode_binary(device_id='dev', seq=0, readings=[Reading(1_614_578_403_000, 1, False)], wheel_id='cage1'),
+        payload.encode_binary(device_id='dev', seq=1, readings=[Reading(1_614_578_404_000, 0, False)], wheel_id='cage0'),
+    ]
+    timestamps_ns, states = decode.decode_payloads(payloads=payloads, wheel_id='cage1')
+
+    assert timestamps_ns.tolist() == [1_614_578_401_000_000_000, 1_614_578_403_000_000_000]
+    assert states.tolist() == [0, 1]
+    assert len(decode.decode_payloads(payloads=payloads)[0]) == 5
+
+
+def test_repair_12_hour_clock():
+    # 11:59 AM, noon, 1 PM and 11 PM, then 00:30 AM, 1 AM, 11 AM and 12:59 PM of the next day
+    clock_12 = ['2021-03-01 11:59:00', '2021-03-01 12:00:00', '2021-03-01 01:00:00', '2021-03-01 11:00:00',
+                '2021-03-02 12:30:00', '2021-03-02 01:00:00', '2021-03-02 11:00:00', '2021-03-02 12:59:00']
+    payloads = [_v1(timestamp, str(i % 2)) for i, timestamp in enumerate(clock_12)]
+    timestamps_ns, _ = decode.decode_payloads(payloads=payloads, repair_12_hour=True)
+
+    expected = ['2021-03-01T11:59:00', '2021-03-01T12:00:00', '2021-03-01T13:00:00', '2021-03-01T23:00:00',
+                '2021-03-02T00:30:00', '2021-03-02T01:00:00', '2021-03-02T11:00:00', '2021-03-02T12:59:00']
+    assert timestamps_ns.astype('datetime64[ns]').astype(str).tolist() == [e + '.000000000' for e in expected]
+    # A 24-hour clock is kept
+    clock_24 = np.array(['2021-03-01 13:00:00', '2021-03-01 01:00:00'], dtype='datetime64[ns]').astype(np.int64)
+    assert decode.repair_12_hour_clock(timestamps_ns=clock_24).tolist() == clock_24.tolist()
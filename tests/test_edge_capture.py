@@ -0,0 +1,56 @@
+import time
+
+from edge_capture import EdgeCapture, EdgeRingBuffer
+from gpio_backend import ReplayGpioBackend, SimulatedGpioBackend
+
+PIN = 18
+MS = 1_000_000
+
+
+def _capture(io, debouncetime: float) -> EdgeCapture:
+    io.setmode(io.BCM)
+    io.setup(PIN, io.IN, pull_up_down=io.PUD_UP)
+    capture = EdgeCapture(io=io, pins=[PIN], debouncetime=debouncetime)
+    capture.start()
+    return capture
+
+
+def test_ring_buffer_overwrites_oldest():
+    buffer = EdgeRingBuffer(capacity=2)
+    for i in range(3):
+        buffer.push(timestamp_ns=i, pin_state=i % 2, pin=PIN)
+
+    assert buffer.drain() == [(1, PIN, 1), (2, PIN, 0)]
+    assert buffer.dropped == 1 and len(buffer) == 0
+
+
+def test_bounces_are_suppressed_and_settled_state_is_reread():
+    trace = [
+        (0, 1),
+        # Closure with two bounces which settles closed
+        (100 * MS, 0), (110 * MS, 1), (120 * MS, 0),
+        # Opening followed by a closure within the debounce time
+        (400 * MS, 1), (420 * MS, 0),
+    ]
+    io = ReplayGpioBackend(trace=trace)
+    capture = _capture(io=io, debouncetime=0.1)
+    time.sleep(0.7)
+    capture.stop()
+
+    edges = capture.drain()
+    assert [state for _, _, state in edges] == [1, 0, 1, 0]
+    # The re-read closure is timestamped at its suppressed edge
+    offsets_ms = [(timestamp_ns - edges[0][0]) / MS for timestamp_ns, _, _ in edges]
+    assert abs(offsets_ms[3] - 420) < 50
+    assert capture.buffer.dropped == 0
+
+
+def test_simulated_wheel_alternates():
+    io = SimulatedGpioBackend(rpm=300.0, closed_fraction=0.5)
+    capture = _capture(io=io, debouncetime=0.005)
+    time.sleep(0.5)
+    capture.stop()
+
+    states = [state for _, _, state in capture.drain()]
+    assert len(states) >= 4
+    assert all(a != b for a, b in zip(states, states[1:]))
@@ -0,0 +1,38 @@
+from history import NS_PER_MINUTE, RecentHistory
+from sinks import Event
+
+T0 = 1_614_578_400 * 1_000_000_000
+
+
+def _reading(timestamp_ns: int, pin_state: int, wheel_id: str = None, edge: bool = True) -> Event:
+    return Event(kind='reading', timestamp_ns=timestamp_ns, pin_state=pin_state, edge=edge, wheel_id=wheel_id)
+
+
+def test_events_are_kept_sorted_in_a_bounded_ring():
+    history = RecentHistory(max_events=3)
+    for offset in [0, 2, 1, 3]:
+        history.add(event=_reading(timestamp_ns=T0 + offset, pin_state=offset % 2))
+    # Older than all kept events of the full ring
+    history.add(event=_reading(timestamp_ns=T0 - 1, pin_state=0))
+
+    assert [event.timestamp_ns - T0 for event in history.events()] == [1, 2, 3]
+    assert history.reordered == 2
+    assert [event.timestamp_ns - T0 for event in history.events(start_ns=T0 + 2)] == [2, 3]
+    assert [event.timestamp_ns - T0 for event in history.events(limit=1)] == [3]
+
+
+def test_minutes_and_summary_per_wheel():
+    history = RecentHistory()
+    for i in range(4):
+        history.add(event=_reading(timestamp_ns=T0 + i * 10_000_000_000, pin_state=i % 2, wheel_id='a'))
+    history.add(event=_reading(timestamp_ns=T0 + NS_PER_MINUTE, pin_state=0, wheel_id='b'))
+    history.add(event=Event(kind='metrics', timestamp_ns=T0 + NS_PER_MINUTE, summary={'Type': 'session'}))
+
+    minutes = history.minutes(wheel_id='a')
+    assert len(minutes) == 1
+    assert minutes[0]['Readings'] == 4 and minutes[0]['Rotations'] == 2
+    summary = history.summary()
+    assert summary['Wheels']['a']['Rotations'] == 2 and summary['Wheels']['b']['Rotations'] == 1
+    assert summary['Wheels']['b']['LastPinState'] == 0
+    assert summary['Events'] == 6
+    assert history.events(kind='metrics')[0].summary == {'Type': 'session'}
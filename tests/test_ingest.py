@@ -0,0 +1,100 @@
+from datetime import datetime
+import json
+import os
+
+import numpy as np
+
+from ingest import ColumnarCache
+from log_rotation import LogRotator
+
+
+def _message(path, timestamp: str, message: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump({'Timestamp': timestamp, 'Message': message}, file)
+
+
+def test_update_is_incremental_and_recursive(tmp_path):
+    message_dir = str(tmp_path / 'messages')
+    for i in range(7):
+        _message(os.path.join(message_dir, str(i % 2), f'{i:03d}'), f'2021-03-01 06:00:{i:02d}', str(i % 2))
+    cache = ColumnarCache(cache_dir=str(tmp_path / 'cache'), chunk_files=3)
+
+    assert cache.update(message_dir=message_dir) == 7
+    assert cache.update(message_dir=message_dir) == 0
+    _message(os.path.join(message_dir, 'new', '007'), '2021-03-01 06:00:07', '1')
+    assert ColumnarCache(cache_dir=str(tmp_path / 'cache')).update(message_dir=message_dir) == 1
+
+    timestamps_ns, states = cache.load()
+    assert np.all(np.diff(timestamps_ns) > 0)
+    assert states.tolist() == [0, 1, 0, 1, 0, 1, 0, 1]
+
+
+def test_legacy_manifest_is_migrated(tmp_path):
+    message_dir = str(tmp_path / 'messages')
+    _message(os.path.join(message_dir, 'a'), '2021-03-01 06:00:00', '1')
+    _message(os.path.join(message_dir, 'b'), '2021-03-01 06:00:01', '0')
+    os.makedirs(tmp_path / 'cache')
+    with open(tmp_path / 'cache' / ColumnarCache.legacy_manifest_name, 'w') as file:
+        json.dump(['a'], file)
+
+    assert ColumnarCache(cache_dir=str(tmp_path / 'cache')).update(message_dir=message_dir) == 1
+
+
+def _log(path: str, start: float, count: int) -> float:
+    with open(path, 'a') as file:
+        for i in range(count):
+            file.write(f'\n{datetime.fromtimestamp(start + i)} - pin_state = {i % 2}')
+    return start + count - 1
+
+
+def test_backfill_resumes_rotated_segment(tmp_path):
+    log_path = str(tmp_path / 'hw.log')
+    rotator = LogRotator(log_path=log_path, compression='gzip')
+    cache = ColumnarCache(cache_dir=str(tmp_path / 'cache'))
+
+    _log(log_path, start=1_614_578_400.0, count=10)
+    assert cache.backfill(log_path=log_path) == 10
+    # More lines, then two rotations before the next backfill
+    last = _log(log_path, start=1_614_578_410.0, count=5)
+    rotator.rotate(first=1_614_578_400.0, last=last)
+    last = _log(log_path, start=1_614_578_500.0, count=4)
+    rotator.rotate(first=1_614_578_500.0, last=last)
+    _log(log_path, start=1_614_578_600.0, count=3)
+    rotator.wait()
+
+    assert cache.backfill(log_path=log_path) == 5 + 4 + 3
+    assert cache.backfill(log_path=log_path) == 0
+    timestamps_ns, _ = cache.load()
+    assert len(np.unique(timestamps_ns)) == len(timestamps_ns) == 22
+
+
+def test_backfill_live_leaves_last_line(tmp_path):
+    log_path = str(tmp_path / 'hw.log')
+    cache = ColumnarCache(cache_dir=str(tmp_path / 'cache'))
+    _log(log_path, start=1_614_578_400.0, count=4)
+
+    assert cache.backfill(log_path=log_path, live=True) == 3
+    assert cache.backfill(log_path=log_path) == 1
+
+
+def test_backfill_detects_rotation_with_reused_inode(tmp_path):
+    log_path = str(tmp_path / 'hw.log')
+    rotator = LogRotator(log_path=log_path, compression=None)
+    cache = ColumnarCache(cache_dir=str(tmp_path / 'cache'))
+    _log(log_path, start=1_614_578_400.0, count=3)
+    assert cache.backfill(log_path=log_path) == 3
+
+    last = _log(log_path, start=1_614_578_403.0, count=2)
+    rotator.rotate(first=1_614_578_400.0, last=last)
+    # A new log at least as long as the offset, which got the inode of the old one
+    _log(log_path, start=1_614_578_500.0, count=6)
+    state_path = tmp_path / 'cache' / ColumnarCache.backfill_name
+    with open(state_path) as file:
+        state = json.load(file)
+    for value in state.values():
+        value['inode'] = os.stat(log_path).st_ino
+    with open(state_path, 'w') as file:
+        json.dump(state, file)
+
+    assert ColumnarCache(cache_dir=str(tmp_path / 'cache')).backfill(log_path=log_path) == 2 + 6
@@ -0,0 +1,101 @@
+from datetime import datetime
+import gzip
+import os
+
+from log_rotation import LogRotator, open_segment
+from utils import BufferedLogWriter
+
+
+def _write(path: str, timestamps) -> None:
+    with open(path, 'a') as file:
+        for timestamp in timestamps:
+            file.write(f'\n{datetime.fromtimestamp(timestamp)} - pin_state = 0')
+
+
+def test_due():
+    rotator = LogRotator(log_path='unused.log', max_bytes=100, max_age=60.0)
+
+    assert not rotator.due(size=0, first=None, now=1000.0)
+    assert rotator.due(size=100, first=1000.0, now=1000.0)
+    assert rotator.due(size=10, first=1000.0, now=1060.0)
+    assert not rotator.due(size=10, first=1000.0, now=1030.0)
+
+
+def test_rotate_compress_and_index(tmp_path):
+    log_path = str(tmp_path / 'hw.log')
+    rotator = LogRotator(log_path=log_path, compression='gzip')
+    _write(log_path, [1_614_578_400.0, 1_614_578_401.0])
+    rotator.rotate(first=1_614_578_400.0, last=1_614_578_401.0)
+    rotator.wait()
+
+    segments = rotator.segments()
+    assert len(segments) == 1 and segments[0].endswith('.gz')
+    assert not os.path.exists(log_path)
+    with open_segment(segments[0]) as file:
+        assert file.read().count(b'pin_state') == 2
+    # The index is kept across restarts
+    assert LogRotator(log_path=log_path).segments() == segments
+
+
+def test_segments_in_window(tmp_path):
+    log_path = str(tmp_path / 'hw.log')
+    rotator = LogRotator(log_path=log_path, compression=None)
+    for first in [1_614_578_400.0, 1_614_582_000.0, 1_614_585_600.0]:
+        _write(log_path, [first, first + 10])
+        rotator.rotate(first=first, last=first + 10)
+    _write(log_path, [1_614_589_200.0])
+
+    window = rotator.segments(start=datetime.fromtimestamp(1_614_582_005.0), end=datetime.fromtimestamp(1_614_582_100.0))
+    assert len(window) == 2
+    assert window[-1] == log_path
+
+
+def test_expire(tmp_path):
+    log_path = str(tmp_path / 'hw.log')
+    rotator = LogRotator(log_path=log_path, compression=None, keep_segments=2)
+    for first in [1_614_578_400.0, 1_614_582_000.0, 1_614_585_600.0]:
+        _write(log_path, [first])
+        rotator.rotate(first=first, last=first)
+
+    segments = rotator.segments()
+    assert len(segments) == 2
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(s) for s in segments] + ['hw.log.index.json'])
+
+
+def test_uncompressed_segments_are_recovered(tmp_path):
+    log_path = str(tmp_path / 'hw.log')
+    _write(log_path, [1_614_578_400.0])
+    LogRotator(log_path=log_path, compression=None).rotate(first=1_614_578_400.0, last=1_614_578_400.0)
+
+    rotator = LogRotator(log_path=log_path, compression='gzip')
+    rotator.wait()
+    segment = rotator.segments()[0]
+    assert segment.endswith('.gz')
+    with gzip.open(segment) as file:
+        assert b'pin_state' in file.read()
+
+
+def test_buffered_writer_rotates(tmp_path):
+    log_path = str(tmp_path / 'hw.log')
+    rotator = LogRotator(log_path=log_path, max_bytes=200, compression=None)
+    writer = BufferedLogWriter(log_path=log_path, flush_lines=1, flush_interval=0.01, rotation=rotator)
+    for i in range(20):
+        writer.write(logmsg=f'pin_state = {i % 2}')
+    writer.close()
+
+    lines = b''.join(open_segment(path).read() for path in rotator.segments())
+    assert len(rotator.segments()) > 2
+    assert lines.count(b'pin_state') == 20
+
+
+def test_buffered_writer_drops_beyond_queue(tmp_path):
+    log_path = str(tmp_path / 'hw.log')
+    writer = BufferedLogWriter(log_path=log_path, flush_lines=1000, flush_interval=60.0, max_queue=10)
+    for i in range(15):
+        writer.write(logmsg=f'message {i}')
+    dropped = writer.dropped
+    writer.close()
+
+    assert dropped >= 5
+    with open(log_path) as file:
+        assert file.read().count('message') == 15 - dropped
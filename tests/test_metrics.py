@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from metrics import WheelMetrics
+
+
+def _ns(*args) -> int:
+    return int(datetime(*args).timestamp() * 1e9)
+
+
+def _run(metrics: WheelMetrics, closures_ns):
+    summaries = []
+    for closure_ns in closures_ns:
+        summaries += metrics.update(timestamp_ns=closure_ns - 500_000_000, pin_state=1)
+        summaries += metrics.update(timestamp_ns=closure_ns, pin_state=0)
+    return summaries
+
+
+def test_initial_closed_state_is_not_a_rotation():
+    metrics = WheelMetrics(circumference=0.5)
+    metrics.update(timestamp_ns=_ns(2021, 3, 1, 12, 0, 0), pin_state=0)
+
+    assert metrics.rotations == 0
+    metrics.update(timestamp_ns=_ns(2021, 3, 1, 12, 0, 1), pin_state=1)
+    metrics.update(timestamp_ns=_ns(2021, 3, 1, 12, 0, 2), pin_state=0)
+    assert metrics.rotations == 1 and metrics.distance == 0.5
+
+
+def test_session_over_midnight_splits_active_time():
+    metrics = WheelMetrics(circumference=0.5, idle_timeout=30.0)
+    # One rotation per second from 23:59:50 until 00:00:10
+    closures_ns = [_ns(2021, 3, 1, 23, 59, 50) + i * 1_000_000_000 for i in range(21)]
+    summaries = _run(metrics=metrics, closures_ns=closures_ns)
+    summaries += metrics.tick(timestamp_ns=_ns(2021, 3, 2, 0, 1, 0))
+
+    day, session = summaries
+    assert day['Type'] == 'daily' and day['Day'] == '2021-03-01'
+    assert day['Rotations'] == 10 and day['ActiveTime'] == 9.0 and day['Sessions'] == 1
+    assert session['Type'] == 'session'
+    assert session['Rotations'] == 21 and session['Duration'] == 20.0 and session['MaxRpm'] == 60.0
+
+    summaries = metrics.tick(timestamp_ns=_ns(2021, 3, 3, 0, 0, 1))
+    assert summaries[0]['Day'] == '2021-03-02'
+    assert summaries[0]['Rotations'] == 11 and summaries[0]['ActiveTime'] == 11.0
@@ -0,0 +1,55 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+import decode
+import payload
+from payload import Reading
+
+
+READINGS = [
+    Reading(timestamp_ms=1_614_578_400_000, pin_state=0, keepalive=False, edge=True, duration=1.25),
+    Reading(timestamp_ms=1_614_578_400_500, pin_state=1, keepalive=False, edge=True, duration=0.5),
+    Reading(timestamp_ms=1_614_578_460_500, pin_state=1, keepalive=True, edge=False, duration=None),
+]
+
+
+@pytest.mark.parametrize('wheel_id', [None, 'cage1'])
+def test_binary_round_trip(wheel_id):
+    encoded = payload.encode_binary(device_id='dev', seq=7, readings=READINGS, wheel_id=wheel_id, boot_id=42)
+    batch = decode.decode_binary(payload=encoded)
+
+    assert (batch.device_id, batch.wheel_id, batch.boot_id, batch.seq) == ('dev', wheel_id, 42, 7)
+    assert batch.timestamps_ns.tolist() == [r.timestamp_ms * 1_000_000 for r in READINGS]
+    assert batch.states.tolist() == [0, 1, 1]
+    assert batch.keepalive.tolist() == [False, False, True]
+    assert batch.edge.tolist() == [True, True, False]
+    np.testing.assert_allclose(batch.durations, [1.25, 0.5, np.nan])
+
+
+def test_json_round_trip():
+    encoded = payload.encode_json(device_id='dev', seq=3, readings=READINGS, wheel_id='cage1', boot_id=42)
+    batch = decode.decode_json(payload=encoded.encode())
+
+    assert json.loads(encoded)['v'] == payload.SCHEMA_VERSION
+    assert (batch.wheel_id, batch.boot_id, batch.seq) == ('cage1', 42, 3)
+    assert batch.timestamps_ns.tolist() == [r.timestamp_ms * 1_000_000 for r in READINGS]
+    assert batch.edge.tolist() == [True, True, False]
+    np.testing.assert_allclose(batch.durations, [1.25, 0.5, np.nan])
+
+
+def test_binary_negative_offsets():
+    # Readings of a batch are not always in time order, e.g. after a clock step
+    readings = [Reading(1_000_000, 1, False), Reading(999_000, 0, False)]
+    batch = decode.decode_binary(payload=payload.encode_binary(device_id='dev', seq=0, readings=readings))
+
+    assert batch.timestamps_ns.tolist() == [1_000_000_000_000, 999_000_000_000]
+
+
+def test_binary_header_matches_decoder():
+    assert payload.BINARY_HEADER.format == decode.BINARY_HEADER.format
+    assert payload.BINARY_HEADER.size == struct.calcsize('<BBHIIq')
+    assert payload.SCHEMA_VERSION == decode.SCHEMA_VERSION
+
@@ -0,0 +1,20 @@
+import pytest
+
+from poll_scheduler import PollScheduler
+
+
+def test_backs_off_after_hold_and_resets_on_change():
+    scheduler = PollScheduler(min_interval=0.1, max_interval=1.0, hold=0.5)
+    assert scheduler.update(changed=True, now=0.0) == 0.1
+    assert scheduler.update(changed=False, now=0.4) == 0.1
+
+    assert [scheduler.update(changed=False, now=now) for now in (0.6, 0.8, 1.2, 2.0, 3.0)] == [0.2, 0.4, 0.8, 1.0, 1.0]
+    assert scheduler.update(changed=True, now=4.0) == 0.1
+    assert scheduler.stats() == {'polls': 8, 'fast_polls': 3, 'interval': 0.1}
+
+
+def test_rejects_invalid_intervals():
+    with pytest.raises(ValueError):
+        PollScheduler(min_interval=1.0, max_interval=0.5)
+    with pytest.raises(ValueError):
+        PollScheduler(min_interval=0.1, max_interval=1.0, backoff=1.0)
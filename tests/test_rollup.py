@@ -0,0 +1,64 @@
+import numpy as np
+
+from analytics import DAY_NS, HOUR_NS, MINUTE_NS, SECOND_NS
+from rollup import RollupStore
+
+
+def _readings(count: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    timestamps_ns = np.sort(rng.choice(3 * DAY_NS // SECOND_NS, size=count, replace=False)) * SECOND_NS
+    states = (np.arange(count) % 2).astype(np.uint8)
+    return timestamps_ns, states
+
+
+def _series(store: RollupStore, level: str):
+    return [array.tolist() for array in store.series(level=level, start_ns=0, end_ns=4 * DAY_NS)]
+
+
+def test_late_readings_are_recomputed(tmp_path):
+    timestamps_ns, states = _readings(count=5000)
+    late = np.zeros(len(timestamps_ns), dtype=bool)
+    late[np.random.default_rng(2).choice(len(late), size=100, replace=False)] = True
+    store = RollupStore(path=str(tmp_path / 'late.sqlite'))
+    store.update(timestamps_ns=timestamps_ns[~late], states=states[~late])
+
+    reopened = RollupStore(path=str(tmp_path / 'late.sqlite'))
+    reopened.update(timestamps_ns=timestamps_ns, states=states)
+    assert reopened.update(timestamps_ns=timestamps_ns, states=states) == 0
+
+    full = RollupStore(path=str(tmp_path / 'full.sqlite'))
+    full.update(timestamps_ns=timestamps_ns, states=states)
+    for level in RollupStore.levels:
+        assert _series(reopened, level) == _series(full, level)
+    assert reopened.query(start_ns=0, end_ns=4 * DAY_NS) == full.query(start_ns=0, end_ns=4 * DAY_NS)
+    assert reopened.dropped == 0
+
+
+def test_late_readings_without_history_are_dropped(tmp_path):
+    timestamps_ns, states = _readings(count=100)
+    store = RollupStore(path=str(tmp_path / 'rollup.sqlite'))
+    assert store.update(timestamps_ns=timestamps_ns[:-10], states=states[:-10]) == 44
+
+    # Only the newest readings, two of them older than the last aggregated one
+    newest = np.concatenate([timestamps_ns[-12:-10] - 1, timestamps_ns[-10:]])
+    assert store.update(timestamps_ns=newest, states=np.concatenate([states[-12:-10], states[-10:]])) == 5
+    assert store.dropped == 2
+
+
+def test_query_matches_minute_rollups(tmp_path):
+    timestamps_ns, states = _readings(count=5000, seed=3)
+    store = RollupStore(path=str(tmp_path / 'rollup.sqlite'))
+    half = len(timestamps_ns) // 2
+    rotations = store.update(timestamps_ns=timestamps_ns[:half], states=states[:half])
+    rotations += store.update(timestamps_ns=timestamps_ns, states=states)
+
+    start_ns, end_ns = 3 * HOUR_NS + 17 * MINUTE_NS, 2 * DAY_NS + 5 * HOUR_NS + 42 * MINUTE_NS
+    assert [level for level, _, _ in store._cover(start_ns=start_ns, end_ns=end_ns)] == [
+        'minute', 'hour', 'day', 'hour', 'minute',
+    ]
+    _, minute_rotations, active, max_rpm = store.series(level='minute', start_ns=start_ns, end_ns=end_ns)
+    totals = store.query(start_ns=start_ns, end_ns=end_ns)
+    assert totals['Rotations'] == minute_rotations.sum()
+    assert totals['ActiveTime'] == round(active.sum(), 3)
+    assert totals['MaxRpm'] == round(max_rpm.max(), 1)
+    assert store.query(start_ns=0, end_ns=4 * DAY_NS)['Rotations'] == rotations == len(timestamps_ns) // 2 - 1
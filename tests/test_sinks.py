@@ -0,0 +1,88 @@
+import threading
+
+from sinks import Event, Sink
+
+
+class _RecordingSink(Sink):
+
+    def __init__(self, release: threading.Event = None, **kwargs) -> None:
+        super().__init__(name='recording', **kwargs)
+        self.handled = []
+        self.shut_down = False
+        self._release = release
+
+    def handle(self, event: Event) -> None:
+        if self._release is not None:
+            self._release.wait()
+        self.handled.append(event)
+
+    def shutdown(self) -> None:
+        self.shut_down = True
+
+
+def _reading(timestamp_ns: int, wheel_id: str = None) -> Event:
+    return Event(kind='reading', timestamp_ns=timestamp_ns, pin_state=timestamp_ns % 2, wheel_id=wheel_id)
+
+
+def _handled(sink: _RecordingSink):
+    sink.start()
+    sink.close(timeout=5.0)
+    return [(event.kind, event.timestamp_ns) for event in sink.handled]
+
+
+def test_drop_policies():
+    oldest = _RecordingSink(maxsize=2, overflow='drop_oldest')
+    newest = _RecordingSink(maxsize=2, overflow='drop_newest')
+    for i in range(3):
+        assert oldest.put(_reading(i))
+        assert newest.put(_reading(i)) == (i < 2)
+
+    assert _handled(oldest) == [('reading', 1), ('reading', 2)]
+    assert _handled(newest) == [('reading', 0), ('reading', 1)]
+    assert oldest.stats()['dropped'] == newest.stats()['dropped'] == 1
+    assert oldest.stats()['enqueued'] == 3 and oldest.stats()['handled'] == 2
+
+
+def test_coalesce_replaces_newest_event_of_kind_and_wheel():
+    sink = _RecordingSink(maxsize=3, overflow='coalesce')
+    sink.put(_reading(0, wheel_id='a'))
+    sink.put(Event(kind='metrics', timestamp_ns=1, summary={}))
+    sink.put(_reading(2, wheel_id='a'))
+    sink.put(_reading(3, wheel_id='a'))
+    # No queued event of wheel b, the oldest is dropped
+    sink.put(_reading(4, wheel_id='b'))
+
+    assert _handled(sink) == [('metrics', 1), ('reading', 3), ('reading', 4)]
+    assert sink.stats()['coalesced'] == 1 and sink.stats()['dropped'] == 1
+
+
+def test_block_waits_for_space():
+    release = threading.Event()
+    sink = _RecordingSink(release=release, maxsize=1, overflow='block')
+    sink.start()
+    sink.put(_reading(0))
+    sink.put(_reading(1))
+    producer = threading.Thread(target=sink.put, args=(_reading(2),))
+    producer.start()
+    producer.join(timeout=0.2)
+    assert producer.is_alive()
+
+    release.set()
+    producer.join(timeout=5.0)
+    sink.close(timeout=5.0)
+    assert [event.timestamp_ns for event in sink.handled] == [0, 1, 2]
+    assert sink.stats()['dropped'] == 0
+
+
+def test_close_abandons_events_of_a_stuck_worker():
+    release = threading.Event()
+    sink = _RecordingSink(release=release)
+    sink.start()
+    for i in range(4):
+        sink.put(_reading(i))
+
+    sink.close(timeout=0.2)
+    stats = sink.stats()
+    assert stats['abandoned'] == stats['depth'] == 3
+    assert not sink.shut_down
+    release.set()
@@ -0,0 +1,59 @@
+import pytest
+
+from spool import MessageSpool
+
+
+def test_drain_publishes_in_order_and_keeps_failed(tmp_path):
+    spool = MessageSpool(path=str(tmp_path / 'spool.sqlite'))
+    for i in range(5):
+        spool.put(topic='t', payload=f'm{i}')
+    published = []
+
+    def publish(topic, message):
+        if message == 'm3':
+            return False
+        published.append(message)
+        return True
+
+    assert spool.drain(publish=publish, batch_size=2) == 3
+    assert published == ['m0', 'm1', 'm2']
+    assert spool.depth == 2
+    spool.close()
+
+    # Messages survive a restart
+    spool = MessageSpool(path=str(tmp_path / 'spool.sqlite'))
+    assert spool.depth == 2
+    assert spool.drain(publish=lambda topic, message: published.append(message) or True) == 2
+    assert published[3:] == ['m3', 'm4']
+    spool.close()
+
+
+def test_put_drops_oldest_beyond_limit(tmp_path):
+    spool = MessageSpool(path=str(tmp_path / 'spool.sqlite'), max_messages=3)
+    for i in range(5):
+        spool.put(topic='t', payload=f'm{i}')
+    published = []
+    spool.drain(publish=lambda topic, message: published.append(message) or True)
+
+    assert spool.dropped == 2
+    assert published == ['m2', 'm3', 'm4']
+    spool.close()
+
+
+def test_binary_payloads_and_exceptions(tmp_path):
+    spool = MessageSpool(path=str(tmp_path / 'spool.sqlite'))
+    spool.put(topic='t', payload=b'\x02\x00\xff')
+
+    def publish(topic, message):
+        raise OSError('offline')
+
+    assert spool.drain(publish=publish) == 0
+    published = []
+    spool.drain(publish=lambda topic, message: published.append(message) or True)
+    assert published == [b'\x02\x00\xff']
+    spool.close()
+
+
+def test_invalid_max_messages(tmp_path):
+    with pytest.raises(ValueError):
+        MessageSpool(path=str(tmp_path / 'spool.sqlite'), max_messages=0)
@@ -0,0 +1,66 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from supervisor import Supervisor
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'python')
+
+
+def _run(supervisor: Supervisor, duration: float) -> None:
+    thread = threading.Thread(target=supervisor.run)
+    thread.start()
+    time.sleep(duration)
+    supervisor.stop()
+    thread.join(timeout=10.0)
+    assert not thread.is_alive()
+
+
+def test_restarts_with_doubling_backoff(tmp_path):
+    supervisor = Supervisor(
+        command=['/bin/sh', '-c', 'exit 3'],
+        heartbeat_path=str(tmp_path / 'heartbeat'),
+        log_path=str(tmp_path / 'supervisor.log'),
+        stats_path=str(tmp_path / 'stats.json'),
+        min_backoff=0.05,
+        max_backoff=0.2,
+    )
+    _run(supervisor=supervisor, duration=1.0)
+
+    # Backoffs of 0.05, 0.1, 0.2, 0.2, ... s; without the backoff there were ~10 restarts
+    stats = supervisor.stats()
+    assert 3 <= stats['restarts'] <= 6
+    assert stats['last_reason'] == 'exited with code 3'
+    with open(tmp_path / 'stats.json') as file:
+        assert json.load(file)['restarts'] >= 3
+
+
+def test_hung_process_is_killed_after_kill_timeout(tmp_path):
+    heartbeat_path = str(tmp_path / 'heartbeat')
+    # Beats for 0.1 s, then hangs and ignores SIGINT
+    child = (
+        f'import signal, sys, time; sys.path.insert(0, {SRC!r}); from heartbeat import Heartbeat; '
+        f'signal.signal(signal.SIGINT, signal.SIG_IGN); heartbeat = Heartbeat(path={heartbeat_path!r}, interval=0.02); '
+        'end = time.monotonic() + 0.1\n'
+        'while time.monotonic() < end: heartbeat.beat(); time.sleep(0.005)\n'
+        'time.sleep(60)'
+    )
+    supervisor = Supervisor(
+        command=[sys.executable, '-c', child],
+        heartbeat_path=heartbeat_path,
+        log_path=str(tmp_path / 'supervisor.log'),
+        deadline=0.2,
+        min_backoff=0.05,
+        max_backoff=0.05,
+        stop_timeout=1.0,
+        kill_timeout=0.05,
+    )
+    _run(supervisor=supervisor, duration=2.0)
+
+    # Deadline, kill_timeout and backoff; waiting stop_timeout before the kill took 1.4 s
+    stats = supervisor.stats()
+    assert stats['restarts'] >= 2
+    assert stats['last_reason'].startswith('no heartbeat for')
+    assert 0.0 < stats['last_downtime_s'] < 1.0